@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+from categorical import is_categorical
+
+KEY_SEP = '\x1f'
+
+
+def map_size_to_r_code(size):
+    """Map numeric size to R-code range"""
+    try:
+        size_num = int(size)
+        if size_num == 41:
+            return 'R1'
+        elif size_num in [42, 43, 44]:
+            return 'R2'
+        elif size_num in [45, 46]:
+            return 'R3'
+    except:
+        pass
+    return size  # Return as-is if no mapping
+
+
+def size_r_codes(sizes):
+    """
+    Vectorized map_size_to_r_code. Sizes are factorized so the scalar mapping
+    runs once per distinct value; returns the R-code as a lookup suffix, or
+    None where the mapped value cannot match an Output_forecast size.
+    """
+    codes, uniques = pd.factorize(pd.Series(sizes, dtype=object), use_na_sentinel=True)
+    mapped = []
+    for size in uniques:
+        r_code = map_size_to_r_code(size)
+        mapped.append(r_code if isinstance(r_code, str) and r_code else None)
+    mapped.append(None)  # NaN sizes (code -1)
+    return np.array(mapped, dtype=object)[codes]
+
+
+class AffinityIndex:
+    """
+    (style, size) -> groups ranked by output, stored CSR-style:
+    the ranked group positions of key k are groups[ptr[k]:ptr[k + 1]].
+    """
+
+    def __init__(self, keys, ptr, groups):
+        self.keys = keys          # pd.Index of 'style<SEP>size'
+        self.ptr = ptr            # int64, len(keys) + 1
+        self.groups = groups      # int64 positions into group_names, -1 if unknown
+
+    def __len__(self):
+        return len(self.keys)
+
+    def group_count(self, key_code):
+        if key_code < 0:
+            return 0
+        return int(self.ptr[key_code + 1] - self.ptr[key_code])
+
+    def lookup(self, styles, sizes):
+        """
+        Key code for each demand: exact (style, R-code) match, else
+        (style, ''), else -1. Categorical styles and sizes are looked up once
+        per distinct pair.
+        """
+        if is_categorical(styles) and is_categorical(sizes):
+            n_sizes = len(sizes.cat.categories) + 1
+            # Code -1 (missing) decodes to the NaN appended to each side
+            pairs, inverse = np.unique(
+                styles.cat.codes.to_numpy(dtype=np.int64) * n_sizes + sizes.cat.codes.to_numpy(dtype=np.int64) + 1,
+                return_inverse=True
+            )
+            style_values = np.append(styles.cat.categories.to_numpy(dtype=object), np.nan)[pairs // n_sizes]
+            size_values = np.append(sizes.cat.categories.to_numpy(dtype=object), np.nan)[pairs % n_sizes - 1]
+            return self.lookup(style_values, size_values)[inverse.ravel()]
+
+        styles = pd.Series(styles, dtype=object).astype(str).to_numpy()
+        r_codes = size_r_codes(sizes)
+        has_r_code = pd.notna(r_codes)
+
+        exact = np.full(len(styles), -1, dtype=np.int64)
+        if has_r_code.any():
+            exact_keys = styles[has_r_code] + KEY_SEP + r_codes[has_r_code].astype(str)
+            exact[has_r_code] = self.keys.get_indexer(exact_keys)
+        fallback = self.keys.get_indexer(styles + KEY_SEP)
+        return np.where(exact >= 0, exact, fallback)
+
+
+def _clean_text(df, col):
+    if col not in df.columns:
+        return np.full(len(df), '', dtype=object)
+    return df[col].fillna('').astype(str).str.strip().to_numpy(dtype=object)
+
+
+def build_affinity_index(output_df, group_col, group_names):
+    """
+    Rank the groups that have produced each (style construction, size) by
+    output, highest first; ties keep Output_forecast row order.
+    """
+    styles = _clean_text(output_df, 'style construction')
+    sizes = _clean_text(output_df, 'size')
+    groups = _clean_text(output_df, group_col)
+    if 'output' in output_df.columns:
+        output = pd.to_numeric(output_df['output'], errors='coerce').fillna(-np.inf).to_numpy(dtype=float)
+    else:
+        output = np.zeros(len(output_df))
+
+    keep = (styles != '') & (groups != '')
+    styles, sizes, groups, output = styles[keep], sizes[keep], groups[keep], output[keep]
+
+    key_codes, keys = pd.factorize(styles + KEY_SEP + sizes)
+    order = np.lexsort((np.arange(len(key_codes)), -output, key_codes))
+
+    ptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key_codes, minlength=len(keys)), out=ptr[1:])
+    group_pos = pd.Index(group_names).get_indexer(groups[order]).astype(np.int64)
+    return AffinityIndex(pd.Index(keys), ptr, group_pos)
+
+
+def allocate_affinity(index, key_codes, qty, capacity):
+    """
+    Phase 1 greedy: walk demands in order and fill their ranked groups.
+
+    qty (per demand) and capacity (per group) are float arrays updated in
+    place. Returns the allocations as parallel arrays
+    (demand position, group position, quantity, group capacity at allocation).
+    """
+    ptr = index.ptr.tolist()
+    ranked_groups = index.groups.tolist()
+    remaining = qty.tolist()
+    caps = capacity.tolist()
+
+    demand_idx, group_idx, amounts, group_caps = [], [], [], []
+    for i, k in enumerate(key_codes.tolist()):
+        if k < 0:
+            continue
+        for g in ranked_groups[ptr[k]:ptr[k + 1]]:
+            if g < 0:
+                continue
+            demand_qty = remaining[i]
+            group_cap = caps[g]
+            if demand_qty <= 0 or group_cap <= 0:
+                continue
+
+            amount = min(demand_qty, group_cap)
+            demand_idx.append(i)
+            group_idx.append(g)
+            amounts.append(amount)
+            group_caps.append(group_cap + amount)
+
+            remaining[i] = demand_qty - amount
+            caps[g] = group_cap - amount
+            if remaining[i] <= 0.01:
+                break
+
+    qty[:] = remaining
+    capacity[:] = caps
+    return (
+        np.array(demand_idx, dtype=np.int64),
+        np.array(group_idx, dtype=np.int64),
+        np.array(amounts, dtype=float),
+        np.array(group_caps, dtype=float),
+    )
@@ -0,0 +1,194 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from categorical import take
+
+PHASES = np.array(['Affinity', 'Greedy'])
+AFFINITY, GREEDY = 0, 1
+
+# One compact record per allocated slice; metadata is joined in only once,
+# when the records become allocation_df
+ALLOCATION_DTYPE = np.dtype([
+    ('demand', np.int64),      # position in demand_rows
+    ('group', np.int32),       # position in group_stats
+    ('qty', np.float64),
+    ('group_cap', np.float64), # group capacity when the slice was allocated
+    ('phase', np.uint8),
+])
+
+ALLOCATION_COLUMNS = [
+    'Group', 'Style', 'SELL_STYLE', 'PACK_STYLE', 'SELL_COLOR', 'SELL_SIZE',
+    'SELL_PACK', 'PRIMARY_DC', 'Allocated_Qty', 'HC', 'Eff', 'Total_Group_Cap', 'Phase'
+]
+
+# Phase 2 strategies:
+#   'sweep' - fill groups in order of remaining capacity, one after another
+#             (the original greedy, O(D log D + G log G))
+#   'heap'  - give each demand to the group with the most capacity left,
+#             re-keyed after every slice (O((D + G) log G), spreads load)
+PHASE2_STRATEGIES = ('sweep', 'heap')
+
+
+def make_records(demand, group, qty, group_cap, phase):
+    records = np.empty(len(qty), dtype=ALLOCATION_DTYPE)
+    records['demand'] = demand
+    records['group'] = group
+    records['qty'] = qty
+    records['group_cap'] = group_cap
+    records['phase'] = phase
+    return records
+
+
+def allocate_greedy(qty, capacity, strategy='sweep'):
+    """
+    Phase 2: place the remaining demand on the remaining capacity.
+
+    qty and capacity are float arrays updated in place. Demands are taken
+    largest first. Returns GREEDY allocation records.
+    """
+    if strategy not in PHASE2_STRATEGIES:
+        raise ValueError(f"Unknown Phase 2 strategy '{strategy}'. Use one of: {', '.join(PHASE2_STRATEGIES)}")
+
+    # Stable descending orders, ties keep their original position
+    demand_order = np.flatnonzero(qty > 0.01)
+    demand_order = demand_order[np.argsort(-qty[demand_order], kind='stable')].tolist()
+    group_order = np.flatnonzero(capacity > 0.01)
+    group_order = group_order[np.argsort(-capacity[group_order], kind='stable')].tolist()
+
+    remaining = qty.tolist()
+    caps = capacity.tolist()
+    demand_idx, group_idx, amounts, group_caps = [], [], [], []
+
+    if strategy == 'sweep':
+        d_pos = g_pos = 0
+        while d_pos < len(demand_order) and g_pos < len(group_order):
+            d = demand_order[d_pos]
+            g = group_order[g_pos]
+            demand_qty = remaining[d]
+            group_cap = caps[g]
+
+            if demand_qty <= 0:
+                d_pos += 1
+                continue
+            if group_cap <= 0:
+                g_pos += 1
+                continue
+
+            amount = min(demand_qty, group_cap)
+            demand_idx.append(d)
+            group_idx.append(g)
+            amounts.append(amount)
+            group_caps.append(group_cap + amount)
+
+            remaining[d] = demand_qty - amount
+            caps[g] = group_cap - amount
+            if remaining[d] <= 0.01:
+                d_pos += 1
+            if caps[g] <= 0.01:
+                g_pos += 1
+    else:
+        heap = [(-caps[g], rank, g) for rank, g in enumerate(group_order)]
+        heapq.heapify(heap)
+        for d in demand_order:
+            while remaining[d] > 0.01 and heap:
+                _, rank, g = heapq.heappop(heap)
+                group_cap = caps[g]
+                amount = min(remaining[d], group_cap)
+                demand_idx.append(d)
+                group_idx.append(g)
+                amounts.append(amount)
+                group_caps.append(group_cap + amount)
+
+                remaining[d] -= amount
+                caps[g] = group_cap - amount
+                if caps[g] > 0.01:
+                    heapq.heappush(heap, (-caps[g], rank, g))
+            if not heap:
+                break
+
+    qty[:] = remaining
+    capacity[:] = caps
+    return make_records(demand_idx, group_idx, amounts, group_caps, GREEDY)
+
+
+def allocation_frame(records, demand_rows, group_stats, style_col, group_col, eff_col, metadata_cols):
+    """
+    Materialise allocation records as the allocation_df the rest of the plan
+    uses; Group, Style, the metadata columns and Phase are categoricals.
+    """
+    demand_pos = records['demand']
+    group_pos = records['group']
+
+    columns = {'Group': take(group_stats[group_col], group_pos)}
+    columns['Style'] = take(demand_rows[style_col], demand_pos)
+    for col in metadata_cols:
+        columns[col] = take(demand_rows[col], demand_pos)
+    columns['Allocated_Qty'] = records['qty']
+    columns['HC'] = group_stats['HC'].to_numpy(dtype=float)[group_pos]
+    columns['Eff'] = group_stats[eff_col].to_numpy(dtype=float)[group_pos]
+    columns['Total_Group_Cap'] = records['group_cap']
+    columns['Phase'] = pd.Categorical.from_codes(records['phase'], PHASES)
+
+    return pd.DataFrame(columns)[ALLOCATION_COLUMNS]
+
+
+def allocation_diff(old_df, new_df, keys=('Demand_Id', 'Group', 'Phase', 'Allocated_Qty')):
+    """
+    Allocation rows only in old_df ('removed') and only in new_df ('added'),
+    compared as multisets on keys so identical re-allocations cancel out.
+    """
+    keys = list(keys)
+    old_df = old_df.assign(_n=old_df.groupby(keys, sort=False, observed=True).cumcount())
+    new_df = new_df.assign(_n=new_df.groupby(keys, sort=False, observed=True).cumcount())
+    merged = old_df[keys + ['_n']].merge(new_df[keys + ['_n']], how='outer', indicator=True)
+    removed = merged.loc[merged['_merge'] == 'left_only', keys + ['_n']]
+    added = merged.loc[merged['_merge'] == 'right_only', keys + ['_n']]
+    return (
+        new_df.merge(added, on=keys + ['_n']).drop(columns='_n'),
+        old_df.merge(removed, on=keys + ['_n']).drop(columns='_n'),
+    )
+
+
+class PlanState:
+    """
+    What a finished plan keeps for incremental re-planning.
+
+    Arrays are aligned with demand_rows (demand_ids, demand_keys, active,
+    remaining_qty) or group_stats (remaining_cap). Removed demand stays as an
+    inactive zero-quantity row so record positions remain valid. coalesce
+    holds the columns the plan's tasks are coalesced by (empty: none);
+    engine and time_budget the allocation engine it was planned with.
+    """
+
+    __slots__ = ('demand_rows', 'demand_ids', 'demand_keys', 'active', 'group_stats', 'affinity_index',
+                 'records', 'remaining_qty', 'remaining_cap', 'weeks', 'phase2_strategy', 'coalesce',
+                 'engine', 'time_budget')
+
+    def __init__(self, demand_rows, demand_ids, demand_keys, active, group_stats, affinity_index,
+                 records, remaining_qty, remaining_cap, weeks, phase2_strategy, coalesce=(),
+                 engine='greedy', time_budget=None):
+        self.demand_rows = demand_rows
+        self.demand_ids = demand_ids
+        self.demand_keys = demand_keys
+        self.active = active
+        self.group_stats = group_stats
+        self.affinity_index = affinity_index
+        self.records = records
+        self.remaining_qty = remaining_qty
+        self.remaining_cap = remaining_cap
+        self.weeks = weeks
+        self.phase2_strategy = phase2_strategy
+        self.coalesce = tuple(coalesce)
+        self.engine = engine
+        self.time_budget = time_budget
+
+    @property
+    def nbytes(self):
+        index = self.affinity_index
+        arrays = (self.demand_ids, self.demand_keys, self.active, self.records, self.remaining_qty,
+                  self.remaining_cap, index.ptr, index.groups)
+        return int(self.demand_rows.memory_usage(index=False, deep=True).sum()
+                   + sum(array.nbytes for array in arrays)
+                   + index.keys.memory_usage(deep=True))
@@ -0,0 +1,92 @@
+"""
+Frontend files served from memory.
+
+Each file is read on first request and kept with its gzip (and brotli)
+encodings and a content hash until it changes on disk. Pages reference the
+other assets as name?v=<hash>, so those URLs can be cached for a year;
+pages themselves are revalidated with their ETag on every load.
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+
+from fastapi.responses import Response
+
+from compression import ENCODINGS, compress, negotiate_encoding
+
+PAGE_CACHE_CONTROL = 'no-cache'
+VERSIONED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    __slots__ = ('media_type', 'digest', 'bodies')
+
+    def __init__(self, body, media_type):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        # Encodings that do not make the body smaller are not kept
+        self.bodies = {None: body}
+        for encoding in ENCODINGS:
+            encoded = compress(body, encoding, best=True)
+            if len(encoded) < len(body):
+                self.bodies[encoding] = encoded
+
+    def etag(self, encoding):
+        return f'"{self.digest}.{encoding}"' if encoding else f'"{self.digest}"'
+
+
+class StaticAssets:
+    """
+    files maps URL path -> file name in directory. HTML files are pages: their
+    references to the other files get a ?v= fingerprint.
+    """
+
+    def __init__(self, directory, files):
+        self.directory = directory
+        self.files = dict(files)
+        self._assets = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # A stat per file and request picks up edits (uvicorn --reload only watches .py files)
+        mtimes = [os.stat(os.path.join(self.directory, name)).st_mtime_ns for name in self.files.values()]
+        with self._lock:
+            if self._assets is not None and mtimes == self._mtimes:
+                return self._assets
+            raw = {}
+            for path, name in self.files.items():
+                with open(os.path.join(self.directory, name), 'rb') as fh:
+                    raw[path] = fh.read()
+            assets = {}
+            pages = [path for path, name in self.files.items() if name.endswith('.html')]
+            for path, body in raw.items():
+                if path not in pages:
+                    assets[path] = Asset(body, mimetypes.guess_type(self.files[path])[0] or 'application/octet-stream')
+            for path in pages:
+                body = raw[path]
+                for other, asset in assets.items():
+                    name = self.files[other].encode()
+                    body = body.replace(b'"%s"' % name, b'"%s?v=%s"' % (name, asset.digest.encode()))
+                assets[path] = Asset(body, 'text/html; charset=utf-8')
+            self._assets, self._mtimes = assets, mtimes
+            return assets
+
+    def response(self, path, version=None, accept_encoding=None, if_none_match=None):
+        """The asset at path, in the best accepted encoding; 304 when if_none_match has its ETag"""
+        asset = self._load()[path]
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding not in asset.bodies:
+            encoding = None
+        versioned = version is not None and version == asset.digest
+        headers = {
+            'ETag': asset.etag(encoding),
+            'Cache-Control': VERSIONED_CACHE_CONTROL if versioned else PAGE_CACHE_CONTROL,
+            'Vary': 'Accept-Encoding',
+        }
+        if if_none_match and headers['ETag'] in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(content=asset.bodies[encoding], media_type=asset.media_type, headers=headers)
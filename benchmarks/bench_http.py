@@ -0,0 +1,357 @@
+"""
+HTTP load test: boot the app under uvicorn and drive the static routes,
+/api/template and /api/generate-plan at several concurrency levels.
+
+    python benchmarks/bench_http.py --workers 2 --concurrency 1 8 32 --demand-rows 1000 10000 --out http.json
+    python benchmarks/bench_http.py --workers 2 --concurrency 1 8 32 --demand-rows 1000 10000 --baseline http.json
+
+Every case (route x concurrency, and workbook size for uploads) sends a fixed
+number of requests from that many client threads over keep-alive
+connections, and reports p50/p95/p99 latency, requests/sec and the RSS of
+every uvicorn worker (with its plan processes) after the case. Rejected
+requests (429 backpressure) are counted apart from errors. The plan and
+response caches are switched off so every upload is planned and encoded,
+unless --cached is given.
+
+With --baseline the run exits non-zero when a case's p95 latency or a
+worker's RSS grew, or its requests/sec fell, by more than --tolerance (a
+fraction).
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+from bench_planner import CACHE_DIR, _git_rev, case_name  # noqa: E402
+from workload import cached_workbook  # noqa: E402
+
+STATIC_PATHS = ['/', '/style.css', '/script.js']
+BOUNDARY = 'planbenchboundary'
+OK_STATUSES = (200, 304)
+REJECTED_STATUS = 429
+
+
+# --- Server ---
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, cached, startup_timeout=120):
+    port = _free_port()
+    env = dict(os.environ, PLAN_DEBUG='0')
+    if not cached:
+        env.update(PLAN_CACHE_MAX_ENTRIES='0', RESPONSE_CACHE_MAX_ENTRIES='0')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+        try:
+            status, _ = request_once(port, ('GET', '/healthz', None, {}))
+            if status == 200:
+                return process, port
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not answer /healthz within {startup_timeout}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _children():
+    """pid -> child pids, from /proc (Linux)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as fh:
+                # comm may contain spaces; the ppid follows the closing parenthesis
+                ppid = int(fh.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def _memory(pid):
+    """(VmRSS, VmHWM) of a process in bytes"""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/status') as fh:
+            for line in fh:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, amount = line.split(':')
+                    values[name] = int(amount.split()[0]) * 1024
+    except OSError:
+        pass
+    return values.get('VmRSS', 0), values.get('VmHWM', 0)
+
+
+def worker_memory(server_pid):
+    """RSS of each uvicorn worker and, separately, of the plan processes below it"""
+    if not os.path.isdir('/proc'):
+        return []
+    children = _children()
+    # With --workers > 1 the server process supervises the workers; with 1 it serves itself
+    workers = [pid for pid in children.get(server_pid, []) if 'resource_tracker' not in _cmdline(pid)] or [server_pid]
+    report = []
+    for pid in sorted(workers):
+        rss, hwm = _memory(pid)
+        descendants, stack = [], list(children.get(pid, []))
+        while stack:
+            child = stack.pop()
+            descendants.append(child)
+            stack.extend(children.get(child, []))
+        report.append({
+            'pid': pid,
+            'rss_bytes': rss,
+            'peak_rss_bytes': hwm,
+            'plan_processes': len(descendants),
+            'plan_processes_rss_bytes': sum(_memory(child)[0] for child in descendants),
+        })
+    return report
+
+
+def _cmdline(pid):
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as fh:
+            return fh.read().replace(b'\0', b' ').decode(errors='replace')
+    except OSError:
+        return ''
+
+
+# --- Client ---
+
+def multipart(filename, content):
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n').encode()
+    body = head + content + f'\r\n--{BOUNDARY}--\r\n'.encode()
+    return body, {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+
+
+def connect(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    conn.connect()
+    # Without this, delayed ACKs add ~40ms to every keep-alive request
+    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return conn
+
+
+def request_once(port, spec, connection=None):
+    method, path, body, headers = spec
+    conn = connection or connect(port)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status, conn
+    finally:
+        if connection is None:
+            conn.close()
+
+
+def drive(port, specs, total, concurrency):
+    """Send total requests, cycling through specs, from concurrency threads; (latencies, statuses, seconds)"""
+    tickets = itertools.count()
+    lock = threading.Lock()
+    latencies = np.zeros(total)
+    statuses = np.zeros(total, dtype=np.int64)
+
+    def client():
+        conn = None
+        while True:
+            with lock:
+                i = next(tickets)
+            if i >= total:
+                break
+            started = time.perf_counter()
+            try:
+                statuses[i], conn = request_once(port, specs[i % len(specs)], conn or connect(port))
+                if statuses[i] == REJECTED_STATUS:
+                    # 429s are sent with Connection: close
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                statuses[i] = -1
+                if conn is not None:
+                    conn.close()
+                conn = None
+            latencies[i] = time.perf_counter() - started
+        if conn is not None:
+            conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def summarize(name, route, concurrency, latencies, statuses, seconds):
+    ok = np.isin(statuses, OK_STATUSES)
+    ms = latencies[ok] * 1000
+    percentile = (lambda q: float(np.percentile(ms, q))) if len(ms) else (lambda q: None)
+    return {
+        'name': name,
+        'route': route,
+        'concurrency': concurrency,
+        'requests': len(statuses),
+        'ok': int(ok.sum()),
+        'rejected': int((statuses == REJECTED_STATUS).sum()),
+        'errors': int((~ok & (statuses != REJECTED_STATUS)).sum()),
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'mean_ms': float(ms.mean()) if len(ms) else None,
+        'rps': float(ok.sum() / seconds) if seconds > 0 else 0.0,
+        'seconds': seconds,
+    }
+
+
+# --- Report ---
+
+def _mib(size):
+    return f"{size / 2 ** 20:.1f}MiB"
+
+
+def _ms(value):
+    return '-' if value is None else f"{value:.1f}ms"
+
+
+def compare(results, baseline, tolerance):
+    """Print a per-case comparison; return the names of cases that regressed"""
+    previous = {case['name']: case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        old = previous.get(case['name'])
+        if old is None:
+            print(f"  {case['name']}: no baseline")
+            continue
+        problems = []
+        if old['p95_ms'] and case['p95_ms'] and case['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            problems.append('p95')
+        if old['rps'] and case['rps'] < old['rps'] / (1 + tolerance):
+            problems.append('rps')
+        old_rss = max((w['rss_bytes'] for w in old['workers']), default=0)
+        new_rss = max((w['rss_bytes'] for w in case['workers']), default=0)
+        if old_rss and new_rss > old_rss * (1 + tolerance):
+            problems.append('rss')
+        if problems:
+            regressions.append(case['name'])
+        print(f"  {case['name']}: p95 {_ms(old['p95_ms'])} -> {_ms(case['p95_ms'])}, "
+              f"{old['rps']:.1f} -> {case['rps']:.1f} req/s, worker RSS {_mib(old_rss)} -> {_mib(new_rss)}"
+              + (f"  REGRESSION ({', '.join(problems)})" if problems else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the HTTP API under uvicorn")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=500, help="requests per static/template case")
+    parser.add_argument('--plan-requests', type=int, default=20, help="requests per generate-plan case")
+    parser.add_argument('--routes', nargs='+', default=['static', 'template', 'generate-plan'],
+                        choices=['static', 'template', 'generate-plan'])
+    parser.add_argument('--demand-rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--grouplines', type=int, default=50)
+    parser.add_argument('--weeks', type=int, default=26)
+    parser.add_argument('--overlap', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cached', action='store_true', help="keep the plan and response caches on")
+    parser.add_argument('--out', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed p95 / RSS growth and req/s drop against the baseline (fraction)")
+    args = parser.parse_args()
+
+    accept = {'Accept-Encoding': 'gzip, br'}
+    cases = []
+    if 'static' in args.routes:
+        cases.append(('static', 'static', [('GET', path, None, accept) for path in STATIC_PATHS], args.requests))
+    if 'template' in args.routes:
+        cases.append(('template', 'template', [('GET', '/api/template', None, {})], args.requests))
+    if 'generate-plan' in args.routes:
+        for rows in args.demand_rows:
+            params = {'demand_rows': rows, 'grouplines': args.grouplines, 'weeks': args.weeks,
+                      'overlap': args.overlap, 'seed': args.seed}
+            body, headers = multipart('bench.xlsx', cached_workbook(CACHE_DIR, **params))
+            spec = ('POST', '/api/generate-plan', body, {**headers, **accept})
+            cases.append((f"generate-plan {case_name(params)}", 'generate-plan', [spec], args.plan_requests))
+
+    process, port = start_server(args.workers, args.cached)
+    results = []
+    try:
+        for (label, route, specs, count), concurrency in itertools.product(cases, args.concurrency):
+            # An untimed round per case warms imports, plan pools and template/asset memos in every worker
+            drive(port, specs, len(specs) * args.workers * 2, args.workers)
+            latencies, statuses, seconds = drive(port, specs, max(count, concurrency), concurrency)
+            case = summarize(f"{label} c={concurrency}", route, concurrency, latencies, statuses, seconds)
+            case['workers'] = worker_memory(process.pid)
+            results.append(case)
+            rss = ' '.join(_mib(w['rss_bytes'] + w['plan_processes_rss_bytes']) for w in case['workers'])
+            print(f"{case['name']}: p50 {_ms(case['p50_ms'])} p95 {_ms(case['p95_ms'])} p99 {_ms(case['p99_ms'])}, "
+                  f"{case['rps']:.1f} req/s, {case['ok']} ok / {case['rejected']} rejected / {case['errors']} errors, "
+                  f"worker RSS (with plan processes) {rss}")
+    finally:
+        stop_server(process)
+
+    report = {
+        'meta': {
+            'git_rev': _git_rev(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+            'cached': args.cached,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        print(f"Against baseline {baseline['meta'].get('git_rev')} ({baseline['meta'].get('timestamp')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Memory benchmark: peak usage of logic.run_plan on synthetic workbooks, each
+case in a fresh process so peak RSS belongs to that case alone.
+
+    python benchmarks/bench_memory.py --demand-rows 10000 100000 --weeks 26 52 --out memory.json
+    python benchmarks/bench_memory.py --demand-rows 10000 100000 --weeks 26 52 --baseline memory.json
+
+Per case it reports the process' peak RSS, the peak Python allocation of
+every stage (tracemalloc), and the size of the result tables as held
+(categorical string columns) next to their size with every string column
+decoded to plain Python strings, the representation before categoricals.
+With --baseline the run exits non-zero when any case's peak RSS grew by
+more than --tolerance (a fraction).
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from bench_planner import CACHE_DIR, _git_rev, case_name  # noqa: E402
+from workload import cached_workbook  # noqa: E402
+
+
+def _table_bytes(df, decoded=False):
+    if decoded:
+        df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def _measure(params, phase2_strategy):
+    # Runs in its own process
+    import logic
+    from metrics import _max_rss_bytes
+
+    logic.DEBUG = False
+    logic.TRACE_MEMORY = True
+    data = cached_workbook(CACHE_DIR, **params)
+    rss_before = _max_rss_bytes()
+    result = logic.run_plan(data, phase2_strategy=phase2_strategy)
+    return {
+        'name': case_name(params),
+        'params': params,
+        'max_rss_bytes': _max_rss_bytes(),
+        'rss_before_plan_bytes': rss_before,
+        'stage_peak_bytes': {r['stage']: r['peak_bytes'] for r in result['timings']},
+        'tables': {
+            table: {
+                'rows': len(result[table]),
+                'bytes': _table_bytes(result[table]),
+                'decoded_bytes': _table_bytes(result[table], decoded=True),
+            }
+            for table in logic.TABLES
+        },
+        'state_bytes': result['state'].nbytes,
+    }
+
+
+def run_case(params, phase2_strategy):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(_measure, params, phase2_strategy).result()
+
+
+def _mib(size):
+    return f"{size / 2 ** 20:.1f}MiB"
+
+
+def compare(results, baseline, tolerance):
+    """Print a per-case comparison; return the names of cases whose peak RSS grew"""
+    previous = {case['name']: case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        old = previous.get(case['name'])
+        if old is None:
+            print(f"  {case['name']}: no baseline")
+            continue
+        ratio = case['max_rss_bytes'] / old['max_rss_bytes'] if old['max_rss_bytes'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(case['name'])
+            flag = '  REGRESSION'
+        print(f"  {case['name']}: peak RSS {_mib(old['max_rss_bytes'])} -> {_mib(case['max_rss_bytes'])} ({ratio:.2f}x){flag}")
+        for stage, peak in case['stage_peak_bytes'].items():
+            before = old['stage_peak_bytes'].get(stage)
+            if before:
+                print(f"      {stage:<15} {_mib(before)} -> {_mib(peak)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the planner's peak memory on synthetic workbooks")
+    parser.add_argument('--demand-rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--grouplines', type=int, nargs='+', default=[50])
+    parser.add_argument('--weeks', type=int, nargs='+', default=[26])
+    parser.add_argument('--overlap', type=float, nargs='+', default=[0.8])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--phase2-strategy', default='sweep')
+    parser.add_argument('--out', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="allowed peak RSS growth against the baseline (fraction)")
+    args = parser.parse_args()
+
+    results = []
+    for rows, groups, weeks, overlap in itertools.product(args.demand_rows, args.grouplines, args.weeks, args.overlap):
+        params = {'demand_rows': rows, 'grouplines': groups, 'weeks': weeks, 'overlap': overlap, 'seed': args.seed}
+        case = run_case(params, args.phase2_strategy)
+        results.append(case)
+        peak_stage = max(case['stage_peak_bytes'], key=case['stage_peak_bytes'].get)
+        tables = '  '.join(f"{table}={_mib(info['bytes'])} (strings {_mib(info['decoded_bytes'])})"
+                           for table, info in case['tables'].items())
+        print(f"{case['name']}: peak RSS {_mib(case['max_rss_bytes'])}, "
+              f"peak stage {peak_stage} {_mib(case['stage_peak_bytes'][peak_stage])}  [{tables}]")
+
+    report = {
+        'meta': {
+            'git_rev': _git_rev(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'phase2_strategy': args.phase2_strategy,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        print(f"Against baseline {baseline['meta'].get('git_rev')} ({baseline['meta'].get('timestamp')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} case(s) use more memory than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Planner benchmarks: run logic.run_plan on synthetic workbooks and record
+per-stage and end-to-end wall time as JSON.
+
+    python benchmarks/bench_planner.py --demand-rows 1000 10000 100000 --out results.json
+    python benchmarks/bench_planner.py --baseline results.json --tolerance 0.2
+
+With --baseline the run exits non-zero when any case's end-to-end median is
+slower than the baseline by more than --tolerance (a fraction).
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+import logic  # noqa: E402
+from workload import cached_workbook  # noqa: E402
+
+CACHE_DIR = os.path.join(HERE, '.cache')
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_name(params):
+    return "rows={demand_rows} groups={grouplines} weeks={weeks} overlap={overlap}".format(**params)
+
+
+def run_case(params, repeats, phase2_strategy):
+    data = cached_workbook(CACHE_DIR, **params)
+    runs = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = logic.run_plan(data, phase2_strategy=phase2_strategy)
+        total = time.perf_counter() - started
+        runs.append((total, result['timings']))
+
+    stages = {}
+    for _, timings in runs:
+        for record in timings:
+            stages.setdefault(record['stage'], []).append(record['seconds'])
+    last = runs[-1][1]
+    return {
+        'name': case_name(params),
+        'params': params,
+        'workbook_bytes': len(data),
+        'total_seconds': statistics.median(total for total, _ in runs),
+        'runs': [total for total, _ in runs],
+        'stages': {stage: statistics.median(seconds) for stage, seconds in stages.items()},
+        'rows': {r['stage']: r['rows'] for r in last},
+        'max_rss_bytes': max(r['max_rss_bytes'] for r in last),
+        'kpi': result['kpi'],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print a per-case comparison; return the names of cases that regressed"""
+    previous = {case['name']: case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        old = previous.get(case['name'])
+        if old is None:
+            print(f"  {case['name']}: no baseline")
+            continue
+        ratio = case['total_seconds'] / old['total_seconds'] if old['total_seconds'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(case['name'])
+            flag = '  REGRESSION'
+        print(f"  {case['name']}: {old['total_seconds']:.3f}s -> {case['total_seconds']:.3f}s ({ratio:.2f}x){flag}")
+        for stage, seconds in case['stages'].items():
+            before = old['stages'].get(stage)
+            if before:
+                print(f"      {stage:<15} {before:.4f}s -> {seconds:.4f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the planner on synthetic workbooks")
+    parser.add_argument('--demand-rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--grouplines', type=int, nargs='+', default=[50])
+    parser.add_argument('--weeks', type=int, nargs='+', default=[8])
+    parser.add_argument('--overlap', type=float, nargs='+', default=[0.8])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--phase2-strategy', default='sweep')
+    parser.add_argument('--out', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed end-to-end slowdown against the baseline (fraction)")
+    args = parser.parse_args()
+
+    logic.DEBUG = False
+    results = []
+    for rows, groups, weeks, overlap in itertools.product(args.demand_rows, args.grouplines, args.weeks, args.overlap):
+        params = {'demand_rows': rows, 'grouplines': groups, 'weeks': weeks, 'overlap': overlap, 'seed': args.seed}
+        case = run_case(params, args.repeats, args.phase2_strategy)
+        results.append(case)
+        stages = '  '.join(f"{stage}={seconds:.3f}" for stage, seconds in case['stages'].items())
+        print(f"{case['name']}: {case['total_seconds']:.3f}s  [{stages}]")
+
+    report = {
+        'meta': {
+            'git_rev': _git_rev(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats,
+            'phase2_strategy': args.phase2_strategy,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        print(f"Against baseline {baseline['meta'].get('git_rev')} ({baseline['meta'].get('timestamp')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
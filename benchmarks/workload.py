@@ -0,0 +1,151 @@
+"""
+Synthetic workbooks for benchmarking the planner.
+
+The sheets follow the upload template (logic.generate_template_file); the
+Output_forecast style column is 'style construction', the name the planner's
+affinity stage reads.
+"""
+import argparse
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+import xlsxwriter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logic  # noqa: E402
+
+DEMAND_HEADER = ['PLANT', 'SELL_STYLE', 'PACK_STYLE', 'SELL_COLOR', 'SELL_SIZE', 'QTY', 'DC',
+                 'SEW_WEEK', 'CUT_WEEK', logic.STYLE_COL]
+OUTPUT_HEADER = ['year', 'month', 'week', 'groupline', 'shift', 'style construction', 'size', 'cd_btn',
+                 'eff', 'HC', 'output', 'rate_cbc']
+STYLE_HEADER = ['SELLING_GARMENT', 'STYLE_DETAIL']
+
+COLORS = ['RED', 'BLUE', 'GREEN', 'YELLOW', 'BLACK', 'WHITE', 'GREY', 'NAVY']
+DEMAND_SIZES = [41, 42, 43, 44, 45, 46, 'S', 'M', 'L', 'XL']
+R_CODES = ['R1', 'R2', 'R3']
+
+
+def _write_sheet(workbook, name, header, columns):
+    worksheet = workbook.add_worksheet(name)
+    worksheet.write_row(0, 0, header)
+    for row_num, row in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row_num, 0, row)
+
+
+def generate_workbook(demand_rows=10000, grouplines=50, weeks=8, styles=None, plants=1,
+                      overlap=0.8, load=0.9, output_rows_per_group=4, seed=0):
+    """
+    Build a planner workbook and return its bytes.
+
+    overlap is the share of demand styles that some groupline has produced
+    (i.e. that Phase 1 can match); the rest only reach Phase 2. load is total
+    demand over total horizon capacity.
+    """
+    rng = np.random.default_rng(seed)
+    styles = styles or max(10, grouplines // 2)
+    style_names = np.array([f"Construction {i:04d}" for i in range(styles)], dtype=object)
+    sell_styles = np.array([f"ST{i:05d}" for i in range(max(styles * 4, 1))], dtype=object)
+    start_week = 202501
+    week_codes = start_week + np.arange(weeks)
+
+    group_eff = rng.uniform(70, 160, grouplines).round(1)
+    group_hc = rng.integers(30, 100, grouplines)
+    base_rate = logic.BASE_OUTPUT_100_EFF / 38 / logic.SHIFT_HOURS
+    capacity = (group_hc * logic.SHIFT_HOURS * len(logic.SHIFTS_PER_WEEK) * weeks * base_rate * group_eff / 100).sum()
+
+    # Demand: skewed quantities, a few styles dominate like real order books
+    qty = rng.lognormal(7, 0.8, demand_rows)
+    qty = np.maximum(1, (qty * load * capacity / qty.sum()).round()).astype(np.int64)
+    style_idx = np.minimum(rng.zipf(1.3, demand_rows) - 1, styles - 1)
+    sell_idx = style_idx * 4 + rng.integers(0, 4, demand_rows)
+    sizes = np.array(DEMAND_SIZES, dtype=object)[rng.integers(0, len(DEMAND_SIZES), demand_rows)]
+    sew_weeks = week_codes[rng.integers(0, weeks, demand_rows)]
+    demand = [
+        np.char.mod('%d', 90 + rng.integers(0, plants, demand_rows)).astype(object),
+        sell_styles[sell_idx],
+        np.char.add(sell_styles[sell_idx].astype(str), '_001').astype(object),
+        np.array(COLORS, dtype=object)[rng.integers(0, len(COLORS), demand_rows)],
+        sizes,
+        qty,
+        np.char.add('DC', (1 + rng.integers(0, 3, demand_rows)).astype(str)).astype(object),
+        sew_weeks,
+        sew_weeks - 1,
+        style_names[style_idx],
+    ]
+
+    # Output_forecast: each groupline has produced a few styles; only the
+    # first `overlap` share of styles can appear here
+    known_styles = max(1, int(round(styles * overlap))) if overlap > 0 else 0
+    groups = np.array([f"{10 + 8 * i:03d}-{17 + 8 * i:03d}" for i in range(grouplines)], dtype=object)
+    n_output = grouplines * output_rows_per_group
+    group_col = np.repeat(groups, output_rows_per_group)
+    if known_styles:
+        output_styles = style_names[rng.integers(0, known_styles, n_output)]
+    else:
+        output_styles = np.array([f"Unmatched {i:04d}" for i in rng.integers(0, styles, n_output)], dtype=object)
+    output = [
+        np.full(n_output, 2025),
+        np.full(n_output, 'Jan', dtype=object),
+        rng.integers(1, 53, n_output),
+        group_col,
+        np.full(n_output, 'B', dtype=object),
+        output_styles,
+        np.array(R_CODES, dtype=object)[rng.integers(0, len(R_CODES), n_output)],
+        np.full(n_output, 'Y', dtype=object),
+        np.repeat(group_eff, output_rows_per_group),
+        np.repeat(group_hc, output_rows_per_group),
+        rng.integers(500, 3000, n_output),
+        rng.uniform(97, 99, n_output).round(1),
+    ]
+
+    output_header = OUTPUT_HEADER
+    if plants > 1:
+        # Grouplines split round-robin over the plants, for sharded planning
+        output_header = OUTPUT_HEADER + ['PLANT']
+        output.append(np.char.mod('%d', 90 + np.arange(n_output) // output_rows_per_group % plants).astype(object))
+
+    style_sheet = [np.char.add(sell_styles.astype(str), '_001').astype(object),
+                   style_names[np.arange(len(sell_styles)) // 4]]
+
+    buf = BytesIO()
+    workbook = xlsxwriter.Workbook(buf, {'constant_memory': True})
+    _write_sheet(workbook, 'demand_forecast', DEMAND_HEADER, [c.tolist() for c in demand])
+    _write_sheet(workbook, 'Output_forecast', output_header, [c.tolist() for c in output])
+    _write_sheet(workbook, 'style_construction', STYLE_HEADER, [c.tolist() for c in style_sheet])
+    workbook.close()
+    return buf.getvalue()
+
+
+def cached_workbook(cache_dir, **params):
+    """generate_workbook, memoised on disk by its parameters"""
+    name = "wb_" + "_".join(f"{k}-{params[k]}" for k in sorted(params)) + ".xlsx"
+    path = os.path.join(cache_dir, name)
+    if os.path.exists(path):
+        with open(path, 'rb') as fh:
+            return fh.read()
+    data = generate_workbook(**params)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic planner workbook")
+    parser.add_argument('output')
+    parser.add_argument('--demand-rows', type=int, default=10000)
+    parser.add_argument('--grouplines', type=int, default=50)
+    parser.add_argument('--weeks', type=int, default=8)
+    parser.add_argument('--styles', type=int, default=None)
+    parser.add_argument('--plants', type=int, default=1)
+    parser.add_argument('--overlap', type=float, default=0.8)
+    parser.add_argument('--load', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    data = generate_workbook(args.demand_rows, args.grouplines, args.weeks, args.styles,
+                             args.plants, args.overlap, args.load, seed=args.seed)
+    with open(args.output, 'wb') as fh:
+        fh.write(data)
+    print(f"Wrote {args.output} ({len(data) / 1e6:.1f} MB)")
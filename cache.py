@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def plan_key(file_content, *params):
+    """Content address of an upload: sha256 of the bytes plus the planning parameters"""
+    digest = hashlib.sha256()
+    digest.update(file_content)
+    for param in params:
+        digest.update(b'\0' + repr(param).encode())
+    return digest.hexdigest()
+
+
+class PlanCache:
+    """
+    LRU cache of plan results bounded by entry count and total size.
+
+    Values are stored with the size the caller reports for them. When a
+    directory is given, entries are also pickled to disk so they survive a
+    restart; the disk copy is bounded separately by max_disk_bytes and evicted
+    oldest-first. Failing to write an entry to disk only logs a warning.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=256 * 1024 * 1024, directory=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, *entry)
+        return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            self._insert(key, value, size)
+        self._store(key, value, size)
+
+    def _insert(self, key, value, size):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    # --- Disk persistence ---
+
+    def _disk_path(self, key):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _load(self, key):
+        path = self._disk_path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as fh:
+                entry = pickle.load(fh)
+            os.utime(path)
+            return entry
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _store(self, key, value, size):
+        path = self._disk_path(key)
+        if path is None:
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as fh:
+                pickle.dump((value, size), fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        except OSError as e:
+            # Disk full or unwritable: the entry stays cached in memory only
+            logger.warning("Plan cache: could not write %s to disk: %s", key, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _trim_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
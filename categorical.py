@@ -0,0 +1,70 @@
+"""
+String columns held as pandas categoricals.
+
+Demand metadata repeats a handful of styles, sizes, DCs and grouplines (and a
+lot of '-') across every allocation and every shift of the detailed plan. As
+categoricals each distinct value is stored once and rows hold small integer
+codes; the strings come back only when a table is serialised.
+"""
+import numpy as np
+import pandas as pd
+
+
+def is_categorical(values):
+    return isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype)
+
+
+def categorize(series):
+    """series as a categorical (a no-op when it already is one)"""
+    return series if is_categorical(series) else series.astype('category')
+
+
+def map_categories(series, func):
+    """
+    Apply an element-wise func to the distinct values only; func receives
+    them as an object Index, missing value last. Values func maps together
+    become one category.
+    """
+    series = categorize(series)
+    values = func(pd.Index([*series.cat.categories, np.nan], dtype=object))
+    codes, uniques = pd.factorize(values)
+    # Code -1 (missing) picks the missing value's slot at the end
+    return pd.Series(pd.Categorical.from_codes(codes[series.cat.codes.to_numpy()], uniques),
+                     index=series.index, name=series.name)
+
+
+def sort_categories(series):
+    """Categories in value order, so codes sort like the values (groupby, factorize(sort=True))"""
+    categories = series.cat.categories
+    if categories.is_monotonic_increasing:
+        return series
+    return series.cat.reorder_categories(categories.sort_values())
+
+
+def take(series, positions, fill=None):
+    """
+    series' values at positions, as a Categorical. With fill, position -1
+    takes the fill value instead.
+    """
+    series = categorize(series)
+    categories = series.cat.categories
+    codes = series.cat.codes.to_numpy()
+    if fill is not None:
+        if fill not in categories:
+            categories = categories.append(pd.Index([fill], dtype=object))
+        codes = np.append(codes, categories.get_loc(fill))
+    return pd.Categorical.from_codes(codes[positions], categories)
+
+
+def concat(frames, **kwargs):
+    """pd.concat that keeps columns categorical in every frame categorical, over the union of their categories"""
+    frames = list(frames)
+    if len(frames) > 1:
+        for col in frames[0].columns:
+            if not all(col in frame.columns and is_categorical(frame[col]) for frame in frames):
+                continue
+            categories = frames[0][col].cat.categories
+            for frame in frames[1:]:
+                categories = categories.append(frame[col].cat.categories.difference(categories, sort=False))
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, **kwargs)
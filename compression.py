@@ -0,0 +1,40 @@
+"""Content-Encoding negotiation and compression for plan bodies and static assets"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding=None):
+    """Content-Encoding to apply: 'br' when brotli is installed and accepted, else 'gzip', else None"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding, best=False):
+    """body in the given encoding; best trades speed for size (bodies compressed once and kept)"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else 5)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output (and so its ETag) stable
+        return gzip.compress(body, compresslevel=9 if best else 5, mtime=0)
+    return body
@@ -0,0 +1,229 @@
+"""
+Parsed workbooks staged on local disk.
+
+A dataset is a workbook parsed once: each sheet is stored as an uncompressed
+Feather (Arrow IPC) file in a directory named after the workbook's content
+hash. Plans of a dataset memory-map those files instead of parsing the XLSX
+again; only the columns a plan reads are converted, and numeric columns
+without missing values are used in place.
+
+The registry is the directory itself, so every server process sees the same
+datasets. It is bounded by total size, least recently used first.
+"""
+import importlib.util
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from categorical import categorize, is_categorical
+
+ARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+INFO_FILE = 'dataset.json'
+# Schema metadata key listing the columns stored as category positions (see _encode)
+MIXED_KEY = b'plan.mixed'
+# What pandas.api.types.infer_dtype reports for object columns Arrow stores as they are
+ARROW_KINDS = {'string', 'integer', 'floating', 'boolean', 'empty', 'bytes', 'decimal', 'datetime', 'date', 'time'}
+_ID = re.compile(r'[0-9a-f]{64}')
+
+
+def _sheet_file(path, sheet):
+    return os.path.join(path, f"{sheet}.feather")
+
+
+def _encode(df):
+    """
+    df as an Arrow table. Object columns mixing types (sizes like 10 and 'L')
+    have no Arrow type: they are stored as the positions of their distinct
+    values, which travel as JSON in the schema metadata. Values JSON cannot
+    represent come back as text.
+    """
+    import pyarrow as pa
+
+    frame = {}
+    mixed = {}
+    for name in df.columns:
+        series = df[name]
+        values = series.cat.categories if is_categorical(series) else series.dropna()
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) not in ARROW_KINDS:
+            categories = categorize(series).cat
+            mixed[str(name)] = {'categorical': is_categorical(series), 'values': list(categories.categories)}
+            series = pd.Series(pd.Categorical.from_codes(
+                categories.codes, [str(i) for i in range(len(categories.categories))]), name=name)
+        frame[str(name)] = series.reset_index(drop=True)
+    table = pa.Table.from_pandas(pd.DataFrame(frame), preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), MIXED_KEY: json.dumps(mixed, default=str).encode()}
+    return table.replace_schema_metadata(metadata)
+
+
+def _decode(table):
+    """The DataFrame _encode stored, without copying numeric columns that have no missing values"""
+    df = table.to_pandas(split_blocks=True)
+    mixed = json.loads((table.schema.metadata or {}).get(MIXED_KEY, b'{}'))
+    for name, spec in mixed.items():
+        if name not in df.columns:
+            continue
+        positions = df[name].cat.categories.astype(int)
+        values = pd.Index(spec['values'], dtype=object)[positions]
+        column = pd.Categorical.from_codes(df[name].cat.codes, values)
+        df[name] = column if spec['categorical'] else pd.Series(column, index=df.index).astype(object)
+    return df
+
+
+def write_dataset(directory, dataset_id, frames, filename=None):
+    """
+    Stage frames (sheet name -> DataFrame) as dataset dataset_id under
+    directory and return its info. Staging the same id again keeps the
+    existing files.
+    """
+    from pyarrow import feather
+
+    path = os.path.join(directory, dataset_id)
+    if os.path.exists(path):
+        return _read_info(path)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+    try:
+        sheets = {}
+        for sheet, df in frames.items():
+            feather.write_feather(_encode(df), _sheet_file(staging, sheet), compression='uncompressed')
+            sheets[sheet] = {'rows': len(df), 'columns': [str(name) for name in df.columns]}
+        info = {
+            'id': dataset_id,
+            'filename': filename,
+            'created': time.time(),
+            'bytes': sum(os.path.getsize(_sheet_file(staging, sheet)) for sheet in sheets),
+            'sheets': sheets,
+        }
+        with open(os.path.join(staging, INFO_FILE), 'w') as fh:
+            json.dump(info, fh)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Another process staged the same workbook first
+            if not os.path.exists(path):
+                raise
+            shutil.rmtree(staging, ignore_errors=True)
+            return _read_info(path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return _read_info(path)
+
+
+def _read_info(path):
+    info_path = os.path.join(path, INFO_FILE)
+    with open(info_path) as fh:
+        info = json.load(fh)
+    info['last_used'] = os.stat(info_path).st_mtime
+    return info
+
+
+class Dataset:
+    """A staged dataset's location; it pickles as a path, so plan workers map the files themselves"""
+
+    __slots__ = ('id', 'path')
+
+    def __init__(self, dataset_id, path):
+        self.id = dataset_id
+        self.path = path
+
+    def read(self, sheets):
+        """
+        The requested sheets and columns, like ingest.read_workbook (the kinds
+        were applied when the dataset was staged). Returns the frames keyed by
+        sheet name and the load time (seconds) of each sheet.
+        """
+        import pyarrow as pa
+
+        frames = {}
+        timings = {}
+        for sheet_name, columns in sheets.items():
+            start = time.perf_counter()
+            try:
+                source = pa.memory_map(_sheet_file(self.path, sheet_name))
+            except FileNotFoundError:
+                raise ValueError(f"Dataset {self.id} has no sheet '{sheet_name}' (or was removed)")
+            table = pa.ipc.open_file(source).read_all()
+            table = table.select([name for name in columns if name in table.schema.names])
+            frames[sheet_name] = _decode(table)
+            timings[sheet_name] = time.perf_counter() - start
+        return frames, timings
+
+
+class DatasetRegistry:
+    """
+    The datasets staged under directory, at most max_bytes of them on disk.
+    Opening a dataset marks it used; trim() removes the least recently used
+    ones until the rest fit.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, dataset_id):
+        if not _ID.fullmatch(dataset_id or ''):
+            return None
+        path = os.path.join(self.directory, dataset_id)
+        return path if os.path.exists(os.path.join(path, INFO_FILE)) else None
+
+    def info(self, dataset_id):
+        """The dataset's id, filename, created / last_used times, bytes and sheets (rows, columns); None if unknown"""
+        path = self._path(dataset_id)
+        if path is None:
+            return None
+        try:
+            return _read_info(path)
+        except OSError:
+            return None
+
+    def open(self, dataset_id):
+        """The Dataset, marked as used; None if unknown"""
+        path = self._path(dataset_id)
+        if path is None:
+            return None
+        try:
+            os.utime(os.path.join(path, INFO_FILE))
+        except OSError:
+            return None
+        return Dataset(dataset_id, path)
+
+    def list(self):
+        """Info of every dataset, most recently used first"""
+        datasets = [self.info(name) for name in os.listdir(self.directory) if _ID.fullmatch(name)]
+        return sorted((info for info in datasets if info is not None), key=lambda info: -info['last_used'])
+
+    def nbytes(self):
+        return sum(info['bytes'] for info in self.list())
+
+    def delete(self, dataset_id):
+        path = self._path(dataset_id)
+        if path is None:
+            return False
+        # Renamed first so the dataset disappears at once; workers that mapped its files keep reading them
+        trash = tempfile.mkdtemp(prefix='.deleted-', dir=self.directory)
+        try:
+            os.rename(path, os.path.join(trash, dataset_id))
+        except OSError:
+            os.rmdir(trash)
+            return False
+        shutil.rmtree(trash, ignore_errors=True)
+        return True
+
+    def trim(self):
+        """Remove the least recently used datasets until the total fits max_bytes; returns their ids"""
+        datasets = self.list()
+        total = sum(info['bytes'] for info in datasets)
+        evicted = []
+        for info in reversed(datasets):
+            if total <= self.max_bytes:
+                break
+            if self.delete(info['id']):
+                evicted.append(info['id'])
+            total -= info['bytes']
+        return evicted
@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+import xlsxwriter
+
+EXPORT_TABLES = {
+    'summary': 'Allocation Summary',
+    'demand_details': 'Demand Details',
+    'detailed_plan': 'Detailed Plan',
+}
+CSV_CHUNK_ROWS = 20000
+FILE_CHUNK_BYTES = 1024 * 1024
+
+
+def csv_chunks(df, chunk_rows=CSV_CHUNK_ROWS):
+    """Stream a table as CSV, chunk_rows rows at a time"""
+    yield df.head(0).to_csv(index=False).encode('utf-8')
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode('utf-8')
+
+
+def xlsx_chunks(result, tables=None):
+    """
+    The plan tables as one workbook, one sheet per table, in chunks.
+
+    xlsxwriter's constant_memory mode flushes every row to disk as it is
+    written, so only the current row is held in memory. The workbook is not
+    streamed while it is built, though: nothing is yielded until the whole
+    file is written to a temp file, which is then read out and removed.
+    """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+        header_format = workbook.add_format({'bold': True})
+        for table in tables or EXPORT_TABLES:
+            df = result[table]
+            worksheet = workbook.add_worksheet(EXPORT_TABLES[table])
+            worksheet.write_row(0, 0, list(df.columns), header_format)
+            for row_num, row in enumerate(df.itertuples(index=False, name=None), start=1):
+                worksheet.write_row(row_num, 0, row)
+        workbook.close()
+
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(FILE_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
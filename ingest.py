@@ -0,0 +1,113 @@
+import mmap
+import os
+import time
+from io import BytesIO
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+# Column kinds understood by read_workbook:
+#   'numeric' -> pd.to_numeric (int64/float64, unparseable values become NaN)
+#   'object'  -> raw cell values, same inference pandas.read_excel applies
+#   'category' -> 'object' values stored as a categorical (repetitive text)
+NUMERIC = 'numeric'
+OBJECT = 'object'
+CATEGORY = 'category'
+
+
+class _MappedFile(mmap.mmap):
+    """Read-only mmap that zipfile accepts as a file (mmap has no seekable() before 3.13)"""
+
+    def seekable(self):
+        return True
+
+
+def _cell_value(value):
+    """Normalise a raw openpyxl value the way pandas.read_excel does"""
+    if value is None or value == '':
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _to_series(name, values, kind):
+    series = pd.Series([_cell_value(v) for v in values], dtype=object, name=name)
+    if kind == NUMERIC:
+        return pd.to_numeric(series, errors='coerce')
+    if kind == CATEGORY:
+        return series.infer_objects().astype('category')
+    return series.infer_objects()
+
+
+def _read_sheet(ws, columns, others=None):
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame(columns=list(columns))
+    if others is not None:
+        columns = {**columns, **{name: others for name in header if name is not None and name not in columns}}
+
+    # First occurrence wins, matching pandas' de-duplication of headers
+    positions = {}
+    for idx, name in enumerate(header):
+        if name in columns and name not in positions:
+            positions[name] = idx
+    selected = [name for name in columns if name in positions]
+    if not selected:
+        return pd.DataFrame()
+
+    indices = [positions[name] for name in selected]
+    first, last = min(indices), max(indices)
+    picker = itemgetter(*[i - first for i in indices])
+    width = last - first + 1
+
+    # Stream only the column span we need; blank rows are skipped like read_excel does
+    data = []
+    for row in ws.iter_rows(min_row=2, min_col=first + 1, max_col=last + 1, values_only=True):
+        if row.count(None) == width:
+            continue
+        values = picker(row)
+        data.append(values if len(selected) > 1 else (values,))
+
+    columns_data = list(zip(*data)) if data else [()] * len(selected)
+    return pd.DataFrame({
+        name: _to_series(name, values, columns[name])
+        for name, values in zip(selected, columns_data)
+    })
+
+
+def read_workbook(file_content, sheets, others=None):
+    """
+    Open the workbook once and read the requested sheets.
+
+    sheets maps sheet name -> {column name: kind}. Columns absent from a sheet
+    are simply left out so the caller can report them; with others (a kind),
+    the sheet's remaining columns are read too, as that kind. file_content is the
+    workbook's bytes or a path, which is memory-mapped rather than read.
+    Returns the frames keyed by sheet name and the parse time (seconds) of
+    each sheet.
+    """
+    if isinstance(file_content, (str, os.PathLike)):
+        with open(file_content, 'rb') as fh, _MappedFile(fh.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            return read_workbook(view, sheets, others)
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        file_content = BytesIO(file_content)
+
+    frames = {}
+    timings = {}
+    start = time.perf_counter()
+    wb = load_workbook(file_content, read_only=True, data_only=True, keep_links=False)
+    timings['open'] = time.perf_counter() - start
+    try:
+        for sheet_name, columns in sheets.items():
+            if sheet_name not in wb.sheetnames:
+                raise ValueError(f"Worksheet named '{sheet_name}' not found")
+            start = time.perf_counter()
+            frames[sheet_name] = _read_sheet(wb[sheet_name], columns, others)
+            timings[sheet_name] = time.perf_counter() - start
+    finally:
+        wb.close()
+    return frames, timings
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ('id', 'status', 'stage', 'events', 'error', 'result', 'keep_result', 'future', 'created', 'finished', 'meta')
+
+    def __init__(self, meta=None, keep_result=False):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.stage = None
+        self.events = []   # (stage, seconds since created)
+        self.error = None
+        self.result = None
+        self.keep_result = keep_result
+        self.future = None
+        self.created = time.time()
+        self.finished = None
+        self.meta = meta or {}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': [{'stage': stage, 'elapsed': elapsed} for stage, elapsed in self.events],
+            'error': self.error,
+            **self.meta,
+        }
+
+
+# --- Worker side ---
+
+_progress_queue = None
+_cancelled = None
+_pool_workers = 1
+
+
+def _init_worker(progress_queue, cancelled, pool_workers=1):
+    global _progress_queue, _cancelled, _pool_workers
+    _progress_queue = progress_queue
+    _cancelled = cancelled
+    _pool_workers = pool_workers
+
+
+def cpu_share():
+    """CPUs for the current job: the machine's split evenly across the job pool (all of them outside a job worker)"""
+    return max(1, (os.cpu_count() or 1) // _pool_workers)
+
+
+def _run_job(job_id, fn, args, kwargs):
+    def progress(stage):
+        if job_id in _cancelled:
+            raise JobCancelled(job_id)
+        _progress_queue.put((job_id, stage, time.time()))
+
+    progress('started')
+    return fn(*args, progress=progress, **kwargs)
+
+
+# --- Parent side ---
+
+class JobManager:
+    """
+    Runs CPU-bound plan jobs in a bounded process pool.
+
+    At most max_workers jobs run at once and at most max_pending are queued or
+    running; submit raises QueueFull beyond that. Workers report stage progress
+    through a queue drained by a background thread, and check a shared
+    cancellation set at every stage boundary.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, keep_finished=256):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _start(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._manager = ctx.Manager()
+        self._progress = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self._progress, self._cancelled, self.max_workers),
+        )
+        threading.Thread(target=self._drain_progress, daemon=True).start()
+
+    def _drain_progress(self):
+        while True:
+            try:
+                job_id, stage, stamp = self._progress.get()
+            except (EOFError, OSError):
+                return
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if stage == 'started':
+                if job.status == QUEUED:
+                    job.status = RUNNING
+            else:
+                job.stage = stage
+                job.events.append((stage, round(stamp - job.created, 4)))
+
+    def active(self):
+        with self._lock:
+            return self._active()
+
+    def _active(self):
+        # Callers hold self._lock: submit and finished_job change self._jobs under it
+        return sum(1 for job in self._jobs.values() if job.status not in FINISHED)
+
+    def submit(self, fn, *args, on_done=None, meta=None, keep_result=False, **kwargs):
+        """
+        Queue fn(*args, progress=..., **kwargs) in a worker. on_done(job) runs on
+        success with job.result set; the result is dropped afterwards unless
+        keep_result is set (the caller then takes it from the job).
+        """
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            if self._active() >= self.max_pending:
+                raise QueueFull(f"Too many plan jobs in progress (limit {self.max_pending})")
+            job = Job(meta, keep_result)
+            self._jobs[job.id] = job
+            self._forget_finished()
+            job.future = self._pool.submit(_run_job, job.id, fn, args, kwargs)
+        job.future.add_done_callback(lambda future: self._finish(job, future, on_done))
+        return job
+
+    def finished_job(self, result, meta=None):
+        """Register a job that needed no work (e.g. served from cache)"""
+        job = Job(meta, keep_result=True)
+        job.status = DONE
+        job.result = result
+        job.finished = job.created
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        return job
+
+    def _finish(self, job, future, on_done):
+        try:
+            job.result = future.result()
+            if on_done is not None:
+                on_done(job)
+            if not job.keep_result:
+                job.result = None
+            job.status = DONE
+        except (CancelledError, JobCancelled):
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        job.finished = time.time()
+        self._cancelled.pop(job.id, None)
+
+    def _forget_finished(self):
+        # Under self._lock, like _active
+        finished = [job for job in self._jobs.values() if job.status in FINISHED]
+        for job in sorted(finished, key=lambda j: j.finished)[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        if not job.future.cancel():
+            # Already running: the worker stops at its next stage boundary
+            self._cancelled[job_id] = True
+        return job
+
+    async def wait(self, job):
+        if job.future is not None:
+            await asyncio.wait([asyncio.wrap_future(job.future)])
+        # on_done runs in the future's callback; make sure it has completed
+        while job.status not in FINISHED:
+            await asyncio.sleep(0.01)
+        return job
+
+    async def events(self, job, poll_interval=0.1):
+        """Server-sent events for a job: one 'progress' event per stage, then 'end'"""
+        sent = 0
+        while True:
+            events = job.events
+            while sent < len(events):
+                stage, elapsed = events[sent]
+                yield f"event: progress\ndata: {json.dumps({'stage': stage, 'elapsed': elapsed})}\n\n"
+                sent += 1
+            if job.status in FINISHED:
+                yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            await asyncio.sleep(poll_interval)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
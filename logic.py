@@ -1,6 +1,17 @@
+import functools
+import os
+import time
 import pandas as pd
 import numpy as np
 from io import BytesIO
+from ingest import read_workbook, NUMERIC, OBJECT, CATEGORY
+from categorical import is_categorical, categorize, map_categories, concat
+from affinity import KEY_SEP, map_size_to_r_code, build_affinity_index, allocate_affinity
+from allocation import AFFINITY, make_records, allocate_greedy, allocation_frame, allocation_diff, PlanState
+from schedule import expand_shift_plan, splice_groups, plan_diff, PlanIndex, coalesce_columns, coalesce_tasks, scheduled_slots
+from optimize import ENGINES, GREEDY_ENGINE, OPTIMAL_ENGINE, DEFAULT_TIME_BUDGET, optimize_allocation
+from metrics import StageTimer, ProgressInstrument
+from datasets import Dataset, write_dataset
 
 # --- CONSTANTS ---
 BASE_OUTPUT_100_EFF = 480
@@ -12,6 +23,30 @@ EFF_COL = 'eff'
 GROUPLINE_COL = 'groupline'
 SHIFTS_PER_WEEK = [f"s{i}" for i in range(1, 13)]
 
+# PLAN_DEBUG=0 switches off the diagnostic dumps (they format DataFrames on the hot path)
+DEBUG = os.environ.get('PLAN_DEBUG', '1') != '0'
+# PLAN_TRACE_MEMORY=1 records per-stage peak allocations with tracemalloc (slower)
+TRACE_MEMORY = os.environ.get('PLAN_TRACE_MEMORY', '0') == '1'
+METADATA_COLS = ['SELL_STYLE', 'SELL_COLOR', 'SELL_SIZE', 'PACK_STYLE', 'SELL_PACK', 'PRIMARY_DC']
+
+# Only these columns are parsed from the uploaded workbook; the style and
+# metadata text stays categorical from here to serialisation
+DEMAND_COLUMNS = {
+    STYLE_COL: CATEGORY,
+    QTY_COL: NUMERIC,
+    SEW_WEEK_COL: OBJECT,
+    **{col: CATEGORY for col in METADATA_COLS},
+}
+OUTPUT_COLUMNS = {
+    GROUPLINE_COL: OBJECT,
+    EFF_COL: NUMERIC,
+    'HC': NUMERIC,
+    'style construction': OBJECT,
+    'size': OBJECT,
+    'output': NUMERIC,
+}
+PLAN_SHEETS = {'demand_forecast': DEMAND_COLUMNS, 'Output_forecast': OUTPUT_COLUMNS}
+
 def generate_template_file():
     demand_template = pd.DataFrame({
         'PLANT': ['90'] * 5, 'SELL_STYLE': ['STBA02', 'STLL02', 'STBA03', 'STLL03', 'STBA04'],
@@ -43,12 +78,125 @@ def generate_template_file():
     output.seek(0)
     return output
 
-def process_plan(file_content):
-    # 1. READ DATA
-    excel_data = pd.ExcelFile(file_content)
-    demand_df = pd.read_excel(file_content, sheet_name='demand_forecast')
-    output_df = pd.read_excel(file_content, sheet_name='Output_forecast')
 
+@functools.lru_cache(maxsize=1)
+def template_bytes():
+    """The template workbook, built once per process"""
+    return generate_template_file().getvalue()
+
+TABLES = ['summary', 'demand_details', 'detailed_plan']
+STAGES = ['parsing', 'validate', 'affinity', 'phase1', 'phase2', 'kpi', 'summary', 'plan_expansion']
+REPLAN_STAGES = ['delta', 'phase1', 'phase2', 'kpi', 'summary', 'plan_expansion', 'diff']
+# Result entries that are not part of the plan response
+INTERNAL_KEYS = ('timings', 'state', 'index')
+
+
+def process_plan(file_content, **options):
+    """Run the planner and return the JSON-ready records response"""
+    return plan_records(run_plan(file_content, **options))
+
+
+def plan_records(result, tables=TABLES):
+    """Plan result with its tables (only those in tables) converted to lists of records"""
+    records = {}
+    for key, value in result.items():
+        if key in INTERNAL_KEYS or (key in TABLES and key not in tables):
+            continue
+        records[key] = value.to_dict('records') if key in TABLES else value
+    return records
+
+
+def plan_nbytes(result):
+    """Approximate in-memory size of a plan result"""
+    size = sum(result[table].memory_usage(index=False, deep=True).sum() for table in TABLES)
+    for key in ('state', 'index'):
+        if result.get(key) is not None:
+            size += result[key].nbytes
+    return int(size)
+
+
+def plan_index(result):
+    """The PlanIndex of a result's detailed plan, built once and kept with the result (main.cache_plan builds it before caching)"""
+    index = result.get('index')
+    if index is None:
+        index = result['index'] = PlanIndex(result['detailed_plan'])
+    return index
+
+
+def run_plan(file_content, phase2_strategy='sweep', engine=GREEDY_ENGINE, time_budget=None, coalesce=None,
+             progress=None, instruments=()):
+    """
+    Run the planner; the summary, demand details and detailed plan stay DataFrames.
+
+    Every stage in STAGES is timed (result['timings']). progress, if given, is
+    called with each stage name as it starts; instruments (metrics.Instrument)
+    also receive the finished stage records.
+
+    engine='optimal' re-solves the greedy allocation as a min-cost flow
+    (extra 'optimize' stage, needs scipy) within time_budget seconds of
+    allocation time, falling back to the greedy result; result['optimization']
+    reports the solver status and the gap to the greedy.
+
+    coalesce=('style', 'color', ...) merges each group's allocations of the
+    same style (and color/size) into one task before the plan is expanded
+    (extra 'coalesce' stage); result['coalescing'] reports the reduction.
+    """
+    if progress is not None:
+        instruments = [ProgressInstrument(progress), *instruments]
+    timer = StageTimer(instruments, trace_memory=TRACE_MEMORY)
+
+    timer.start('parsing')
+    demand_df, output_df = read_plan_frames(file_content)
+    timer.rows(len(demand_df) + len(output_df))
+    return plan_frames(demand_df, output_df, timer, phase2_strategy, engine, time_budget, coalesce=coalesce)
+
+
+def read_plan_frames(file_content, extra_columns=()):
+    """
+    The demand_forecast and Output_forecast sheets, plus extra_columns from
+    both where present. file_content may also be a staged datasets.Dataset.
+    """
+    # 1. READ DATA (single pass, only the columns the planner uses)
+    extra = {col: OBJECT for col in extra_columns}
+    spec = {sheet: {**columns, **extra} for sheet, columns in PLAN_SHEETS.items()}
+    if isinstance(file_content, Dataset):
+        sheets, parse_timings = file_content.read(spec)
+    else:
+        sheets, parse_timings = read_workbook(file_content, spec)
+    if DEBUG:
+        print("Parse timings: " + ", ".join(f"{name}={secs:.3f}s" for name, secs in parse_timings.items()))
+    return sheets['demand_forecast'], sheets['Output_forecast']
+
+
+def stage_dataset(file_content, directory, dataset_id, filename=None, progress=None):
+    """
+    Parse the plan sheets (every column; the planner's with their usual
+    kinds) and store them as dataset dataset_id under directory. Returns the
+    dataset's info.
+    """
+    sheets, _ = read_workbook(file_content, PLAN_SHEETS, others=OBJECT)
+    return write_dataset(directory, dataset_id, sheets, filename)
+
+
+def horizon_weeks(demand_df):
+    """Sorted week numbers (last two digits of SEW_WEEK) the demand spans"""
+    week_num = demand_df[SEW_WEEK_COL].astype(str).str.split('.').str[0].str[-2:]
+    week_num = pd.to_numeric(week_num, errors='coerce')
+    return sorted(week_num.dropna().astype(int).unique())
+
+
+def plan_frames(demand_df, output_df, timer, phase2_strategy='sweep', engine=GREEDY_ENGINE, time_budget=None, weeks=None,
+                coalesce=None):
+    """
+    Plan parsed sheets: every stage after 'parsing', timed on timer. weeks
+    fixes the planning horizon (shards of one workbook share it); by default
+    it is the weeks the demand spans.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}'. Use one of: {', '.join(ENGINES)}")
+    coalesce_by = coalesce_columns(coalesce) if coalesce else ()
+
+    timer.start('validate')
     # 2. PREPROCESSING
     # Validate columns
     required_demand_cols = [STYLE_COL, QTY_COL, SEW_WEEK_COL]
@@ -62,14 +210,12 @@ def process_plan(file_content):
     if missing_output:
         raise ValueError(f"Missing columns in 'Output_forecast': {', '.join(missing_output)}")
 
-    demand_df[STYLE_COL] = demand_df[STYLE_COL].astype(str).str.strip()
+    demand_df[STYLE_COL] = map_categories(demand_df[STYLE_COL], lambda styles: styles.astype(str).str.strip())
     output_df[GROUPLINE_COL] = output_df[GROUPLINE_COL].astype(str).str.strip()
     demand_df[QTY_COL] = pd.to_numeric(demand_df[QTY_COL], errors='coerce').fillna(0)
 
     # Calculate Horizon
-    demand_df['week_num'] = demand_df[SEW_WEEK_COL].astype(str).str.split('.').str[0].str[-2:]
-    demand_df['week_num'] = pd.to_numeric(demand_df['week_num'], errors='coerce')
-    unique_weeks = sorted(demand_df['week_num'].dropna().astype(int).unique())
+    unique_weeks = horizon_weeks(demand_df) if weeks is None else list(weeks)
     planning_horizon_weeks = len(unique_weeks)
     
     if planning_horizon_weeks == 0:
@@ -81,79 +227,36 @@ def process_plan(file_content):
     demand_rows = demand_df.copy()
     
     # Ensure required metadata columns exist with defaults
-    metadata_cols = ['SELL_STYLE', 'SELL_COLOR', 'SELL_SIZE', 'PACK_STYLE', 'SELL_PACK', 'PRIMARY_DC']
+    metadata_cols = METADATA_COLS
     for col in metadata_cols:
         if col not in demand_rows.columns:
             demand_rows[col] = '-'
+        demand_rows[col] = categorize(demand_rows[col])
     
     # Select only the columns we need
     base_cols = [STYLE_COL, QTY_COL]
     available_cols = base_cols + [col for col in metadata_cols if col in demand_rows.columns]
     demand_rows = demand_rows[available_cols].copy()
     
-    # Sort by quantity descending (highest demand first for greedy allocation)
-    demand_rows = demand_rows.sort_values(by=QTY_COL, ascending=False).reset_index(drop=True)
+    # Sort by quantity descending (highest demand first for greedy allocation);
+    # the demand id is the row's position in demand_forecast
+    demand_rows = demand_rows.sort_values(by=QTY_COL, ascending=False)
+    demand_ids = demand_rows.index.to_numpy(dtype=np.int64)
+    demand_rows = demand_rows.reset_index(drop=True)
+    timer.rows(len(demand_rows))
     
     # DEBUG: Check Output_forecast structure
-    print("\n" + "="*60)
-    print("OUTPUT_FORECAST COLUMNS:")
-    print("="*60)
-    print(f"Total rows: {len(output_df)}")
-    print(f"Columns: {list(output_df.columns)}")
-    print("\nFirst 3 rows of Output_forecast:")
-    print(output_df.head(3).to_string())
-    print("="*60 + "\n")
-    
-    # SIZE MAPPING: Convert demand sizes to Output_forecast R-codes
-    def map_size_to_r_code(size):
-        """Map numeric size to R-code range"""
-        try:
-            size_num = int(size)
-            if size_num == 41:
-                return 'R1'
-            elif size_num in [42, 43, 44]:
-                return 'R2'
-            elif size_num in [45, 46]:
-                return 'R3'
-        except:
-            pass
-        return size  # Return as-is if no mapping
-    
-    # 3.5. BUILD STYLE-SIZE-GROUP AFFINITY MAP FROM OUTPUT_FORECAST
-    # Map (style, size) combinations to groups that have worked on them
-    style_size_group_map = {}
-    for _, row in output_df.iterrows():
-        style = row.get('style construction', '').strip()
-        size = row.get('size', '').strip()
-        group = row[GROUPLINE_COL].strip()
-        output = row.get('output', 0)
-        
-        if style and group:
-            key = (style, size) if size else (style, '')
-            if key not in style_size_group_map:
-                style_size_group_map[key] = []
-            # Store group with its output for sorting
-            style_size_group_map[key].append({'group': group, 'output': output})
-    
-    # Sort each group list by output (descending) - highest output first
-    for key in style_size_group_map:
-        style_size_group_map[key] = sorted(
-            style_size_group_map[key], 
-            key=lambda x: x['output'], 
-            reverse=True
-        )
-    
-    # DEBUG: Print affinity map summary
-    print("\n" + "="*60)
-    print(f"AFFINITY MAP: {len(style_size_group_map)} unique (style, size) combinations")
-    print("="*60)
-    if len(style_size_group_map) > 0:
-        print("Sample entries:")
-        for i, (key, groups) in enumerate(list(style_size_group_map.items())[:5]):
-            style_name, size_name = key
-            print(f"  {i+1}. Style: '{style_name[:40]}...' | Size: '{size_name}' | {len(groups)} groups")
-    print("="*60 + "\n")
+    if DEBUG:
+        print("\n" + "="*60)
+        print("OUTPUT_FORECAST COLUMNS:")
+        print("="*60)
+        print(f"Total rows: {len(output_df)}")
+        print(f"Columns: {list(output_df.columns)}")
+        print("\nFirst 3 rows of Output_forecast:")
+        print(output_df.head(3).to_string())
+        print("="*60 + "\n")
     
+    timer.start('affinity')
     # Calculate group capacity
     group_stats = output_df.groupby(GROUPLINE_COL).agg({
         EFF_COL: 'mean', 
@@ -166,143 +269,79 @@ def process_plan(file_content):
     group_stats['Total_Capacity'] = group_stats['HC'] * hours_per_horizon * base_rate * (group_stats[EFF_COL] / 100)
     group_stats = group_stats.sort_values(by='Total_Capacity', ascending=False).reset_index(drop=True)
     
+    # 3.5. BUILD STYLE-SIZE-GROUP AFFINITY INDEX FROM OUTPUT_FORECAST
+    # Map (style, size) combinations to groups that have worked on them,
+    # ranked by output (descending) - highest output first
+    affinity_index = build_affinity_index(output_df, GROUPLINE_COL, group_stats[GROUPLINE_COL].to_numpy())
+    timer.rows(len(affinity_index))
+    
+    # DEBUG: Print affinity map summary
+    if DEBUG:
+        print("\n" + "="*60)
+        print(f"AFFINITY MAP: {len(affinity_index)} unique (style, size) combinations")
+        print("="*60)
+        if len(affinity_index) > 0:
+            print("Sample entries:")
+            for i, key in enumerate(affinity_index.keys[:5]):
+                style_name, size_name = key.split(KEY_SEP)
+                print(f"  {i+1}. Style: '{style_name[:40]}...' | Size: '{size_name}' | {affinity_index.group_count(i)} groups")
+        print("="*60 + "\n")
+    
     # 4. TWO-PHASE ALLOCATION
-    allocations = [] 
-    demand_queue = demand_rows.to_dict('records')
-    groups_dict = {row[GROUPLINE_COL]: row for row in group_stats.to_dict('records')}
+    # Remaining demand and capacity live in arrays aligned with demand_rows / group_stats;
+    # allocations are compact records turned into a DataFrame once, at the end
+    remaining_qty = demand_rows[QTY_COL].to_numpy(dtype=float, copy=True)
+    remaining_cap = group_stats['Total_Capacity'].to_numpy(dtype=float, copy=True)
     
     total_demand_initial = demand_df[QTY_COL].sum()
     total_capacity_initial = group_stats['Total_Capacity'].sum()
     
+    timer.start('phase1')
+    allocation_started = time.perf_counter()
     # PHASE 1: AFFINITY-BASED ALLOCATION (PRIORITY)
-    phase1_matches = 0
-    phase1_attempts = 0
-    for demand in demand_queue:
-        style = demand[STYLE_COL]
-        size = demand.get('SELL_SIZE', '')
-        
-        # Map demand size to R-code
-        r_code = map_size_to_r_code(size)
-        
-        # Try exact match: (style, R-code)
-        key = (style, r_code) if r_code else (style, '')
-        preferred_groups = style_size_group_map.get(key, [])
-        
-        # If no exact match, try just style
-        if not preferred_groups and r_code:
-            key = (style, '')
-            preferred_groups = style_size_group_map.get(key, [])
-        
-        # DEBUG: Log first 5 matching attempts
-        if phase1_attempts < 5:
-            print(f"Demand {phase1_attempts+1}: Style='{style[:40]}', Size={size} (R-code:{r_code}) -> {len(preferred_groups)} preferred groups")
-            phase1_attempts += 1
-        
-        # Try allocating to preferred groups (sorted by efficiency)
-        for pref in preferred_groups:
-            group_name = pref['group']
-            if group_name in groups_dict:
-                current_group = groups_dict[group_name]
-                group_cap = current_group['Total_Capacity']
-                demand_qty = demand[QTY_COL]
-                
-                if demand_qty <= 0 or group_cap <= 0:
-                    continue
-                
-                amount_to_allocate = min(demand_qty, group_cap)
-                
-                allocations.append({
-                    'Group': group_name,
-                    'Style': demand[STYLE_COL],
-                    'SELL_STYLE': demand.get('SELL_STYLE', '-'),
-                    'PACK_STYLE': demand.get('PACK_STYLE', '-'),
-                    'SELL_COLOR': demand.get('SELL_COLOR', '-'),
-                    'SELL_SIZE': demand.get('SELL_SIZE', '-'),
-                    'SELL_PACK': demand.get('SELL_PACK', '-'),
-                    'PRIMARY_DC': demand.get('PRIMARY_DC', '-'),
-                    'Allocated_Qty': amount_to_allocate,
-                    'HC': current_group['HC'],
-                    'Eff': current_group[EFF_COL],
-                    'Total_Group_Cap': current_group['Total_Capacity'] + amount_to_allocate,
-                    'Phase': 'Affinity'  # Track which phase allocated this
-                })
-                
-                phase1_matches += 1
-                demand[QTY_COL] -= amount_to_allocate
-                groups_dict[group_name]['Total_Capacity'] -= amount_to_allocate
-                
-                if demand[QTY_COL] <= 0.01:
-                    break
+    # Demand sizes are mapped to R-codes and matched against the index in one pass
+    demand_keys = affinity_index.lookup(demand_rows[STYLE_COL], demand_rows['SELL_SIZE'])
     
-    print(f"\nPhase 1 Summary: {phase1_matches} successful matches out of {len(demand_queue)} demands\n")
+    # DEBUG: Log first 5 matching attempts
+    if DEBUG:
+        for i, (style, size) in enumerate(zip(demand_rows[STYLE_COL][:5], demand_rows['SELL_SIZE'][:5])):
+            print(f"Demand {i+1}: Style='{style[:40]}', Size={size} (R-code:{map_size_to_r_code(size)}) -> {affinity_index.group_count(demand_keys[i])} preferred groups")
     
-    # PHASE 2: GREEDY FALLBACK FOR REMAINING DEMAND
-    # Rebuild groups queue from remaining capacity, sorted by capacity
-    groups_queue = sorted(
-        [g for g in groups_dict.values() if g['Total_Capacity'] > 0.01],
-        key=lambda x: x['Total_Capacity'],
-        reverse=True
-    )
+    phase1_records = make_records(*allocate_affinity(affinity_index, demand_keys, remaining_qty, remaining_cap), AFFINITY)
+    timer.rows(len(phase1_records))
     
-    # Sort unallocated demands by remaining quantity
-    remaining_demands = [d for d in demand_queue if d[QTY_COL] > 0.01]
-    remaining_demands.sort(key=lambda x: x[QTY_COL], reverse=True)
+    if DEBUG:
+        print(f"\nPhase 1 Summary: {len(phase1_records)} successful matches out of {len(demand_rows)} demands\n")
     
-    g_idx = 0
-    d_idx = 0
-    
-    while d_idx < len(remaining_demands) and g_idx < len(groups_queue):
-        current_demand = remaining_demands[d_idx]
-        current_group = groups_queue[g_idx]
-        
-        demand_qty = current_demand[QTY_COL]
-        group_cap = current_group['Total_Capacity']
-        
-        if demand_qty <= 0:
-            d_idx += 1
-            continue
-        if group_cap <= 0:
-            g_idx += 1
-            continue
-        
-        amount_to_allocate = min(demand_qty, group_cap)
-        
-        allocations.append({
-            'Group': current_group[GROUPLINE_COL],
-            'Style': current_demand[STYLE_COL],
-            'SELL_STYLE': current_demand.get('SELL_STYLE', '-'),
-            'PACK_STYLE': current_demand.get('PACK_STYLE', '-'),
-            'SELL_COLOR': current_demand.get('SELL_COLOR', '-'),
-            'SELL_SIZE': current_demand.get('SELL_SIZE', '-'),
-            'SELL_PACK': current_demand.get('SELL_PACK', '-'),
-            'PRIMARY_DC': current_demand.get('PRIMARY_DC', '-'),
-            'Allocated_Qty': amount_to_allocate,
-            'HC': current_group['HC'],
-            'Eff': current_group[EFF_COL],
-            'Total_Group_Cap': current_group['Total_Capacity'] + amount_to_allocate,
-            'Phase': 'Greedy'  # Track which phase allocated this
-        })
-        
-        remaining_demands[d_idx][QTY_COL] -= amount_to_allocate
-        groups_queue[g_idx]['Total_Capacity'] -= amount_to_allocate
-        
-        if remaining_demands[d_idx][QTY_COL] <= 0.01:
-            d_idx += 1 
-        
-        if groups_queue[g_idx]['Total_Capacity'] <= 0.01:
-            g_idx += 1 
+    timer.start('phase2')
+    # PHASE 2: GREEDY FALLBACK FOR REMAINING DEMAND
+    phase2_records = allocate_greedy(remaining_qty, remaining_cap, strategy=phase2_strategy)
     
-    allocation_df = pd.DataFrame(allocations)
-    if allocation_df.empty:
-        allocation_df = pd.DataFrame(columns=[
-            'Group', 'Style', 'SELL_STYLE', 'PACK_STYLE', 'SELL_COLOR', 
-            'SELL_SIZE', 'Allocated_Qty', 'HC', 'Eff', 'Total_Group_Cap', 'Phase'
-        ])
+    allocation_records = np.concatenate([phase1_records, phase2_records])
+    timer.rows(len(phase2_records))
+
+    optimization = None
+    if engine == OPTIMAL_ENGINE:
+        timer.start('optimize')
+        # The greedy result is the warm start and the fallback
+        allocation_records, remaining_qty, remaining_cap, optimization = optimize_allocation(
+            affinity_index, demand_keys,
+            demand_rows[QTY_COL].to_numpy(dtype=float), group_stats['Total_Capacity'].to_numpy(dtype=float),
+            group_stats[EFF_COL].to_numpy(dtype=float), (allocation_records, remaining_qty, remaining_cap),
+            DEFAULT_TIME_BUDGET if time_budget is None else time_budget, started=allocation_started
+        )
+        timer.rows(len(allocation_records))
+        if DEBUG:
+            print(f"Optimization: {optimization}")
 
+    allocation_df = allocation_frame(
+        allocation_records, demand_rows, group_stats,
+        STYLE_COL, GROUPLINE_COL, EFF_COL, metadata_cols
+    )
 
     # DEBUG: Print allocation phase statistics
-    if not allocation_df.empty and 'Phase' in allocation_df.columns:
-        phase_stats = allocation_df.groupby('Phase')['Allocated_Qty'].agg(['sum', 'count']).reset_index()
+    if DEBUG and not allocation_df.empty and 'Phase' in allocation_df.columns:
+        phase_stats = allocation_df.groupby('Phase', observed=True)['Allocated_Qty'].agg(['sum', 'count']).reset_index()
         print("\n" + "="*60)
         print("ALLOCATION PHASE STATISTICS")
         print("="*60)
@@ -313,27 +352,300 @@ def process_plan(file_content):
             print(f"{phase:10} | {num_allocations:4} allocations | {total_qty:12,.0f} units")
         print("="*60 + "\n")
     
-    unallocated_qty = sum(d[QTY_COL] for d in demand_queue)
-    total_allocated = allocation_df['Allocated_Qty'].sum() if not allocation_df.empty else 0
+    unallocated_qty = remaining_qty.sum()
 
+    coalescing = None
+    task_df = allocation_df
+    if coalesce_by:
+        timer.start('coalesce')
+        # Fragments of a style on one group become one task, styles kept back to back
+        task_df = coalesce_tasks(allocation_df, coalesce_by)
+        coalescing = coalescing_report(allocation_df, task_df, coalesce_by, len(unique_weeks), base_rate)
+        timer.rows(len(task_df))
+
+    timer.start('kpi')
     # 5. KPI CALCULATIONS
+    kpi_data = plan_kpis(task_df, group_stats, total_demand_initial, total_capacity_initial, unallocated_qty)
+
+    timer.start('summary')
+    # 6. WORK ALLOCATION SUMMARY
+    summary_df = allocation_summary(task_df, hours_per_horizon, base_rate, planning_horizon_weeks)
+    demand_details = demand_details_table(demand_rows)
+    timer.rows(len(summary_df))
+
+    timer.start('plan_expansion')
+    # 7. DETAILED PLAN
+    # ZERO CHANGEOVERS: each group runs ONE style per week across all shifts,
+    # expanded for every group and week at once
+    final_plan_df = expand_shift_plan(task_df, unique_weeks, SHIFT_HOURS, base_rate, SHIFTS_PER_WEEK)
+    timer.rows(len(final_plan_df))
+
+    state = PlanState(
+        demand_rows, demand_ids, demand_keys, np.ones(len(demand_rows), dtype=bool), group_stats, affinity_index,
+        allocation_records, remaining_qty, remaining_cap, unique_weeks, phase2_strategy, coalesce_by,
+        engine, time_budget
+    )
+
+    result = {
+        'kpi': kpi_data,
+        'summary': summary_df,
+        'demand_details': demand_details,
+        'detailed_plan': final_plan_df,
+        'planning_horizon': planning_horizon_weeks,
+        'timings': timer.finish(),
+        'state': state,
+    }
+    if optimization is not None:
+        result['optimization'] = optimization
+    if coalescing is not None:
+        result['coalescing'] = coalescing
+    return result
+
+
+
+def _week_num(sew_week):
+    return pd.to_numeric(str(sew_week).split('.')[0][-2:], errors='coerce')
+
+
+def _demand_fields(row, columns, weeks, skip=()):
+    """Validated demand field updates from one delta row"""
+    fields = {}
+    for col, value in row.items():
+        if col in skip:
+            continue
+        if col == SEW_WEEK_COL:
+            # Only checked: the planning horizon is fixed by the base plan
+            if _week_num(value) not in weeks:
+                raise ValueError(f"SEW_WEEK {value} is outside the planning horizon; upload the workbook again")
+        elif col == QTY_COL:
+            try:
+                fields[col] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"QTY must be a number, got {value!r}")
+        elif col == STYLE_COL:
+            fields[col] = str(value).strip()
+        elif col in columns:
+            fields[col] = value
+        else:
+            raise ValueError(f"Unknown demand field '{col}'")
+    return fields
+
+
+def _demand_positions(state, active, ids):
+    positions = pd.Index(state.demand_ids).get_indexer(pd.Index(ids, dtype=object))
+    unknown = [demand_id for demand_id, pos in zip(ids, positions) if pos < 0 or not active[pos]]
+    if unknown:
+        raise ValueError(f"Unknown demand id(s): {', '.join(map(str, unknown[:10]))}")
+    return positions.astype(np.int64)
+
+
+def replan(result, delta, progress=None, instruments=()):
+    """
+    Re-plan a previous run_plan (or replan) result after demand changes.
+
+    delta = {'added': [row, ...], 'removed': [id, ...], 'changed': [{'id': id, column: value, ...}, ...]}
+    with rows keyed by demand_forecast column names. A demand id is the
+    row's position in demand_forecast; added rows get new ids (see the diff).
+
+    Only the styles the delta touches are reallocated: their allocations are
+    released back to the grouplines, Phase 1 reruns over their demand and
+    Phase 2 over whatever is still unallocated, and the detailed plan is
+    re-expanded only for grouplines whose allocations changed. The planning
+    horizon stays that of the base plan.
+
+    Returns (result, diff); diff holds the allocation and detailed-plan rows
+    that were added, removed or changed, as records.
+    """
+    state = result.get('state')
+    if state is None:
+        raise ValueError("This plan has no re-planning state; upload the workbook again")
+    unknown = set(delta) - {'added', 'removed', 'changed'}
+    if unknown:
+        raise ValueError(f"Unknown delta key(s): {', '.join(sorted(unknown))}")
+    if progress is not None:
+        instruments = [ProgressInstrument(progress), *instruments]
+    timer = StageTimer(instruments, trace_memory=TRACE_MEMORY)
+
+    timer.start('delta')
+    weeks = state.weeks
+    group_stats = state.group_stats
+    affinity_index = state.affinity_index
+    columns = list(state.demand_rows.columns)
+    active = state.active.copy()
+
+    removed = delta.get('removed') or []
+    changed = delta.get('changed') or []
+    added = delta.get('added') or []
+    removed_pos = _demand_positions(state, active, removed)
+    changed_pos = _demand_positions(state, active, [change.get('id') for change in changed])
+    updates = [_demand_fields(change, columns, weeks, skip=('id',)) for change in changed]
+    added_fields = [_demand_fields(row, columns, weeks) for row in added]
+    for fields in added_fields:
+        if STYLE_COL not in fields or QTY_COL not in fields:
+            raise ValueError(f"Added demand rows need '{STYLE_COL}' and '{QTY_COL}'")
+
+    # Old styles of removed/changed rows, new styles of changed/added rows
+    touched_styles = set(state.demand_rows[STYLE_COL].to_numpy()[np.concatenate([removed_pos, changed_pos])])
+
+    demand_rows = state.demand_rows
+    if added_fields:
+        new_rows = pd.DataFrame([{col: fields.get(col, '-') for col in columns} for fields in added_fields], columns=columns)
+        for col in columns:
+            if is_categorical(demand_rows[col]):
+                new_rows[col] = categorize(new_rows[col])
+        demand_rows = concat([demand_rows, new_rows], ignore_index=True)
+    else:
+        demand_rows = demand_rows.copy()
+    next_id = int(state.demand_ids.max()) + 1 if len(state.demand_ids) else 0
+    added_ids = np.arange(next_id, next_id + len(added_fields), dtype=np.int64)
+    demand_ids = np.concatenate([state.demand_ids, added_ids])
+    added_pos = np.arange(len(state.demand_ids), len(demand_rows), dtype=np.int64)
+    active = np.concatenate([active, np.ones(len(added_fields), dtype=bool)])
+
+    # Apply removals and changes column by column
+    qty_values = demand_rows[QTY_COL].to_numpy(dtype=float, copy=True)
+    qty_values[removed_pos] = 0
+    active[removed_pos] = False
+    for col in columns:
+        edits = [(pos, fields[col]) for pos, fields in zip(changed_pos, updates) if col in fields]
+        if not edits or col == QTY_COL:
+            continue
+        values = demand_rows[col].to_numpy(dtype=object, copy=True)
+        for pos, value in edits:
+            values[pos] = value
+        if is_categorical(demand_rows[col]):
+            values = pd.Categorical(values)
+        demand_rows[col] = values
+    for pos, fields in zip(changed_pos, updates):
+        if QTY_COL in fields:
+            qty_values[pos] = fields[QTY_COL]
+    if np.issubdtype(demand_rows[QTY_COL].dtype, np.integer) and np.array_equal(qty_values, np.round(qty_values)):
+        demand_rows[QTY_COL] = qty_values.astype(demand_rows[QTY_COL].dtype)
+    else:
+        demand_rows[QTY_COL] = qty_values
+
+    styles = demand_rows[STYLE_COL].to_numpy()
+    relookup = np.concatenate([changed_pos, added_pos])
+    touched_styles.update(styles[relookup])
+    demand_keys = np.concatenate([state.demand_keys, np.full(len(added_fields), -1, dtype=np.int64)])
+    demand_keys[relookup] = affinity_index.lookup(styles[relookup], demand_rows['SELL_SIZE'].to_numpy()[relookup])
+
+    # Release every allocation of the touched styles
+    affected = np.flatnonzero(demand_rows[STYLE_COL].isin(touched_styles).to_numpy())
+    records = state.records
+    released_mask = np.isin(records['demand'], affected)
+    released = records[released_mask]
+    remaining_cap = state.remaining_cap.copy()
+    np.add.at(remaining_cap, released['group'], released['qty'])
+    remaining_qty = np.concatenate([state.remaining_qty, np.zeros(len(added_fields))])
+    remaining_qty[affected] = np.where(active[affected], qty_values[affected], 0)
+    timer.rows(len(affected))
+
+    timer.start('phase1')
+    # Affected demand only, highest quantity first as in a full run
+    order = affected[np.argsort(-remaining_qty[affected], kind='stable')]
+    order_qty = remaining_qty[order]
+    demand_idx, group_idx, amounts, group_caps = allocate_affinity(affinity_index, demand_keys[order], order_qty, remaining_cap)
+    remaining_qty[order] = order_qty
+    phase1_records = make_records(order[demand_idx], group_idx, amounts, group_caps, AFFINITY)
+    timer.rows(len(phase1_records))
+
+    timer.start('phase2')
+    phase2_records = allocate_greedy(remaining_qty, remaining_cap, strategy=state.phase2_strategy)
+    new_records = np.concatenate([phase1_records, phase2_records])
+    allocation_records = np.concatenate([records[~released_mask], new_records])
+    allocation_df = allocation_frame(allocation_records, demand_rows, group_stats, STYLE_COL, GROUPLINE_COL, EFF_COL, METADATA_COLS)
+    timer.rows(len(phase2_records))
+
+    base_rate = BASE_OUTPUT_100_EFF / 38 / SHIFT_HOURS
+    hours_per_horizon = SHIFT_HOURS * 2 * 6 * len(weeks)
+    coalescing = None
+    task_df = allocation_df
+    if state.coalesce:
+        timer.start('coalesce')
+        task_df = coalesce_tasks(allocation_df, state.coalesce)
+        coalescing = coalescing_report(allocation_df, task_df, state.coalesce, len(weeks), base_rate)
+        timer.rows(len(task_df))
+
+    timer.start('kpi')
+    kpi_data = plan_kpis(task_df, group_stats, qty_values[active].sum(), group_stats['Total_Capacity'].sum(), remaining_qty.sum())
+
+    timer.start('summary')
+    summary_df = allocation_summary(task_df, hours_per_horizon, base_rate, len(weeks))
+    demand_details = demand_details_table(demand_rows[active])
+    timer.rows(len(summary_df))
+
+    timer.start('plan_expansion')
+    # Only grouplines that lost or gained allocations get a new schedule
+    group_names = group_stats[GROUPLINE_COL].to_numpy()
+    touched_groups = group_names[np.unique(np.concatenate([released['group'], new_records['group']]))]
+    group_plan = expand_shift_plan(
+        task_df[task_df['Group'].isin(touched_groups)], weeks, SHIFT_HOURS, base_rate, SHIFTS_PER_WEEK
+    )
+    old_plan = result['detailed_plan']
+    final_plan_df = splice_groups(old_plan, group_plan, touched_groups, SHIFTS_PER_WEEK)
+    timer.rows(len(group_plan))
+
+    timer.start('diff')
+    old_allocations = allocation_frame(released, state.demand_rows, group_stats, STYLE_COL, GROUPLINE_COL, EFF_COL, METADATA_COLS)
+    old_allocations.insert(0, 'Demand_Id', state.demand_ids[released['demand']])
+    new_allocations = allocation_frame(new_records, demand_rows, group_stats, STYLE_COL, GROUPLINE_COL, EFF_COL, METADATA_COLS)
+    new_allocations.insert(0, 'Demand_Id', demand_ids[new_records['demand']])
+    allocations_added, allocations_removed = allocation_diff(old_allocations, new_allocations)
+    plan_changes = plan_diff(old_plan[old_plan['Group'].isin(touched_groups)], group_plan)
+    diff = {
+        'demand': {
+            'added_ids': added_ids.tolist(),
+            'removed_ids': state.demand_ids[removed_pos].tolist(),
+            'changed_ids': state.demand_ids[changed_pos].tolist(),
+            'reallocated': int(len(affected)),
+        },
+        'groups': touched_groups.tolist(),
+        'allocations': {
+            'added': allocations_added.to_dict('records'),
+            'removed': allocations_removed.to_dict('records'),
+        },
+        'detailed_plan': {name: rows.to_dict('records') for name, rows in plan_changes.items()},
+    }
+    timer.rows(len(allocations_added) + len(allocations_removed))
+
+    new_state = PlanState(
+        demand_rows, demand_ids, demand_keys, active, group_stats, affinity_index,
+        allocation_records, remaining_qty, remaining_cap, weeks, state.phase2_strategy, state.coalesce,
+        state.engine, state.time_budget
+    )
+    replanned = {
+        'kpi': kpi_data,
+        'summary': summary_df,
+        'demand_details': demand_details,
+        'detailed_plan': final_plan_df,
+        'planning_horizon': len(weeks),
+        'timings': timer.finish(),
+        'state': new_state,
+    }
+    if coalescing is not None:
+        replanned['coalescing'] = coalescing
+    return replanned, diff
+
+def plan_kpis(allocation_df, group_stats, total_demand, total_capacity, unallocated_qty):
+    total_allocated = allocation_df['Allocated_Qty'].sum() if not allocation_df.empty else 0
+
     if total_allocated > 0:
         weighted_avg_eff = (allocation_df['Eff'] * allocation_df['Allocated_Qty']).sum() / total_allocated
     else:
         weighted_avg_eff = 0
 
-    cap_utilization = (total_allocated / total_capacity_initial * 100) if total_capacity_initial > 0 else 0
+    cap_utilization = (total_allocated / total_capacity * 100) if total_capacity > 0 else 0
 
     max_eff = group_stats[EFF_COL].max()
     effective_output = (allocation_df['Allocated_Qty'] * (allocation_df['Eff']/100)).sum()
     theoretical_max_output = total_allocated * (max_eff/100)
     model_score = (effective_output / theoretical_max_output * 100) if theoretical_max_output > 0 else 0
 
-    changeovers = allocation_df.groupby('Group').size().sub(1).sum()
-    if changeovers < 0: changeovers = 0
+    changeovers = plan_changeovers(allocation_df)
 
-    kpi_data = {
-        'total_demand': float(total_demand_initial),
+    return {
+        'total_demand': float(total_demand),
         'total_allocated': float(total_allocated),
         'weighted_avg_eff': float(weighted_avg_eff),
         'cap_utilization': float(cap_utilization),
@@ -342,8 +654,35 @@ def process_plan(file_content):
         'unallocated_qty': float(unallocated_qty)
     }
 
-    # 6. WORK ALLOCATION SUMMARY
-    summary_df = allocation_df.groupby(['Group', 'HC', 'Eff']).agg({
+
+def plan_changeovers(allocation_df):
+    """Task switches: every task after a group's first"""
+    changeovers = allocation_df.groupby('Group', observed=True).size().sub(1).sum()
+    return max(int(changeovers), 0)
+
+
+def coalescing_report(allocation_df, task_df, by, n_weeks, base_rate):
+    """Tasks, changeovers and non-IDLE detailed plan rows without and with coalescing"""
+    def measure(df):
+        return {
+            'tasks': len(df),
+            'changeovers': plan_changeovers(df),
+            'scheduled_rows': scheduled_slots(df, n_weeks, SHIFT_HOURS, base_rate, len(SHIFTS_PER_WEEK)) * len(SHIFTS_PER_WEEK),
+        }
+
+    before, after = measure(allocation_df), measure(task_df)
+    return {'by': list(by), 'before': before, 'after': after, 'reduction_pct': reduction_pct(before, after)}
+
+
+def reduction_pct(before, after):
+    return {
+        key: round(100 * (before[key] - after[key]) / before[key], 2) if before[key] else 0.0
+        for key in before
+    }
+
+
+def allocation_summary(allocation_df, hours_per_horizon, base_rate, planning_horizon_weeks):
+    summary_df = allocation_df.groupby(['Group', 'HC', 'Eff'], observed=True).agg({
         'Allocated_Qty': 'sum'
     }).reset_index()
     
@@ -354,102 +693,11 @@ def process_plan(file_content):
         'Group', 'HC', 'Eff', 'Weekly Capacity (Units)', 'Total Capacity (Units)', 'Allocated_Qty'
     ]]
     summary_df.columns = ['Group', 'Average HC', 'Efficiency (%)', 'Weekly Capacity (Units)', 'Total Capacity (Units)', 'Allocated Units']
-    summary_data = summary_df.sort_values(by='Allocated Units', ascending=False).to_dict('records')
+    return summary_df.sort_values(by='Allocated Units', ascending=False)
 
-    # 7. DETAILED PLAN
-    plan_rows = []
-    
-    for group_name in group_stats[GROUPLINE_COL].unique():
-        group_work = allocation_df[allocation_df['Group'] == group_name].copy()
-        if group_work.empty: continue
-        
-        hc = group_work.iloc[0]['HC']
-        eff = group_work.iloc[0]['Eff']
-        cap_per_shift = hc * SHIFT_HOURS * base_rate * (eff / 100)
-        cap_per_week = cap_per_shift * 12  # 12 shifts per week
-        
-        tasks = []
-        for _, row in group_work.iterrows():
-            tasks.append({
-                'Style': row['Style'],
-                'SELL_STYLE': row['SELL_STYLE'],
-                'PACK_STYLE': row['PACK_STYLE'],
-                'SELL_COLOR': row['SELL_COLOR'],
-                'SELL_SIZE': row.get('SELL_SIZE', '-'),
-                'SELL_PACK': row.get('SELL_PACK', '-'),
-                'PRIMARY_DC': row.get('PRIMARY_DC', '-'),
-                'Qty': row['Allocated_Qty']
-            })
-        
-        current_task_idx = 0
-        
-        # ZERO CHANGEOVERS: Assign ONE style per week for all 12 shifts
-        for week in unique_weeks:
-            if current_task_idx >= len(tasks):
-                # No more tasks, mark entire week as IDLE
-                for shift in SHIFTS_PER_WEEK:
-                    plan_rows.append({
-                        'Week': int(week),
-                        'Group': group_name,
-                        'Shift': shift,
-                        'Style': 'IDLE',
-                        'SELL_STYLE': '-',
-                        'PACK_STYLE': '-',
-                        'SELL_COLOR': '-',
-                        'SELL_SIZE': '-',
-                        'SELL_PACK': '-',
-                        'PRIMARY_DC': '-',
-                        'Allocated Qty': 0.0,
-                        'Shift Capacity': float(cap_per_shift),
-                        'HC': float(hc),
-                        'Eff': float(eff)
-                    })
-                continue
-            
-            # Get current task
-            task = tasks[current_task_idx]
-            qty_remaining = task['Qty']
-            
-            # Allocate to this week (one style for all 12 shifts)
-            units_this_week = min(qty_remaining, cap_per_week)
-            units_per_shift = units_this_week / 12  # Distribute evenly across 12 shifts
-            
-            # Assign same style to all 12 shifts
-            for shift in SHIFTS_PER_WEEK:
-                plan_rows.append({
-                    'Week': int(week),
-                    'Group': group_name,
-                    'Shift': shift,
-                    'Style': task['Style'],
-                    'SELL_STYLE': task['SELL_STYLE'],
-                    'PACK_STYLE': task['PACK_STYLE'],
-                    'SELL_COLOR': task['SELL_COLOR'],
-                    'SELL_SIZE': task['SELL_SIZE'],
-                    'SELL_PACK': task.get('SELL_PACK', '-'),
-                    'PRIMARY_DC': task.get('PRIMARY_DC', '-'),
-                    'Allocated Qty': float(units_per_shift),
-                    'Shift Capacity': float(cap_per_shift),
-                    'HC': float(hc),
-                    'Eff': float(eff)
-                })
-            
-            # Update task remaining quantity
-            tasks[current_task_idx]['Qty'] -= units_this_week
-            
-            # Move to next task if current one complete
-            if tasks[current_task_idx]['Qty'] <= 0.1:
-                current_task_idx += 1
-
-    final_plan_df = pd.DataFrame(plan_rows)
-    
-    # Sort by Week, Group, then Shift (numerically) so shifts go s1, s2, ... s12 for each group in each week
-    if not final_plan_df.empty and 'Week' in final_plan_df.columns and 'Shift' in final_plan_df.columns:
-        # Extract shift number from 's1', 's2', etc. for proper numerical sorting
-        final_plan_df['shift_num'] = final_plan_df['Shift'].str.extract(r'(\d+)').astype(int)
-        final_plan_df = final_plan_df.sort_values(by=['Week', 'Group', 'shift_num'], ascending=True)
-        final_plan_df = final_plan_df.drop('shift_num', axis=1).reset_index(drop=True)
-    
-    # Prepare demand details table (sorted by quantity descending)
+
+def demand_details_table(demand_rows):
+    """Demand details table (sorted by quantity descending)"""
     # Select columns that actually exist
     detail_cols = [STYLE_COL]
     for col in ['SELL_STYLE', 'SELL_COLOR', 'SELL_SIZE', 'PACK_STYLE']:
@@ -462,12 +710,4 @@ def process_plan(file_content):
     
     # Rename columns for display
     col_rename = {STYLE_COL: 'Style', QTY_COL: 'Demand Qty'}
-    demand_details = demand_details.rename(columns=col_rename)
-    
-    return {
-        'kpi': kpi_data,
-        'summary': summary_data,
-        'demand_details': demand_details.to_dict('records'),
-        'detailed_plan': final_plan_df.to_dict('records'),
-        'planning_horizon': planning_horizon_weeks
-    }
+    return demand_details.rename(columns=col_rename)
@@ -1,14 +1,111 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
-import pandas as pd
-from io import BytesIO
-import logic   # <-- normal import (NOT: from . import logic)
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse
+from typing import List
+import hashlib
+import importlib.util
+import sys
+import tempfile
+from cache import PlanCache, plan_key
+from jobs import JobManager, QueueFull, DONE
+from metrics import PlanMetrics, timings_header
+from uploads import UploadSpool, UploadLimits, UploadTooLarge, NotAWorkbook, NoUpload
+from assets import StaticAssets
+import compression
+import json
 import os
 
+
+def _lazy_import(name):
+    """Module `name`, executed on first attribute access"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# The planner modules pull in pandas, numpy and scipy: they load on the first
+# request that needs them, so the server starts (and /healthz answers) quickly
+logic = _lazy_import('logic')
+optimize = _lazy_import('optimize')
+sharding = _lazy_import('sharding')
+exports = _lazy_import('exports')
+serialize = _lazy_import('serialize')
+scenarios = _lazy_import('scenarios')
+datasets = _lazy_import('datasets')
+
 app = FastAPI()
 
+# Planning runs in worker processes so the event loop keeps serving other requests
+plan_jobs = JobManager(
+    max_workers=int(os.environ.get('PLAN_WORKERS', min(2, os.cpu_count() or 1))),
+    max_pending=int(os.environ.get('PLAN_MAX_PENDING', 8)),
+)
+
+# Plan results keyed by upload content + planning constants.
+# PLAN_CACHE_DIR enables on-disk persistence across restarts.
+plan_cache = PlanCache(
+    max_entries=int(os.environ.get('PLAN_CACHE_MAX_ENTRIES', 32)),
+    max_bytes=int(os.environ.get('PLAN_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+    directory=os.environ.get('PLAN_CACHE_DIR') or None,
+    max_disk_bytes=int(os.environ.get('PLAN_CACHE_MAX_DISK_BYTES', 1024 * 1024 * 1024)),
+)
+plan_metrics = PlanMetrics()
+# What-if scenarios run one per process across all cores
+_scenario_runner = None
+
+def scenario_runner():
+    global _scenario_runner
+    if _scenario_runner is None:
+        _scenario_runner = scenarios.ScenarioRunner(
+            max_workers=int(os.environ.get('SCENARIO_WORKERS', os.cpu_count() or 1)),
+            max_scenarios=int(os.environ.get('SCENARIO_MAX_BATCH', 32)),
+        )
+    return _scenario_runner
+# Uploads are spooled to disk (PLAN_UPLOAD_DIR, default the temp dir) and
+# memory-mapped by the planner; oversize and excess concurrent uploads are
+# turned away before their body is read
+upload_spool = UploadSpool(
+    max_bytes=int(os.environ.get('PLAN_UPLOAD_MAX_BYTES', 100 * 1024 * 1024)),
+    max_in_flight=int(os.environ.get('PLAN_UPLOAD_MAX_IN_FLIGHT', 4)),
+    directory=os.environ.get('PLAN_UPLOAD_DIR') or None,
+)
+UPLOAD_PATHS = ("/api/generate-plan", "/api/download-plan", "/api/jobs", "/api/datasets")
+# The upload routes read their body themselves (see spool_upload); this documents it
+UPLOAD_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}}}}}}
+# Parsed workbooks staged as Feather files (PLAN_DATASET_DIR) that plans
+# memory-map instead of parsing the upload again
+_dataset_registry = None
+
+def dataset_registry():
+    global _dataset_registry
+    if _dataset_registry is None:
+        _dataset_registry = datasets.DatasetRegistry(
+            directory=os.environ.get('PLAN_DATASET_DIR') or os.path.join(tempfile.gettempdir(), 'plan-datasets'),
+            max_bytes=int(os.environ.get('PLAN_DATASET_MAX_BYTES', 1024 * 1024 * 1024)),
+        )
+    return _dataset_registry
+# PLAN_SHARD_BY=PLANT plans every upload sharded by that column (per request: ?shard_by=)
+SHARD_BY = os.environ.get('PLAN_SHARD_BY', '').strip()
+# Page size bounds of /api/plans/{id}/rows
+ROWS_DEFAULT_LIMIT = 500
+ROWS_MAX_LIMIT = 5000
+# PLAN_TIMINGS_HEADER=1 adds per-stage timings to plan responses
+TIMINGS_HEADER = os.environ.get('PLAN_TIMINGS_HEADER', '0') == '1'
+
+# Encoded (and compressed) response bodies per plan, format and content-encoding
+response_cache = PlanCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 64)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+)
+
+app.add_middleware(UploadLimits, spool=upload_spool, paths=UPLOAD_PATHS)
+
 # Enable CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -16,47 +113,602 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Plan-Id", "X-Cache", "Content-Encoding", "X-Plan-Timings"],
 )
 
-# Since all files (index.html, style.css, script.js) are in SAME folder:
-app.mount("/static", StaticFiles(directory="."), name="static")
+# The frontend files (in the same folder), precompressed and fingerprinted
+static_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)), {
+    "/": "index.html",
+    "/style.css": "style.css",
+    "/script.js": "script.js",
+})
 
 @app.get("/")
-def read_root():
-    return FileResponse('index.html')
-
 @app.get("/style.css")
-def read_style():
-    return FileResponse('style.css')
-
 @app.get("/script.js")
-def read_script():
-    return FileResponse('script.js')
+def read_asset(
+    request: Request,
+    v: str = Query(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
+    return static_assets.response(request.url.path, v, accept_encoding, if_none_match)
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: answers without loading the planner"""
+    return {'status': 'ok', 'plan_jobs_active': plan_jobs.active()}
 
 @app.get("/api/template")
-def get_template():
+def get_template(if_none_match: str = Header(None)):
     try:
-        output = logic.generate_template_file()
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=data_detail_template.xlsx"}
-        )
+        body = logic.template_bytes()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    headers = {
+        "ETag": f'"{hashlib.sha256(body).hexdigest()[:20]}"',
+        "Cache-Control": "no-cache",
+        "Content-Disposition": "attachment; filename=data_detail_template.xlsx",
+    }
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=body,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=headers,
+    )
 
-@app.post("/api/generate-plan")
-async def generate_plan(file: UploadFile = File(...)):
-    if not file.filename.endswith('.xlsx'):
-        raise HTTPException(status_code=400, detail="Invalid file format. Please upload an Excel file.")
+@app.post("/api/generate-plan", openapi_extra=UPLOAD_BODY)
+async def generate_plan(
+    request: Request,
+    format: str = Query(None),
+    table: str = Query('detailed_plan'),
+    tables: str = Query(None),
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    shard_by: str = Query(None),
+    coalesce: str = Query(None),
+    accept: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
+    try:
+        fmt = serialize.negotiate_format(accept, format)
+    except serialize.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    options = plan_options(engine, time_budget, shard_by, coalesce)
+    tables = requested_tables(tables)
+    upload = await spool_upload(request)
     
     try:
-        contents = await file.read()
-        result = logic.process_plan(contents)
-        return JSONResponse(content=result)
+        plan_id, result, cache_status = await get_or_run_plan(upload, options)
+        return plan_response(plan_id, result, fmt, table, accept_encoding, if_none_match, cache_status, tables)
+    except HTTPException:
+        raise
+    except serialize.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
+
+async def spool_upload(request):
+    """
+    The request's 'file' part streamed to disk as it arrives, bounded by
+    PLAN_UPLOAD_MAX_BYTES; it must be an .xlsx workbook
+    """
+    try:
+        return await upload_spool.spool(request)
+    except NoUpload as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except NotAWorkbook as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def plan_options(engine, time_budget, shard_by=None, coalesce=None):
+    """run_plan options for the engine (default greedy), sharding and coalescing query parameters"""
+    engine = engine or optimize.GREEDY_ENGINE
+    if engine not in optimize.ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of: {', '.join(optimize.ENGINES)}")
+    if engine == optimize.OPTIMAL_ENGINE and optimize.linprog is None:
+        raise HTTPException(status_code=400, detail="The 'optimal' engine requires the 'scipy' package")
+    options = {}
+    if engine != optimize.GREEDY_ENGINE:
+        options.update(engine=engine, time_budget=time_budget)
+    # shard_by='' turns off the configured default
+    shard_by = SHARD_BY if shard_by is None else shard_by.strip()
+    if shard_by:
+        options['shard_by'] = shard_by
+    if coalesce:
+        # ?coalesce=style,color: style is implied, order does not matter
+        keys = {key.strip().lower() for key in coalesce.split(',') if key.strip()} | {'style'}
+        try:
+            logic.coalesce_columns(keys)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        options['coalesce'] = tuple(sorted(keys))
+    return options
+
+def requested_tables(tables):
+    """The tables a records/columnar response carries (?tables=summary,demand_details); all by default"""
+    if tables is None:
+        return tuple(logic.TABLES)
+    names = tuple(name.strip() for name in tables.split(',') if name.strip())
+    unknown = [name for name in names if name not in logic.TABLES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown table(s): {', '.join(unknown)}. Use: {', '.join(logic.TABLES)}")
+    return names
+
+def upload_plan_id(upload, options):
+    # Default options keep the plain content key so existing cache entries stay valid
+    with upload.view() as contents:
+        return plan_key(contents, logic.BASE_OUTPUT_100_EFF, logic.SHIFT_HOURS, *sorted(options.items()))
+
+async def get_or_run_plan(upload, options=None):
+    """
+    Cached plan for this spooled upload, or run it in the job pool and wait.
+    The upload is released once no job needs it.
+    """
+    options = options or {}
+    try:
+        plan_id = upload_plan_id(upload, options)
+    except BaseException:
+        upload.release()
+        raise
+    return await cached_plan(plan_id, upload.path, options, upload.release)
+
+async def cached_plan(plan_id, source, options, release=None):
+    """Plan plan_id from the cache, or plan source (a path or Dataset) in the job pool and wait"""
+    try:
+        result = plan_cache.get(plan_id)
+        plan_metrics.inc('plan_requests_total', cache="hit" if result is not None else "miss")
+        if result is not None:
+            if release is not None:
+                release()
+            return plan_id, result, "HIT"
+        job = submit_plan_job(source, plan_id, options, keep_result=True, release=release)
+    except BaseException:
+        if release is not None:
+            release()
+        raise
+    await plan_jobs.wait(job)
+    if job.status != DONE:
+        raise HTTPException(status_code=500, detail=f"Error processing plan: {job.error or job.status}")
+    result, job.result = job.result, None
+    return plan_id, result, "MISS"
+
+def cache_plan(plan_id, result):
+    """Cache a plan result with its row index built, so the cache size counts the index too"""
+    logic.plan_index(result)
+    plan_cache.put(plan_id, result, logic.plan_nbytes(result))
+
+def submit_plan_job(source, plan_id, options=None, keep_result=False, release=None):
+    """
+    Plan source in a worker: a spooled upload's path or a Dataset, both of
+    which the worker memory-maps. release() runs when the job ends.
+    """
+    def cache_result(job):
+        plan_metrics.observe_plan(job.result['timings'])
+        cache_plan(plan_id, job.result)
+
+    try:
+        run = sharding.run_sharded_plan if (options or {}).get('shard_by') else logic.run_plan
+        job = plan_jobs.submit(run, source, on_done=cache_result, keep_result=keep_result,
+                               meta={'plan_id': plan_id}, **(options or {}))
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    if release is not None:
+        job.future.add_done_callback(lambda future: release())
+    return job
+
+def plan_response(plan_id, result, fmt, table, accept_encoding, if_none_match, cache_status, tables=None):
+    """Encode a plan result for the negotiated format/encoding, reusing cached bodies"""
+    tables = tuple(logic.TABLES) if tables is None else tables
+    encoding = compression.negotiate_encoding(accept_encoding)
+    subset = "+".join(tables) if fmt != serialize.ARROW and tables != tuple(logic.TABLES) else None
+    variant = ".".join(part for part in (fmt, table if fmt == serialize.ARROW else None, subset, encoding) if part)
+    headers = {
+        "ETag": f'"{plan_id}.{variant}"',
+        "X-Plan-Id": plan_id,
+        "X-Cache": cache_status,
+        "Vary": "Accept, Accept-Encoding",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if TIMINGS_HEADER and result.get('timings'):
+        headers["X-Plan-Timings"] = timings_header(result['timings'])
+
+    # Same bytes + same constants always produce the same plan
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    body_key = f"{plan_id}.{variant}"
+    body = response_cache.get(body_key)
+    if body is None:
+        body = compression.compress(serialize.encode(result, fmt, table, tables), encoding)
+        response_cache.put(body_key, body, len(body))
+    return Response(content=body, media_type=serialize.MEDIA_TYPES[fmt], headers=headers)
+
+@app.post("/api/download-plan", openapi_extra=UPLOAD_BODY)
+async def download_plan(
+    request: Request,
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    shard_by: str = Query(None),
+    coalesce: str = Query(None),
+):
+    options = plan_options(engine, time_budget, shard_by, coalesce)
+    upload = await spool_upload(request)
+    try:
+        _, result, _ = await get_or_run_plan(upload, options)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
+    return export_response(result, None, 'xlsx', 'plan')
+
+def export_response(result, table, format, filename):
+    if format == 'csv':
+        return StreamingResponse(
+            exports.csv_chunks(result[table]),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}.csv"}
+        )
+    return StreamingResponse(
+        exports.xlsx_chunks(result, [table] if table else None),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={filename}.xlsx"}
+    )
+
+@app.get("/api/plans/{plan_id}")
+def get_plan(
+    plan_id: str,
+    format: str = Query(None),
+    table: str = Query('detailed_plan'),
+    tables: str = Query(None),
+    accept: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
+    tables = requested_tables(tables)
+    result = plan_cache.get(plan_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Plan not found. Upload the workbook again.")
+    try:
+        fmt = serialize.negotiate_format(accept, format)
+        return plan_response(plan_id, result, fmt, table, accept_encoding, if_none_match, "HIT", tables)
+    except serialize.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+@app.get("/api/plans/{plan_id}/rows")
+def plan_rows(
+    plan_id: str,
+    week: List[int] = Query(None),
+    group: List[str] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(ROWS_DEFAULT_LIMIT, ge=1, le=ROWS_MAX_LIMIT),
+):
+    """One page of detailed plan rows, optionally only some weeks and/or groups (repeat the parameter)"""
+    result = plan_cache.get(plan_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Plan not found. Upload the workbook again.")
+    positions, total = logic.plan_index(result).rows(week, group, offset, limit)
+    return {
+        'plan_id': plan_id,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'rows': result['detailed_plan'].iloc[positions].to_dict('records'),
+    }
+
+@app.get("/api/plans/{plan_id}/group-weeks")
+def plan_group_weeks(plan_id: str):
+    """Allocated units of every group per week, for the weekly chart"""
+    result = plan_cache.get(plan_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Plan not found. Upload the workbook again.")
+    return {'plan_id': plan_id, **logic.plan_index(result).group_weeks()}
+
+@app.get("/api/plans/{plan_id}/export")
+def export_plan(plan_id: str, table: str = Query(None), format: str = Query('csv')):
+    """Stream one table as CSV, or the whole plan (or one table) as XLSX, from a cached plan"""
+    if format not in ('csv', 'xlsx'):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'xlsx'")
+    if table is not None and table not in exports.EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"table must be one of: {', '.join(exports.EXPORT_TABLES)}")
+    if format == 'csv' and table is None:
+        table = 'detailed_plan'
+    result = plan_cache.get(plan_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Plan not found. Upload the workbook again.")
+    return export_response(result, table, format, table or 'plan')
+
+@app.post("/api/plans/{plan_id}/replan")
+def replan_plan(plan_id: str, delta: dict = Body(...)):
+    """
+    Apply demand changes ({added, removed, changed}) to a cached plan. Only the
+    touched styles are reallocated; the new plan is cached under its own id and
+    the response carries the allocation and detailed-plan diff.
+    """
+    base = plan_cache.get(plan_id)
+    if base is None:
+        raise HTTPException(status_code=404, detail="Plan not found. Upload the workbook again.")
+    try:
+        result, diff = logic.replan(base, delta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    new_plan_id = plan_key(plan_id.encode(), json.dumps(delta, sort_keys=True, default=str))
+    cache_plan(new_plan_id, result)
+    plan_metrics.inc('plan_replans_total')
+    headers = {"X-Plan-Id": new_plan_id}
+    if TIMINGS_HEADER:
+        headers["X-Plan-Timings"] = timings_header(result['timings'])
+    return JSONResponse({
+        'plan_id': new_plan_id,
+        'base_plan_id': plan_id,
+        'result_url': f"/api/plans/{new_plan_id}",
+        'kpi': result['kpi'],
+        'planning_horizon': result['planning_horizon'],
+        'diff': diff,
+    }, headers=headers)
+
+@app.post("/api/plans/{plan_id}/scenarios")
+async def run_scenarios(plan_id: str, body: dict = Body(...)):
+    """
+    Plan {"scenarios": [{name, eff, eff_scale, hc, hc_delta, shift_hours,
+    shifts_per_week, include, exclude}, ...]} against a cached plan's data and
+    compare their KPIs with the plan's own.
+    """
+    base = plan_cache.get(plan_id)
+    if base is None:
+        raise HTTPException(status_code=404, detail="Plan not found. Upload the workbook again.")
+    try:
+        comparison = await scenario_runner().run(base, body.get('scenarios'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    plan_metrics.inc('plan_scenarios_total', len(comparison['scenarios']) - 1)
+    return {'plan_id': plan_id, **comparison}
+
+# --- Plan jobs: submit, poll, stream progress, cancel ---
+
+def job_status(job):
+    status = job.to_dict()
+    if job.status == DONE:
+        status['result_url'] = f"/api/plans/{job.meta['plan_id']}"
+    return status
+
+def get_job_or_404(job_id):
+    job = plan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/jobs", status_code=202, openapi_extra=UPLOAD_BODY)
+async def create_job(
+    request: Request,
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    shard_by: str = Query(None),
+    coalesce: str = Query(None),
+):
+    options = plan_options(engine, time_budget, shard_by, coalesce)
+    upload = await spool_upload(request)
+    try:
+        plan_id = upload_plan_id(upload, options)
+        if plan_cache.get(plan_id) is not None:
+            upload.release()
+            job = plan_jobs.finished_job(None, meta={'plan_id': plan_id})
+        else:
+            job = submit_plan_job(upload.path, plan_id, options, release=upload.release)
+    except BaseException:
+        upload.release()
+        raise
+    return job_status(job)
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    return job_status(get_job_or_404(job_id))
+
+@app.get("/api/jobs/{job_id}/events")
+def job_events(job_id: str):
+    job = get_job_or_404(job_id)
+    return StreamingResponse(
+        plan_jobs.events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    return job_status(plan_jobs.cancel(job_id))
+
+# --- Datasets: a workbook parsed once, planned, exported and compared by id ---
+
+def dataset_plan_id(dataset_id, options):
+    return plan_key(dataset_id.encode(), logic.BASE_OUTPUT_100_EFF, logic.SHIFT_HOURS, *sorted(options.items()))
+
+def open_dataset_or_404(dataset_id):
+    dataset = dataset_registry().open(dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="Dataset not found. Upload the workbook to /api/datasets again.")
+    return dataset
+
+def dataset_status(info):
+    return {**info, 'plan_url': f"/api/datasets/{info['id']}/plan"}
+
+@app.post("/api/datasets", openapi_extra=UPLOAD_BODY)
+async def create_dataset(request: Request):
+    """
+    Parse a workbook and stage its plan sheets as memory-mappable Feather
+    files under the workbook's content hash (201; 200 when already staged).
+    """
+    if not datasets.ARROW_AVAILABLE:
+        raise HTTPException(status_code=400, detail="Datasets require the 'pyarrow' package")
+    upload = await spool_upload(request)
+    try:
+        with upload.view() as contents:
+            dataset_id = plan_key(contents)
+        info = dataset_registry().info(dataset_id)
+        if info is not None:
+            upload.release()
+            dataset_registry().open(dataset_id)
+            return dataset_status(info)
+        job = plan_jobs.submit(logic.stage_dataset, upload.path, dataset_registry().directory, dataset_id, upload.filename,
+                               keep_result=True, meta={'dataset_id': dataset_id})
+    except QueueFull as e:
+        upload.release()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except BaseException:
+        upload.release()
+        raise
+    job.future.add_done_callback(lambda future: upload.release())
+    await plan_jobs.wait(job)
+    if job.status != DONE:
+        raise HTTPException(status_code=500, detail=f"Error staging dataset: {job.error or job.status}")
+    info, job.result = job.result, None
+    if dataset_id in dataset_registry().trim():
+        raise HTTPException(status_code=413, detail=f"Dataset exceeds the {dataset_registry().max_bytes} byte dataset budget")
+    return JSONResponse(dataset_status(info), status_code=201)
+
+@app.get("/api/datasets")
+def list_datasets():
+    """Staged datasets, most recently used first, and their total size against PLAN_DATASET_MAX_BYTES"""
+    datasets = dataset_registry().list()
+    return {
+        'datasets': [dataset_status(info) for info in datasets],
+        'bytes': sum(info['bytes'] for info in datasets),
+        'max_bytes': dataset_registry().max_bytes,
+    }
+
+@app.get("/api/datasets/{dataset_id}")
+def get_dataset(dataset_id: str):
+    info = dataset_registry().info(dataset_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return dataset_status(info)
+
+@app.delete("/api/datasets/{dataset_id}", status_code=204)
+def delete_dataset(dataset_id: str):
+    if not dataset_registry().delete(dataset_id):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return Response(status_code=204)
+
+@app.post("/api/datasets/{dataset_id}/plan")
+async def plan_dataset(
+    dataset_id: str,
+    format: str = Query(None),
+    table: str = Query('detailed_plan'),
+    tables: str = Query(None),
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    shard_by: str = Query(None),
+    coalesce: str = Query(None),
+    accept: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
+    """/api/generate-plan for a staged dataset"""
+    try:
+        fmt = serialize.negotiate_format(accept, format)
+    except serialize.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    options = plan_options(engine, time_budget, shard_by, coalesce)
+    tables = requested_tables(tables)
+    dataset = open_dataset_or_404(dataset_id)
+    try:
+        plan_id, result, cache_status = await cached_plan(dataset_plan_id(dataset.id, options), dataset, options)
+        return plan_response(plan_id, result, fmt, table, accept_encoding, if_none_match, cache_status, tables)
+    except HTTPException:
+        raise
+    except serialize.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
 
-@app.post("/api/download-plan")
-async def download_plan(file: UploadFile = File(...)):
-    return {"message": "Use frontend to export CSV from data"}
+@app.post("/api/datasets/{dataset_id}/jobs", status_code=202)
+def create_dataset_job(
+    dataset_id: str,
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    shard_by: str = Query(None),
+    coalesce: str = Query(None),
+):
+    """/api/jobs for a staged dataset"""
+    options = plan_options(engine, time_budget, shard_by, coalesce)
+    dataset = open_dataset_or_404(dataset_id)
+    plan_id = dataset_plan_id(dataset.id, options)
+    if plan_cache.get(plan_id) is not None:
+        job = plan_jobs.finished_job(None, meta={'plan_id': plan_id})
+    else:
+        job = submit_plan_job(dataset, plan_id, options)
+    return job_status(job)
+
+@app.get("/api/datasets/{dataset_id}/export")
+async def export_dataset(
+    dataset_id: str,
+    table: str = Query(None),
+    format: str = Query('xlsx'),
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    shard_by: str = Query(None),
+    coalesce: str = Query(None),
+):
+    """The dataset's plan (planned unless cached) as XLSX, or one table as CSV or XLSX"""
+    if format not in ('csv', 'xlsx'):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'xlsx'")
+    if table is not None and table not in exports.EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"table must be one of: {', '.join(exports.EXPORT_TABLES)}")
+    if format == 'csv' and table is None:
+        table = 'detailed_plan'
+    options = plan_options(engine, time_budget, shard_by, coalesce)
+    dataset = open_dataset_or_404(dataset_id)
+    try:
+        _, result, _ = await cached_plan(dataset_plan_id(dataset.id, options), dataset, options)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
+    return export_response(result, table, format, table or 'plan')
+
+@app.post("/api/datasets/{dataset_id}/scenarios")
+async def run_dataset_scenarios(
+    dataset_id: str,
+    body: dict = Body(...),
+    engine: str = Query(None),
+    time_budget: float = Query(None, gt=0),
+    coalesce: str = Query(None),
+):
+    """/api/plans/{plan_id}/scenarios against the dataset's plan (unsharded: sharded plans keep no planning state)"""
+    options = plan_options(engine, time_budget, '', coalesce)
+    dataset = open_dataset_or_404(dataset_id)
+    try:
+        plan_id, base, _ = await cached_plan(dataset_plan_id(dataset.id, options), dataset, options)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing plan: {str(e)}")
+    try:
+        comparison = await scenario_runner().run(base, body.get('scenarios'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    plan_metrics.inc('plan_scenarios_total', len(comparison['scenarios']) - 1)
+    return {'plan_id': plan_id, 'dataset_id': dataset.id, **comparison}
+
+@app.get("/metrics")
+def metrics():
+    gauges = {
+        'plan_jobs_active': plan_jobs.active(),
+        'plan_cache_entries': len(plan_cache),
+        'plan_cache_bytes': plan_cache.nbytes,
+        'plan_uploads_in_flight': upload_spool.in_flight(),
+    }
+    if _dataset_registry is not None:
+        gauges['plan_dataset_bytes'] = _dataset_registry.nbytes()
+    return PlainTextResponse(plan_metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    plan_jobs.shutdown()
+    if _scenario_runner is not None:
+        _scenario_runner.shutdown()
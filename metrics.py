@@ -0,0 +1,177 @@
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Instrument:
+    """
+    Receives planner stage events. Subclass and override what you need, then
+    pass instances to logic.run_plan(instruments=[...]).
+    """
+
+    def stage_started(self, stage):
+        pass
+
+    def stage_finished(self, record):
+        """record: {'stage', 'seconds', 'rows', 'peak_bytes', 'max_rss_bytes'}"""
+        pass
+
+
+class ProgressInstrument(Instrument):
+    """Adapts a plain progress(stage) callback"""
+
+    def __init__(self, progress):
+        self.progress = progress
+
+    def stage_started(self, stage):
+        self.progress(stage)
+
+
+def _max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class StageTimer:
+    """
+    Times consecutive planner stages: start(stage) closes the previous one.
+
+    Each record carries wall time, a row count set with rows(), the process'
+    peak RSS so far and, when trace_memory is on, the peak Python allocation
+    during the stage (tracemalloc; noticeably slower, so off by default).
+    """
+
+    def __init__(self, instruments=(), trace_memory=False):
+        self.instruments = list(instruments)
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stage = None
+        self._started = None
+        self._rows = None
+        self._owns_tracemalloc = False
+
+    def start(self, stage):
+        self._close()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracemalloc = True
+            tracemalloc.reset_peak()
+        for instrument in self.instruments:
+            instrument.stage_started(stage)
+        self._stage = stage
+        self._rows = None
+        self._started = time.perf_counter()
+
+    def rows(self, count):
+        self._rows = int(count)
+
+    def finish(self):
+        self._close()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        return self.records
+
+    def _close(self):
+        if self._stage is None:
+            return
+        seconds = time.perf_counter() - self._started
+        record = {
+            'stage': self._stage,
+            'seconds': seconds,
+            'rows': self._rows,
+            'peak_bytes': tracemalloc.get_traced_memory()[1] if self.trace_memory else None,
+            'max_rss_bytes': _max_rss_bytes(),
+        }
+        self.records.append(record)
+        self._stage = None
+        for instrument in self.instruments:
+            instrument.stage_finished(record)
+
+
+def timings_header(records):
+    """Compact X-Plan-Timings value: stage=seconds pairs"""
+    return ", ".join(f"{r['stage']}={r['seconds']:.4f}" for r in records)
+
+
+class PlanMetrics:
+    """
+    Process-wide planner metrics rendered in the Prometheus text format.
+    Stage durations are histograms; rows and peak memory are per-stage gauges
+    of the last run.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stage_counts = {}    # stage -> [bucket counts..., count, sum]
+        self._stage_rows = {}
+        self._stage_peak = {}
+        self._max_rss = 0
+        self._counters = {}        # (name, labels) -> value
+
+    def observe_plan(self, records):
+        with self._lock:
+            for record in records:
+                stage = record['stage']
+                hist = self._stage_counts.setdefault(stage, [0] * (len(self.BUCKETS) + 2))
+                for i, bound in enumerate(self.BUCKETS):
+                    if record['seconds'] <= bound:
+                        hist[i] += 1
+                hist[-2] += 1
+                hist[-1] += record['seconds']
+                if record['rows'] is not None:
+                    self._stage_rows[stage] = record['rows']
+                if record['peak_bytes'] is not None:
+                    self._stage_peak[stage] = record['peak_bytes']
+                self._max_rss = max(self._max_rss, record['max_rss_bytes'] or 0)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render(self, gauges=None):
+        lines = []
+        with self._lock:
+            lines.append('# HELP plan_stage_seconds Wall time of each planner stage')
+            lines.append('# TYPE plan_stage_seconds histogram')
+            for stage, hist in sorted(self._stage_counts.items()):
+                for bound, count in zip(self.BUCKETS, hist):
+                    lines.append(f'plan_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'plan_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[-2]}')
+                lines.append(f'plan_stage_seconds_count{{stage="{stage}"}} {hist[-2]}')
+                lines.append(f'plan_stage_seconds_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+
+            lines.append('# HELP plan_stage_rows Rows produced by each stage in the last plan')
+            lines.append('# TYPE plan_stage_rows gauge')
+            for stage, rows in sorted(self._stage_rows.items()):
+                lines.append(f'plan_stage_rows{{stage="{stage}"}} {rows}')
+
+            if self._stage_peak:
+                lines.append('# HELP plan_stage_peak_bytes Peak Python allocation during each stage in the last plan')
+                lines.append('# TYPE plan_stage_peak_bytes gauge')
+                for stage, peak in sorted(self._stage_peak.items()):
+                    lines.append(f'plan_stage_peak_bytes{{stage="{stage}"}} {peak}')
+
+            lines.append('# HELP plan_worker_max_rss_bytes Highest peak RSS reported by a plan worker')
+            lines.append('# TYPE plan_worker_max_rss_bytes gauge')
+            lines.append(f'plan_worker_max_rss_bytes {self._max_rss}')
+
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f'# TYPE {name} counter')
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter != name:
+                        continue
+                    label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+
+        for name, value in (gauges or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
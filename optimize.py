@@ -0,0 +1,277 @@
+"""
+Optimal allocation engine: the greedy's demand -> groupline assignment
+solved as one min-cost flow LP (scipy's HiGHS).
+
+Demand rows with the same affinity key cost the same on every groupline, so
+they are aggregated into one source per key. Each key sends flow directly to
+its affinity grouplines (cost by rank) or through a shared pool node to any
+groupline (Phase 2); that keeps the model linear in the size of the affinity
+index instead of keys x grouplines. The solution is allocated back to the
+demand rows keeping each row whole where it fits, since every split is a
+changeover.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from allocation import AFFINITY, GREEDY, make_records
+
+GREEDY_ENGINE = 'greedy'
+OPTIMAL_ENGINE = 'optimal'
+ENGINES = (GREEDY_ENGINE, OPTIMAL_ENGINE)
+DEFAULT_TIME_BUDGET = 10.0
+
+# Per-unit rewards: allocating anything dominates, then affinity (by rank),
+# then efficiency
+ALLOCATION_REWARD = 10.0
+AFFINITY_REWARD = 1.0
+EFF_REWARD = 0.5
+# Each changeover (a groupline's allocations after its first) costs as much
+# as leaving 20 units unallocated. The LP cannot see it; it is charged when
+# the whole-row allocation is compared with the greedy's
+CHANGEOVER_COST = 20 * ALLOCATION_REWARD
+MIN_PIECE = 1e-6
+
+try:
+    from scipy.optimize import linprog
+    from scipy.sparse import coo_matrix
+except ImportError:
+    linprog = None
+
+
+def _split(a, b):
+    """
+    Overlay two sequences of amounts with the same total: piece j covers
+    part of a[ia[j]] and of b[ib[j]]. Pieces come out in sequence order.
+    """
+    ends_a = np.cumsum(a)
+    ends_b = np.cumsum(b)
+    bounds = np.union1d(ends_a, ends_b)
+    starts = np.concatenate(([0.0], bounds[:-1]))
+    amounts = bounds - starts
+    ia = np.searchsorted(ends_a, starts, side='right')
+    ib = np.searchsorted(ends_b, starts, side='right')
+    keep = (amounts > MIN_PIECE) & (ia < len(a)) & (ib < len(b))
+    return ia[keep], ib[keep], amounts[keep]
+
+
+def _affinity_pairs(index, keys):
+    """(source, group, rank) for every deduplicated affinity group of the used keys"""
+    starts = index.ptr[keys]
+    counts = index.ptr[keys + 1] - starts
+    source = np.repeat(np.arange(len(keys)), counts)
+    position = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    group = index.groups[position]
+    valid = group >= 0
+    source, group = source[valid], group[valid]
+    # Keep each (source, group) at its best rank
+    _, first = np.unique(source * (group.max(initial=0) + 1) + group, return_index=True)
+    first.sort()
+    source, group = source[first], group[first]
+    rank = np.arange(len(source)) - np.searchsorted(source, source)
+    return source, group, rank
+
+
+class _Model:
+    def __init__(self, index, demand_keys, qty, capacity, eff):
+        self.capacity = capacity
+        n_groups = len(capacity)
+        self.n_demand = len(qty)
+        open_rows = np.flatnonzero(qty > 0)
+        sources, self.row_source = np.unique(demand_keys[open_rows], return_inverse=True)
+        self.rows = open_rows
+        self.row_qty = qty[open_rows]
+        self.source_qty = np.bincount(self.row_source, weights=qty[open_rows], minlength=len(sources))
+
+        keyed = np.flatnonzero(sources >= 0)
+        pair_source, pair_group, pair_rank = _affinity_pairs(index, sources[keyed])
+        self.pair_source = keyed[pair_source]
+        self.pair_group = pair_group
+        self.pair_rank = pair_rank
+
+        eff_bonus = EFF_REWARD * eff / max(eff.max(initial=0), 1e-9)
+        self.pair_cost = -(ALLOCATION_REWARD + AFFINITY_REWARD * (1 + 1 / (1 + pair_rank)) + eff_bonus[pair_group])
+        self.pool_cost = -(ALLOCATION_REWARD + eff_bonus)
+        self.n_sources = len(sources)
+        self.n_groups = n_groups
+        self._pair_codes = pd.Index(self.pair_source * n_groups + self.pair_group)
+
+    @property
+    def n_variables(self):
+        return len(self.pair_source) + self.n_sources + self.n_groups
+
+    def solve(self, time_limit):
+        """Returns (status, pair flows, source -> pool flows, pool -> group flows, objective)"""
+        n_pairs, n_sources, n_groups = len(self.pair_source), self.n_sources, self.n_groups
+        c = np.concatenate([self.pair_cost, np.zeros(n_sources), self.pool_cost])
+        pool_in = n_pairs + np.arange(n_sources)
+        pool_out = n_pairs + n_sources + np.arange(n_groups)
+
+        # Rows: one per source (its demand), then one per group (its capacity)
+        rows = np.concatenate([self.pair_source, np.arange(n_sources),
+                               n_sources + self.pair_group, n_sources + np.arange(n_groups)])
+        cols = np.concatenate([np.arange(n_pairs), pool_in, np.arange(n_pairs), pool_out])
+        a_ub = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_sources + n_groups, len(c))).tocsr()
+        b_ub = np.concatenate([self.source_qty, np.maximum(self.capacity, 0)])
+        # Pool conservation: what enters leaves
+        a_eq = coo_matrix((np.concatenate([np.ones(n_sources), -np.ones(n_groups)]),
+                           (np.zeros(n_sources + n_groups, dtype=np.int64), np.concatenate([pool_in, pool_out]))),
+                          shape=(1, len(c))).tocsr()
+
+        res = linprog(c, A_ub=a_ub, b_ub=b_ub, A_eq=a_eq, b_eq=[0.0], bounds=(0, None), method='highs',
+                      options={'time_limit': max(time_limit, 0.01), 'presolve': True})
+        if res.status != 0 or res.x is None:
+            return {1: 'time_limit', 2: 'infeasible', 3: 'unbounded'}.get(res.status, 'failed'), None, None, None, None
+        x = np.where(res.x > MIN_PIECE, res.x, 0.0)
+        return 'optimal', x[:n_pairs], x[n_pairs:n_pairs + n_sources], x[n_pairs + n_sources:], float(res.fun)
+
+    def objective(self, records):
+        """
+        Objective of an allocation (e.g. the greedy one): its per-unit costs
+        plus CHANGEOVER_COST for each of its changeovers, which the LP only
+        approximates
+        """
+        source = np.full(self.n_demand, -1, dtype=np.int64)
+        source[self.rows] = self.row_source
+        cost, _ = self.cost(source[records['demand']], records['group'])
+        return float((cost * records['qty']).sum()) + CHANGEOVER_COST * _changeovers(records)
+
+    def cost(self, source, group):
+        """Per-unit cost of source's demand on each of group (arrays of the same length), and whether it is affinity"""
+        pair = self._pair_codes.get_indexer(source * self.n_groups + group)
+        cost = self.pool_cost[group]
+        affinity = pair >= 0
+        cost[affinity] = self.pair_cost[pair[affinity]]
+        return cost, affinity
+
+    def records(self, pair_flow, pool_in, pool_out):
+        """
+        Allocation records for the source-level flows. Every split of a demand
+        row over grouplines is a changeover, so rows are kept whole: largest
+        first, each goes to the best-fitting flow of its source that still
+        has room for all of it. The rows no flow can take whole go, largest
+        first, to the cheapest groupline with room for them; a row no
+        groupline can take whole fills the largest leftover, and its rest is
+        spread over what remains at the end.
+        """
+        # Pool flow: any source may go to any group at the same cost
+        pool_source, pool_group, pool_amount = _split(pool_in, pool_out)
+        used = pair_flow > 0
+        flow_source = np.concatenate([self.pair_source[used], pool_source])
+        flow_group = np.concatenate([self.pair_group[used], pool_group])
+        flow_amount = np.concatenate([pair_flow[used], pool_amount])
+        room = [{} for _ in range(self.n_sources)]
+        for source, group, amount in zip(flow_source.tolist(), flow_group.tolist(), flow_amount.tolist()):
+            room[source][group] = room[source].get(group, 0.0) + amount
+
+        left = np.maximum(self.capacity, 0).astype(float)
+        demand, group, amounts = [], [], []
+
+        def place(row, g, amount):
+            left[g] -= amount
+            demand.append(row)
+            group.append(g)
+            amounts.append(amount)
+
+        # Largest rows first; ties in demand order
+        by_size = np.lexsort((self.rows, -self.row_qty))
+        deferred = []
+        for position in by_size.tolist():
+            row, source, row_qty = self.rows[position], self.row_source[position], self.row_qty[position]
+            fits = [(r, g) for g, r in room[source].items() if r >= row_qty - MIN_PIECE and left[g] >= row_qty - MIN_PIECE]
+            if not fits:
+                deferred.append(position)
+                continue
+            _, g = min(fits)
+            room[source][g] -= row_qty
+            place(row, g, row_qty)
+
+        rest = []
+        for position in deferred:
+            row, source, row_qty = self.rows[position], self.row_source[position], self.row_qty[position]
+            fits = np.flatnonzero(left >= row_qty - MIN_PIECE)
+            if len(fits):
+                place(row, fits[np.argmin(self.cost(np.full(len(fits), source), fits)[0])], row_qty)
+                continue
+            g = int(np.argmax(left))
+            if left[g] > MIN_PIECE:
+                rest.append((row, row_qty - left[g]))
+                place(row, g, left[g])
+        for row, row_qty in rest:
+            while row_qty > MIN_PIECE and left.max(initial=0) > MIN_PIECE:
+                g = int(np.argmax(left))
+                amount = min(row_qty, left[g])
+                row_qty -= amount
+                place(row, g, amount)
+
+        demand = np.asarray(demand, dtype=np.int64)
+        group = np.asarray(group, dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=float)
+        source = np.full(self.n_demand, -1, dtype=np.int64)
+        source[self.rows] = self.row_source
+        phase = np.where(self.cost(source[demand], group)[1], AFFINITY, GREEDY)
+
+        # Demand order, as the greedy writes them; group_cap is the group's
+        # remaining capacity before the slice plus the slice, like the greedy's
+        order = np.argsort(demand, kind='stable')
+        demand, group, amounts, phase = demand[order], group[order], amounts[order], phase[order]
+        used_before = pd.Series(amounts).groupby(group).cumsum().to_numpy() - amounts
+        group_cap = self.capacity[group] - used_before + amounts
+        return make_records(demand, group, amounts, group_cap, phase)
+
+
+def _changeovers(records):
+    """Changeovers of an allocation as the KPI counts them: each group's allocations after its first"""
+    return int(len(records) - len(np.unique(records['group'])))
+
+
+def optimize_allocation(index, demand_keys, qty, capacity, eff, greedy, time_budget=DEFAULT_TIME_BUDGET, started=None):
+    """
+    Solve the allocation as a min-cost flow within time_budget seconds
+    (counted from `started`, so the greedy's own time is included).
+
+    qty and capacity are demand and group capacity before allocation; greedy
+    is the greedy's (records, remaining qty, remaining capacity). That is the
+    warm start, returned unchanged whenever the solver does not finish in
+    time, fails, or its whole-row allocation does no better: both are
+    compared on their per-unit costs plus CHANGEOVER_COST per changeover,
+    and an allocation with more changeovers than the greedy's is not used.
+    Returns the same triple plus a report with the solver status, the LP's
+    bound, both objectives, the gap between them and both changeover counts.
+    """
+    if linprog is None:
+        raise ValueError("The 'optimal' engine requires the 'scipy' package")
+    started = time.perf_counter() if started is None else started
+    greedy_records = greedy[0]
+    model = _Model(index, demand_keys, qty, capacity, eff)
+    greedy_objective = model.objective(greedy_records)
+    status, pair_flow, pool_in, pool_out, objective = model.solve(time_budget - (time.perf_counter() - started))
+
+    report = {
+        'engine': OPTIMAL_ENGINE,
+        'status': status,
+        'variables': model.n_variables,
+        'greedy_objective': greedy_objective,
+        'objective': objective,
+        'gap_pct': None,
+        'greedy_changeovers': _changeovers(greedy_records),
+        'changeovers': None,
+        'used': GREEDY_ENGINE,
+    }
+    result = greedy
+    if status == 'optimal':
+        # The LP's optimum is a bound; its allocation in whole rows is what
+        # competes with the greedy
+        records = model.records(pair_flow, pool_in, pool_out)
+        report['bound'] = objective
+        report['objective'] = model.objective(records)
+        report['gap_pct'] = (greedy_objective - report['objective']) / abs(greedy_objective) * 100 if greedy_objective else 0.0
+        report['changeovers'] = _changeovers(records)
+        if report['objective'] < greedy_objective and report['changeovers'] <= report['greedy_changeovers']:
+            remaining_qty = qty - np.bincount(records['demand'], weights=records['qty'], minlength=len(qty))
+            remaining_cap = capacity - np.bincount(records['group'], weights=records['qty'], minlength=len(capacity))
+            result = (records, remaining_qty, remaining_cap)
+            report['used'] = OPTIMAL_ENGINE
+    report['seconds'] = time.perf_counter() - started
+    return (*result, report)
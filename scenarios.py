@@ -0,0 +1,259 @@
+"""
+What-if scenarios over one parsed plan.
+
+A scenario overrides groupline eff/HC, the shift length or shifts per week,
+or filters the demand, and is planned again from the plan's stored state
+with the plan's engine and coalescing. The demand arrays and the affinity
+index are published once per batch in shared memory, so worker processes
+read them without copying.
+"""
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import logic
+from affinity import AffinityIndex, allocate_affinity
+from allocation import AFFINITY, make_records, allocate_greedy
+from categorical import is_categorical
+from optimize import OPTIMAL_ENGINE, DEFAULT_TIME_BUDGET, optimize_allocation
+
+COMPARED_KPIS = ['cap_utilization', 'model_score', 'changeovers', 'unallocated_qty']
+SCENARIO_KEYS = {'name', 'eff', 'eff_scale', 'hc', 'hc_delta', 'shift_hours', 'shifts_per_week', 'include', 'exclude'}
+# Two shifts a day, six days a week
+MAX_SHIFTS_PER_WEEK = 12
+
+
+class SharedArrays:
+    """Numpy arrays copied into shared memory; handle is what workers need to attach"""
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.handle = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self._blocks.append(block)
+            self.handle[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach(handle):
+    """Map a SharedArrays handle back to arrays; returns (arrays, blocks to close)"""
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in handle.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays, blocks
+
+
+def _group_values(base, overrides, groups, label, combine):
+    values = base.copy()
+    positions = pd.Index(groups)
+    for group, value in (overrides or {}).items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{label} for '{group}' must be a number, got {value!r}")
+        if group == '*':
+            values = combine(values, value)
+            continue
+        pos = positions.get_indexer([group])[0]
+        if pos < 0:
+            raise ValueError(f"Unknown groupline '{group}' in {label}")
+        values[pos] = combine(values[pos], value)
+    return values
+
+
+def _demand_mask(demand_rows, active, include, exclude):
+    mask = active.copy()
+    for rules, keep in ((include, True), (exclude, False)):
+        for col, values in (rules or {}).items():
+            if col not in demand_rows.columns:
+                raise ValueError(f"Cannot filter demand on '{col}'. Use one of: {', '.join(demand_rows.columns)}")
+            values = [str(value) for value in (values if isinstance(values, list) else [values])]
+            # Workbook cells may be numbers where the request has strings;
+            # categorical columns compare their categories, not every row
+            column = demand_rows[col]
+            if is_categorical(column):
+                hits = np.append(column.cat.categories.astype(str).isin(values), False)
+                matches = hits[column.cat.codes.to_numpy()]
+            else:
+                matches = column.astype(str).isin(values).to_numpy()
+            mask &= matches if keep else ~matches
+    return mask
+
+
+def resolve_scenario(state, scenario):
+    """
+    Turn a scenario dict into what a worker plans with: a demand mask plus
+    per-group capacity and efficiency.
+
+    Overrides: eff / hc set a group's value, eff_scale multiplies eff and
+    hc_delta adds to HC (group '*' = every group); shift_hours and
+    shifts_per_week change the hours worked; include / exclude map demand
+    columns to the values to keep or drop.
+    """
+    unknown = set(scenario) - SCENARIO_KEYS
+    if unknown:
+        raise ValueError(f"Unknown scenario option(s): {', '.join(sorted(unknown))}")
+
+    group_stats = state.group_stats
+    groups = group_stats[logic.GROUPLINE_COL].to_numpy()
+    eff = group_stats[logic.EFF_COL].to_numpy(dtype=float)
+    eff = _group_values(eff, scenario.get('eff'), groups, 'eff', lambda old, new: new)
+    eff = _group_values(eff, scenario.get('eff_scale'), groups, 'eff_scale', lambda old, factor: old * factor)
+    hc = group_stats['HC'].to_numpy(dtype=float)
+    hc = _group_values(hc, scenario.get('hc'), groups, 'hc', lambda old, new: new)
+    hc = _group_values(hc, scenario.get('hc_delta'), groups, 'hc_delta', lambda old, delta: np.maximum(old + delta, 0))
+
+    shift_hours = float(scenario.get('shift_hours', logic.SHIFT_HOURS))
+    shifts = int(scenario.get('shifts_per_week', MAX_SHIFTS_PER_WEEK))
+    if shift_hours <= 0 or not 0 < shifts <= MAX_SHIFTS_PER_WEEK:
+        raise ValueError(f"shift_hours must be positive and shifts_per_week between 1 and {MAX_SHIFTS_PER_WEEK}")
+
+    # BASE_OUTPUT_100_EFF is the output of a standard SHIFT_HOURS shift, so
+    # the hourly rate stays put and only the hours worked change
+    base_rate = logic.BASE_OUTPUT_100_EFF / 38 / logic.SHIFT_HOURS
+    hours_per_horizon = shift_hours * shifts * len(state.weeks)
+    capacity = hc * hours_per_horizon * base_rate * (eff / 100)
+
+    mask = _demand_mask(state.demand_rows, state.active, scenario.get('include'), scenario.get('exclude'))
+    return mask, capacity, eff
+
+
+def _task_codes(state):
+    """Per demand row, the task its allocations merge into inside a group when the plan is coalesced"""
+    columns = [logic.STYLE_COL if col == 'Style' else col for col in state.coalesce]
+    return state.demand_rows.groupby(columns, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+
+
+def _prepare(state, scenarios):
+    """Resolve a batch and publish its arrays; runs off the event loop"""
+    resolved = [resolve_scenario(state, scenario) for scenario in scenarios]
+    index = state.affinity_index
+    arrays = {
+        'qty': state.demand_rows[logic.QTY_COL].to_numpy(dtype=float),
+        'keys': state.demand_keys,
+        'ptr': index.ptr,
+        'groups': index.groups,
+        'masks': np.stack([mask for mask, _, _ in resolved]),
+    }
+    if state.coalesce:
+        arrays['tasks'] = _task_codes(state)
+    return resolved, SharedArrays(arrays)
+
+
+def _run_scenario(handle, row, capacity, eff, phase2_strategy, engine=None, time_budget=None):
+    started = time.perf_counter()
+    arrays, blocks = attach(handle)
+    try:
+        mask = arrays['masks'][row]
+        # Highest quantity first, as in a full run
+        order = np.flatnonzero(mask)
+        order = order[np.argsort(-arrays['qty'][order], kind='stable')]
+        demand_qty = arrays['qty'][order]
+        keys = arrays['keys'][order]
+        index = AffinityIndex(None, arrays['ptr'], arrays['groups'])
+
+        qty, remaining_cap = demand_qty.copy(), capacity.copy()
+        records = make_records(*allocate_affinity(index, keys, qty, remaining_cap), AFFINITY)
+        records = np.concatenate([records, allocate_greedy(qty, remaining_cap, strategy=phase2_strategy)])
+        if engine == OPTIMAL_ENGINE:
+            records, qty, remaining_cap, _ = optimize_allocation(
+                index, keys, demand_qty, capacity, eff, (records, qty, remaining_cap),
+                DEFAULT_TIME_BUDGET if time_budget is None else time_budget, started=started
+            )
+        allocation_df = pd.DataFrame({
+            'Group': records['group'],
+            'Allocated_Qty': records['qty'],
+            'Eff': eff[records['group']],
+        })
+        if 'tasks' in arrays:
+            # One task per group and coalesce key, as the plan schedules them
+            allocation_df['Task'] = arrays['tasks'][order][records['demand']]
+            allocation_df = allocation_df.groupby(['Group', 'Task'], sort=False, as_index=False).agg(
+                Allocated_Qty=('Allocated_Qty', 'sum'), Eff=('Eff', 'first'))
+        kpi = logic.plan_kpis(allocation_df, pd.DataFrame({logic.EFF_COL: eff}), demand_qty.sum(), capacity.sum(), qty.sum())
+    finally:
+        # Views into the blocks must go before the blocks can close
+        arrays = mask = keys = index = None
+        for block in blocks:
+            block.close()
+    return kpi, time.perf_counter() - started
+
+
+class ScenarioRunner:
+    """Plans scenario batches in a process pool, one scenario per task"""
+
+    def __init__(self, max_workers=None, max_scenarios=32):
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_scenarios = max_scenarios
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    async def run(self, result, scenarios):
+        """
+        KPIs of the plan itself ('baseline') and of every scenario, planned
+        with the plan's engine and coalescing, with each scenario's
+        difference to the baseline.
+        """
+        state = result.get('state')
+        if state is None:
+            raise ValueError("This plan has no planning state; upload the workbook again")
+        if not isinstance(scenarios, list) or not scenarios:
+            raise ValueError("Send a non-empty list of scenarios")
+        if len(scenarios) > self.max_scenarios:
+            raise ValueError(f"At most {self.max_scenarios} scenarios per request")
+
+        names = ['baseline'] + [str(scenario.get('name') or f"scenario {i}") for i, scenario in enumerate(scenarios, start=1)]
+        resolved, shared = await asyncio.to_thread(_prepare, state, scenarios)
+        try:
+            pool = self._executor()
+            futures = [
+                asyncio.wrap_future(pool.submit(_run_scenario, shared.handle, row, capacity, eff,
+                                                state.phase2_strategy, state.engine, state.time_budget))
+                for row, (_, capacity, eff) in enumerate(resolved)
+            ]
+            outcomes = await asyncio.gather(*futures)
+        finally:
+            shared.close()
+
+        # The baseline is the plan as it stands, replans included
+        baseline = result['kpi']
+        outcomes = [(baseline, 0.0)] + outcomes
+        runs = []
+        for name, overrides, (kpi, seconds) in zip(names, [{}] + scenarios, outcomes):
+            runs.append({
+                'name': name,
+                'overrides': {key: value for key, value in overrides.items() if key != 'name'},
+                'kpi': kpi,
+                'delta': {key: kpi[key] - baseline[key] for key in COMPARED_KPIS},
+                'seconds': seconds,
+            })
+        return {
+            'scenarios': runs,
+            'comparison': {'name': names, **{key: [run['kpi'][key] for run in runs] for key in COMPARED_KPIS}},
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
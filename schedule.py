@@ -0,0 +1,280 @@
+import numpy as np
+import pandas as pd
+
+from categorical import is_categorical, sort_categories, take, concat
+
+PLAN_COLUMNS = [
+    'Week', 'Group', 'Shift', 'Style', 'SELL_STYLE', 'PACK_STYLE', 'SELL_COLOR',
+    'SELL_SIZE', 'SELL_PACK', 'PRIMARY_DC', 'Allocated Qty', 'Shift Capacity', 'HC', 'Eff'
+]
+TASK_COLUMNS = ['Style', 'SELL_STYLE', 'PACK_STYLE', 'SELL_COLOR', 'SELL_SIZE', 'SELL_PACK', 'PRIMARY_DC']
+IDLE_VALUES = {'Style': 'IDLE'}  # every other task column is '-' on idle weeks
+# Coalescing keys (?coalesce=style,color) -> allocation columns; style is always one
+COALESCE_KEYS = {'style': 'Style', 'color': 'SELL_COLOR', 'size': 'SELL_SIZE'}
+MIXED_VALUE = 'MIXED'  # task column value when merged allocations disagree
+
+
+def _group_tasks(allocation_df, n_weeks, shift_hours, base_rate, n_shifts):
+    """
+    Allocations as each group's task list (group name order, allocation order
+    inside a group), with every group's capacity and the weeks each task
+    occupies: tasks start at start[i] and run span[i] weeks inside the horizon.
+    """
+    groups = allocation_df['Group']
+    if is_categorical(groups):
+        groups = sort_categories(groups)
+    group_codes, group_names = pd.factorize(groups, sort=True)
+    group_names = np.asarray(group_names, dtype=object)
+    task_order = np.argsort(group_codes, kind='stable')
+    task_group = group_codes[task_order]
+    n_groups = len(group_names)
+
+    first_task = np.searchsorted(task_group, np.arange(n_groups))
+    hc = allocation_df['HC'].to_numpy(dtype=float)[task_order][first_task]
+    eff = allocation_df['Eff'].to_numpy(dtype=float)[task_order][first_task]
+    cap_per_shift = hc * shift_hours * base_rate * (eff / 100)
+    cap_per_week = cap_per_shift * n_shifts
+
+    # Weeks each task occupies: the first week k with qty - k * cap <= 0.1
+    qty = allocation_df['Allocated_Qty'].to_numpy(dtype=float)[task_order]
+    task_cap = cap_per_week[task_group]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        task_weeks = np.ceil((qty - 0.1) / task_cap)
+    task_weeks = np.where(task_cap > 0, np.clip(task_weeks, 1, n_weeks), n_weeks).astype(np.int64)
+
+    # First week of each task inside its group, clipped to the horizon
+    ends = np.cumsum(task_weeks)
+    group_offset = np.concatenate(([0], ends))[first_task][task_group]
+    start = ends - task_weeks - group_offset
+    span = np.clip(n_weeks - start, 0, task_weeks)
+    return task_order, task_group, group_names, hc, eff, cap_per_shift, qty, task_cap, start, span
+
+
+def scheduled_slots(allocation_df, n_weeks, shift_hours, base_rate, n_shifts):
+    """Group-weeks of the expanded plan that carry a task rather than IDLE"""
+    if allocation_df.empty or n_weeks == 0:
+        return 0
+    span = _group_tasks(allocation_df, n_weeks, shift_hours, base_rate, n_shifts)[-1]
+    return int(span.sum())
+
+
+def expand_shift_plan(allocation_df, weeks, shift_hours, base_rate, shifts):
+    """
+    Expand allocations into the Week x Group x Shift plan.
+
+    Each group works its allocations in order, ONE task per week across all
+    shifts, until the task is done (remaining <= 0.1); weeks left over are
+    IDLE. Rows come out sorted by Week, Group, then shift number; Group,
+    Shift and the task columns are categoricals.
+    """
+    n_weeks = len(weeks)
+    n_shifts = len(shifts)
+    if allocation_df.empty or n_weeks == 0:
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+
+    task_order, task_group, group_names, hc, eff, cap_per_shift, qty, task_cap, start, span = \
+        _group_tasks(allocation_df, n_weeks, shift_hours, base_rate, n_shifts)
+    n_groups = len(group_names)
+
+    # (group, week) slot -> task position, -1 when IDLE
+    slot_task = np.full(n_groups * n_weeks, -1, dtype=np.int64)
+    slot_units = np.zeros(n_groups * n_weeks)
+    task_pos = np.repeat(np.arange(len(task_order)), span)
+    week_in_task = np.arange(len(task_pos)) - np.repeat(np.cumsum(span) - span, span)
+    slot = task_group[task_pos] * n_weeks + start[task_pos] + week_in_task
+    slot_task[slot] = task_pos
+    slot_units[slot] = np.minimum(qty[task_pos] - week_in_task * task_cap[task_pos], task_cap[task_pos])
+
+    # Reorder slots to (week, group) and repeat each across the shifts
+    slot_task = slot_task.reshape(n_groups, n_weeks).T.ravel()
+    slot_units = slot_units.reshape(n_groups, n_weeks).T.ravel()
+    slot_group = np.tile(np.arange(n_groups), n_weeks)
+    slot_week = np.repeat(np.asarray(weeks, dtype=np.int64), n_groups)
+
+    row_task = np.repeat(slot_task, n_shifts)
+    row_group = np.repeat(slot_group, n_shifts)
+    shift_codes = np.tile(np.arange(n_shifts), len(slot_task))
+
+    columns = {
+        'Week': np.repeat(slot_week, n_shifts),
+        'Group': pd.Categorical.from_codes(row_group, group_names),
+        'Shift': pd.Categorical.from_codes(shift_codes, shifts),
+    }
+    # Allocation row of every plan row, -1 when IDLE
+    row_allocation = np.append(task_order, -1)[row_task]
+    for col in TASK_COLUMNS:
+        values = allocation_df[col] if col in allocation_df.columns \
+            else pd.Series('-', index=allocation_df.index, dtype='category')
+        columns[col] = take(values, row_allocation, fill=IDLE_VALUES.get(col, '-'))
+    columns['Allocated Qty'] = np.repeat(slot_units / n_shifts, n_shifts)
+    columns['Shift Capacity'] = cap_per_shift[row_group]
+    columns['HC'] = hc[row_group]
+    columns['Eff'] = eff[row_group]
+
+    return pd.DataFrame(columns, columns=PLAN_COLUMNS)
+
+
+def coalesce_columns(keys):
+    """Allocation columns to coalesce by for ?coalesce= keys (style is always included)"""
+    unknown = [key for key in keys if key not in COALESCE_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown coalesce key(s): {', '.join(unknown)}. Use: {', '.join(COALESCE_KEYS)}")
+    return tuple(column for key, column in COALESCE_KEYS.items() if key == 'style' or key in keys)
+
+
+def coalesce_tasks(allocation_df, by=('Style',)):
+    """
+    Merge each group's allocations that share the `by` columns into one task
+    with their summed quantity, so a style split into many fragments is
+    scheduled as one run instead of one week per fragment.
+
+    Tasks come out in the order expand_shift_plan works them: inside a group
+    a style's tasks are back to back and styles follow their first
+    allocation. Other categorical columns keep their value where the merged
+    allocations agree and are MIXED_VALUE where they do not.
+    """
+    if allocation_df.empty:
+        return allocation_df
+    keys = ['Group', *by]
+    task = allocation_df.groupby(keys, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+    block = allocation_df.groupby(['Group', 'Style'], observed=True, sort=False, dropna=False).ngroup().to_numpy()
+
+    # ngroup numbers by first appearance: order tasks by their style block, then their own first row
+    _, first = np.unique(task, return_index=True)
+    order = np.lexsort((np.arange(len(first)), block[first]))
+
+    # Rows of each task together, for per-task reductions
+    rows = np.argsort(task, kind='stable')
+    bounds = np.searchsorted(task[rows], np.arange(len(first)))
+
+    tasks = allocation_df.iloc[first].reset_index(drop=True)
+    tasks['Allocated_Qty'] = np.add.reduceat(allocation_df['Allocated_Qty'].to_numpy(dtype=float)[rows], bounds)
+    for col in tasks.columns:
+        if col in keys or not is_categorical(tasks[col]):
+            continue
+        codes = allocation_df[col].cat.codes.to_numpy()[rows]
+        uniform = np.minimum.reduceat(codes, bounds) == np.maximum.reduceat(codes, bounds)
+        if not uniform.all():
+            values = tasks[col].cat.add_categories([MIXED_VALUE]) \
+                if MIXED_VALUE not in tasks[col].cat.categories else tasks[col]
+            tasks[col] = values.where(uniform, MIXED_VALUE)
+    return tasks.iloc[order].reset_index(drop=True)
+
+
+def merge_plans(plans, shifts):
+    """Concatenate plan frames in Week, Group, shift order"""
+    plans = [plan for plan in plans if not plan.empty]
+    if not plans:
+        return pd.DataFrame(columns=PLAN_COLUMNS)
+    if len(plans) == 1:
+        return plans[0].reset_index(drop=True)
+    merged = concat(plans, ignore_index=True)
+    groups = merged['Group']
+    if is_categorical(groups):
+        groups = sort_categories(groups)
+    group_codes = pd.factorize(groups, sort=True)[0]
+    shift_pos = pd.Index(shifts).get_indexer(merged['Shift'])
+    order = np.lexsort((shift_pos, group_codes, merged['Week'].to_numpy()))
+    return merged.iloc[order].reset_index(drop=True)
+
+
+def splice_groups(plan_df, group_plan, groups, shifts):
+    """Replace the rows of `groups` in plan_df with group_plan, keeping Week, Group, shift order"""
+    return merge_plans([plan_df[~plan_df['Group'].isin(groups)], group_plan], shifts)
+
+
+def plan_diff(old_rows, new_rows, keys=('Week', 'Group', 'Shift')):
+    """
+    Compare two sets of plan rows slot by slot: slots only in new_rows are
+    'added', only in old_rows 'removed' (keys only), and slots whose values
+    differ are 'changed' (new values).
+    """
+    keys = list(keys)
+    values = [col for col in PLAN_COLUMNS if col not in keys]
+    merged = old_rows.merge(new_rows, on=keys, how='outer', suffixes=('_old', ''), indicator=True)
+    both = merged['_merge'] == 'both'
+    differs = np.zeros(len(merged), dtype=bool)
+    for col in values:
+        old, new = merged[f'{col}_old'], merged[col]
+        if is_categorical(old) or is_categorical(new):
+            # Categoricals only compare over the same categories
+            old, new = old.astype(object), new.astype(object)
+        differs |= ~((old == new) | (old.isna() & new.isna())).to_numpy()
+    return {
+        'added': merged.loc[merged['_merge'] == 'right_only', PLAN_COLUMNS],
+        'removed': merged.loc[merged['_merge'] == 'left_only', keys],
+        'changed': merged.loc[both.to_numpy() & differs, PLAN_COLUMNS],
+    }
+
+
+class PlanIndex:
+    """
+    Row ranges of a detailed plan by week and group, plus the allocated
+    units of every group per week.
+
+    A plan is sorted by Week, Group, then shift, so each (week, group) slot
+    is one block of rows: slot s = week position * len(groups) + group
+    position covers rows starts[s]:starts[s + 1] (through `order` when the
+    plan is not sorted).
+    """
+
+    def __init__(self, plan_df):
+        week_values = plan_df['Week'].to_numpy(dtype=np.int64)
+        groups = plan_df['Group']
+        if is_categorical(groups):
+            groups = sort_categories(groups)
+        group_codes, group_names = pd.factorize(groups, sort=True)
+        self.weeks = np.unique(week_values)
+        self.groups = np.asarray(group_names, dtype=object)
+        n_slots = len(self.weeks) * len(self.groups)
+
+        slots = np.searchsorted(self.weeks, week_values) * len(self.groups) + group_codes
+        self.order = None
+        if np.any(slots[1:] < slots[:-1]):
+            self.order = np.argsort(slots, kind='stable')
+            slots = slots[self.order]
+        self.starts = np.searchsorted(slots, np.arange(n_slots + 1))
+        qty = plan_df['Allocated Qty'].to_numpy(dtype=float)
+        if self.order is not None:
+            qty = qty[self.order]
+        self.allocated = np.bincount(slots, weights=qty, minlength=n_slots).reshape(len(self.weeks), len(self.groups))
+
+    @property
+    def nbytes(self):
+        order = 0 if self.order is None else self.order.nbytes
+        return int(self.weeks.nbytes + self.starts.nbytes + self.allocated.nbytes + order + self.groups.nbytes)
+
+    def rows(self, weeks=None, groups=None, offset=0, limit=None):
+        """
+        Positions of the plan rows in the given weeks and groups (None = all),
+        in plan order, from offset up to limit of them; returns (positions,
+        number of matching rows).
+        """
+        week_mask = np.ones(len(self.weeks), dtype=bool) if weeks is None else np.isin(self.weeks, weeks)
+        group_mask = np.ones(len(self.groups), dtype=bool) if groups is None else np.isin(self.groups, groups)
+        slots = np.flatnonzero(np.outer(week_mask, group_mask).ravel())
+        counts = self.starts[slots + 1] - self.starts[slots]
+        ends = np.cumsum(counts)
+        total = int(ends[-1]) if len(ends) else 0
+        stop = total if limit is None else min(total, offset + limit)
+        if offset >= stop:
+            return np.empty(0, dtype=np.int64), total
+
+        # Only the slots the page touches are expanded to row positions
+        first = np.searchsorted(ends, offset, side='right')
+        last = np.searchsorted(ends, stop - 1, side='right') + 1
+        begin, counts = self.starts[slots[first:last]], counts[first:last]
+        positions = np.repeat(begin - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        skip = offset - (ends[first] - counts[0])
+        positions = positions[skip:skip + stop - offset]
+        if self.order is not None:
+            positions = self.order[positions]
+        return positions, total
+
+    def group_weeks(self):
+        """Allocated units per group and week: {'weeks', 'groups', 'allocated': [[units per week] per group]}"""
+        return {
+            'weeks': self.weeks.tolist(),
+            'groups': self.groups.tolist(),
+            'allocated': self.allocated.T.tolist(),
+        }
@@ -8,6 +8,7 @@ const fileInput = document.getElementById('file-input');
 const uploadContent = document.getElementById('upload-content');
 const loadingContent = document.getElementById('loading-content');
 const errorMessage = document.getElementById('error-message');
+const planError = document.getElementById('plan-error');
 const newPlanBtn = document.getElementById('new-plan-btn');
 const downloadTemplateBtn = document.getElementById('download-template-btn');
 const downloadSummaryBtn = document.getElementById('download-summary-btn');
@@ -19,21 +20,37 @@ const weekScrollRight = document.getElementById('week-scroll-right');
 
 // State
 let planData = null;
+let planId = null;
+// The uploaded workbook, to regenerate the plan when the server no longer has it
+let planFile = null;
+let planRecovery = null;
+let planRecoveries = 0;
+const MAX_PLAN_RECOVERIES = 3;
 let selectedWeek = null;
 let groupWeekData = null;
 
+// Detailed plan rows are paged from the server
+const DETAILED_PAGE_SIZE = 500;
+let detailedRows = { loaded: 0, total: 0, loading: false, request: 0 };
+
 // Charts
 let capacityChart, efficiencyChart, weeklyGroupChart;
 
 // Event Listeners
 downloadTemplateBtn.addEventListener('click', downloadTemplate);
 newPlanBtn.addEventListener('click', resetView);
-downloadSummaryBtn.addEventListener('click', () => downloadCSV(planData.summary, 'allocation_summary.csv'));
-downloadPlanBtn.addEventListener('click', () => downloadCSV(planData.detailed_plan, 'detailed_plan.csv'));
+downloadSummaryBtn.addEventListener('click', () => exportTable('summary', 'allocation_summary.csv'));
+downloadPlanBtn.addEventListener('click', () => exportTable('detailed_plan', 'detailed_plan.csv'));
 fullscreenAllocationBtn.addEventListener('click', () => toggleFullscreen('allocation-section'));
 fullscreenDetailedBtn.addEventListener('click', () => toggleFullscreen('detailed-section'));
 weekScrollLeft.addEventListener('click', () => scrollWeekFilters(-200));
 weekScrollRight.addEventListener('click', () => scrollWeekFilters(200));
+document.querySelector('#detailed-section .table-container').addEventListener('scroll', (e) => {
+    const el = e.target;
+    if (el.scrollTop + el.clientHeight >= el.scrollHeight - 200) {
+        loadDetailedRows(false);
+    }
+});
 
 dropZone.addEventListener('click', () => fileInput.click());
 dropZone.addEventListener('dragover', (e) => {
@@ -61,24 +78,35 @@ function handleFile(file) {
     uploadFile(file);
 }
 
-async function uploadFile(file) {
-    showLoading(true);
+// Thrown when the server no longer has the plan (evicted, or another server process)
+class PlanExpired extends Error {}
+
+async function requestPlan(file, tables) {
     const formData = new FormData();
     formData.append('file', file);
+    const response = await fetch(`${API_URL}/generate-plan?tables=${tables}`, {
+        method: 'POST',
+        body: formData
+    });
 
-    try {
-        const response = await fetch(`${API_URL}/generate-plan`, {
-            method: 'POST',
-            body: formData
-        });
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Failed to generate plan');
+    }
+    return { id: response.headers.get('X-Plan-Id'), data: await response.json() };
+}
 
-        if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.detail || 'Failed to generate plan');
-        }
+async function uploadFile(file) {
+    showLoading(true);
 
-        planData = await response.json();
-        console.log('detailed_plan length:', planData.detailed_plan?.length || 0);
+    try {
+        // The detailed plan is paged in afterwards, so the first paint does not wait for it
+        const plan = await requestPlan(file, 'summary,demand_details');
+        planFile = file;
+        planId = plan.id;
+        planData = plan.data;
+        planRecoveries = 0;
+        hidePlanError();
         renderDashboard(planData);
         switchView('dashboard');
     } catch (error) {
@@ -105,6 +133,28 @@ async function downloadTemplate() {
     }
 }
 
+async function exportTable(table, filename) {
+    try {
+        // Without a plan id, ask for the table itself (the dashboard only holds the summary tables)
+        if (!planId) {
+            const data = table in planData ? planData[table] : (await requestPlan(planFile, table)).data[table];
+            downloadCSV(data, filename);
+            return;
+        }
+        // Stream the CSV from the server-side plan, regenerated first if it expired
+        await planFetch(`rows?limit=1`);
+        const a = document.createElement('a');
+        a.href = `${API_URL}/plans/${planId}/export?table=${table}&format=csv`;
+        a.download = filename;
+        document.body.appendChild(a);
+        a.click();
+        a.remove();
+    } catch (error) {
+        console.error(error);
+        showPlanError(`Could not export the table: ${error.message}`);
+    }
+}
+
 function downloadCSV(data, filename) {
     if (!data || !data.length) return;
 
@@ -138,6 +188,9 @@ function switchView(view) {
 
 function resetView() {
     planData = null;
+    planId = null;
+    planFile = null;
+    hidePlanError();
     fileInput.value = '';
     switchView('hero');
     errorMessage.classList.add('hidden');
@@ -159,18 +212,93 @@ function showError(msg) {
     errorMessage.classList.remove('hidden');
 }
 
+function showPlanError(msg) {
+    planError.textContent = msg;
+    planError.classList.remove('hidden');
+}
+
+function hidePlanError() {
+    planError.classList.add('hidden');
+}
+
+async function regeneratePlan() {
+    // Concurrent callers share one upload; the same workbook gets the same plan id
+    if (!planRecovery) {
+        if (!planFile || planRecoveries >= MAX_PLAN_RECOVERIES) {
+            throw new Error('The plan is no longer available on the server. Upload the workbook again.');
+        }
+        planRecoveries += 1;
+        showPlanError('The plan expired on the server. Regenerating it...');
+        planRecovery = requestPlan(planFile, 'summary')
+            .then(plan => { planId = plan.id; })
+            .finally(() => { planRecovery = null; });
+    }
+    await planRecovery;
+}
+
+async function planFetch(path) {
+    // GET /api/plans/{id}/{path}; when the plan is gone, regenerate it and try once more
+    for (let attempt = 0; ; attempt++) {
+        const response = await fetch(`${API_URL}/plans/${planId}/${path}`);
+        if (response.ok) return response.json();
+        if (response.status !== 404) throw new Error(`Request failed (${response.status})`);
+        if (attempt > 0) throw new PlanExpired('The plan is no longer available on the server. Upload the workbook again.');
+        await regeneratePlan();
+    }
+}
+
 function renderDashboard(data) {
     renderStats(data.kpi);
     renderCharts(data.summary, data.kpi);
 
-    // NEW: build group-week aggregation and initialise weekly group chart
-    prepareGroupWeekData(data.detailed_plan);
-
     renderKPITable(data.kpi);
     renderAllocationTable(data.summary);
     renderDemandTable(data.demand_details);
-    renderTimelineFilters(data.detailed_plan);
-    renderDetailedTable(data.detailed_plan);
+
+    // Weekly chart and detailed plan come from the server-side plan index
+    selectedWeek = null;
+    loadGroupWeekData();
+    loadDetailedRows(true);
+}
+
+async function loadGroupWeekData() {
+    try {
+        const groupWeeks = await planFetch('group-weeks');
+        prepareGroupWeekData(groupWeeks);
+        renderTimelineFilters(groupWeeks.weeks);
+    } catch (error) {
+        console.error(error);
+        showPlanError(`Could not load the weekly totals: ${error.message}`);
+    }
+}
+
+async function loadDetailedRows(reset) {
+    if (reset) {
+        detailedRows = { loaded: 0, total: 0, loading: false, request: detailedRows.request + 1 };
+        document.getElementById('detailed-table-body').innerHTML = '';
+    } else if (detailedRows.loading || detailedRows.loaded >= detailedRows.total) {
+        return;
+    }
+
+    // A newer reset (e.g. another week) makes this response stale
+    const request = detailedRows.request;
+    detailedRows.loading = true;
+    const params = new URLSearchParams({ offset: detailedRows.loaded, limit: DETAILED_PAGE_SIZE });
+    if (selectedWeek !== null) params.append('week', selectedWeek);
+
+    try {
+        const page = await planFetch(`rows?${params}`);
+        if (request !== detailedRows.request) return;
+        detailedRows.total = page.total;
+        detailedRows.loaded += page.rows.length;
+        renderDetailedTable(page.rows);
+        if (!planRecovery) hidePlanError();
+    } catch (error) {
+        console.error(error);
+        if (request === detailedRows.request) showPlanError(`Could not load the detailed plan: ${error.message}`);
+    } finally {
+        if (request === detailedRows.request) detailedRows.loading = false;
+    }
 }
 
 function renderStats(kpi) {
@@ -276,35 +404,22 @@ function renderCharts(summary, kpi) {
 
 /* ---------- NEW: GROUP-WEEK CHART LOGIC ---------- */
 
-function prepareGroupWeekData(detailedPlan) {
-    if (!detailedPlan || !detailedPlan.length) {
+function prepareGroupWeekData(groupWeeks) {
+    if (!groupWeeks || !groupWeeks.groups.length) {
         console.warn('No detailed_plan data for group-week chart');
         return;
     }
 
-    const weeksSet = new Set();
-    const groupsSet = new Set();
+    // Totals arrive aggregated: allocated[g][w] for groups[g], weeks[w]
+    const { weeks, groups, allocated } = groupWeeks;
     const valuesByGroup = {};
-
-    detailedPlan.forEach(item => {
-        const week = item.Week;
-        const group = item.Group;
-        const qty = item['Allocated Qty'] || 0;
-
-        if (week == null || !group) return;
-
-        weeksSet.add(week);
-        groupsSet.add(group);
-
-        if (!valuesByGroup[group]) {
-            valuesByGroup[group] = {};
-        }
-        valuesByGroup[group][week] = (valuesByGroup[group][week] || 0) + qty;
+    groups.forEach((group, g) => {
+        valuesByGroup[group] = {};
+        weeks.forEach((week, w) => {
+            valuesByGroup[group][week] = allocated[g][w];
+        });
     });
 
-    const weeks = Array.from(weeksSet).sort((a, b) => a - b);
-    const groups = Array.from(groupsSet).sort();
-
     console.log('Groups for weekly chart:', groups);
     console.log('Weeks for weekly chart:', weeks);
 
@@ -455,8 +570,7 @@ function scrollWeekFilters(amount) {
     container.scrollBy({ left: amount, behavior: 'smooth' });
 }
 
-function renderTimelineFilters(detailedPlan) {
-    const weeks = [...new Set(detailedPlan.map(item => item.Week))].sort((a, b) => a - b);
+function renderTimelineFilters(weeks) {
     const container = document.getElementById('week-filters');
     container.innerHTML = '';
 
@@ -466,7 +580,7 @@ function renderTimelineFilters(detailedPlan) {
     allBtn.onclick = () => {
         selectedWeek = null;
         updateFilterButtons(allBtn);
-        renderDetailedTable(detailedPlan);
+        loadDetailedRows(true);
     };
     container.appendChild(allBtn);
 
@@ -477,7 +591,7 @@ function renderTimelineFilters(detailedPlan) {
         btn.onclick = () => {
             selectedWeek = week;
             updateFilterButtons(btn);
-            renderDetailedTable(detailedPlan);
+            loadDetailedRows(true);
         };
         container.appendChild(btn);
     });
@@ -488,18 +602,12 @@ function updateFilterButtons(activeBtn) {
     activeBtn.classList.add('active');
 }
 
-function renderDetailedTable(detailedPlan) {
+function renderDetailedTable(rows) {
+    // Appends one page; loadDetailedRows clears the table when the filter changes
     const tbody = document.getElementById('detailed-table-body');
-    tbody.innerHTML = '';
-
-    let filteredData = detailedPlan;
-    if (selectedWeek) {
-        filteredData = detailedPlan.filter(item => item.Week === selectedWeek);
-    }
-
     const fragment = document.createDocumentFragment();
 
-    filteredData.forEach(item => {
+    rows.forEach(item => {
         const tr = document.createElement('tr');
         tr.innerHTML = `
             <td>${item.Week}</td>
@@ -0,0 +1,113 @@
+import json
+
+import pandas as pd
+
+from categorical import is_categorical, map_categories
+from logic import TABLES, INTERNAL_KEYS, plan_records
+
+RECORDS = 'records'
+COLUMNAR = 'columnar'
+ARROW = 'arrow'
+
+MEDIA_TYPES = {
+    RECORDS: 'application/json',
+    COLUMNAR: 'application/vnd.plan.columnar+json',
+    ARROW: 'application/vnd.apache.arrow.stream',
+}
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def negotiate_format(accept=None, fmt=None):
+    """
+    Pick the response format from an explicit ?format= value or the Accept
+    header. Plain records JSON is the default.
+    """
+    if fmt:
+        if fmt not in MEDIA_TYPES:
+            raise UnsupportedFormat(f"Unknown format '{fmt}'. Use one of: {', '.join(MEDIA_TYPES)}")
+        return fmt
+    if accept:
+        for media_range in accept.split(','):
+            media_type = media_range.split(';')[0].strip().lower()
+            for name, candidate in MEDIA_TYPES.items():
+                if media_type == candidate:
+                    return name
+    return RECORDS
+
+
+def _dumps(content):
+    # Same settings as starlette's JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+def _columnar_table(df):
+    """
+    {"length": n, "columns": {name: values}}; string/object columns are
+    dictionary-encoded as {"dictionary": [...], "codes": [...]} (code -1 = null).
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if is_categorical(series) or series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            columns[col] = {'dictionary': uniques.tolist(), 'codes': codes.tolist()}
+        else:
+            columns[col] = series.tolist()
+    return {'length': len(df), 'columns': columns}
+
+
+def encode(result, fmt, table='detailed_plan', tables=TABLES):
+    """
+    Serialise a run_plan result in the requested format; records and
+    columnar carry the tables in tables, Arrow the one table.
+    """
+    if fmt == RECORDS:
+        return _dumps(plan_records(result, tables))
+
+    if fmt == COLUMNAR:
+        content = {'format': COLUMNAR}
+        for key, value in result.items():
+            if key not in INTERNAL_KEYS and (key not in TABLES or key in tables):
+                content[key] = _columnar_table(value) if key in TABLES else value
+        return _dumps(content)
+
+    if fmt == ARROW:
+        return _arrow_stream(result, table)
+
+    raise UnsupportedFormat(f"Unknown format '{fmt}'")
+
+
+def _arrow_stream(result, table):
+    """
+    One table as an Arrow IPC stream, string columns dictionary-encoded. The
+    KPIs and planning horizon travel in the schema metadata.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise UnsupportedFormat("Arrow output requires the 'pyarrow' package")
+    if table not in TABLES:
+        raise UnsupportedFormat(f"Unknown table '{table}'. Use one of: {', '.join(TABLES)}")
+
+    df = result[table].copy()
+    for col in df.columns:
+        if is_categorical(df[col]):
+            # Sizes and the like can mix numbers and text; Arrow needs one type
+            df[col] = map_categories(df[col], lambda values: values.where(values.isna(), values.astype(str)))
+        elif df[col].dtype == object or pd.api.types.is_string_dtype(df[col].dtype):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype('category')
+
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {
+        b'table': table.encode(),
+        b'kpi': _dumps(result['kpi']),
+        b'planning_horizon': str(result['planning_horizon']).encode(),
+    }
+    arrow_table = arrow_table.replace_schema_metadata({**(arrow_table.schema.metadata or {}), **metadata})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table, max_chunksize=64 * 1024)
+    return sink.getvalue().to_pybytes()
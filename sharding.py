@@ -0,0 +1,175 @@
+"""
+Sharded planning: split demand and Output_forecast by a key column (PLANT by
+default) and plan every shard in its own process.
+
+The workbook is parsed once; the shards share the workbook's planning
+horizon and are merged into one plan. Grouplines only take demand of their
+own shard, so a groupline must belong to exactly one key value.
+"""
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import jobs
+import logic
+from categorical import concat
+from metrics import StageTimer, ProgressInstrument
+from schedule import merge_plans, coalesce_columns
+
+DEFAULT_SHARD_KEY = 'PLANT'
+SHARD_STAGES = ['parsing', 'validate', 'shards', 'merge']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _shard_pool():
+    # One pool per process, reused across plans. Each plan worker gets its
+    # share of the CPUs, so concurrent sharded plans do not oversubscribe them
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get('PLAN_SHARD_WORKERS', jobs.cpu_share()))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            # Inside a job worker atexit never runs, so without this the
+            # worker would wait on the idle shard processes forever when it
+            # exits. Ahead of the pool queues' own finalizers (priority 10),
+            # which would otherwise close the queue before the stop messages
+            multiprocessing.util.Finalize(None, _pool.shutdown, kwargs={'cancel_futures': True}, exitpriority=100)
+        return _pool
+
+
+def _shard_values(series):
+    # Workbook cells may mix 90 and '90'
+    return series.map(lambda value: '' if pd.isna(value) else str(value).strip())
+
+
+def _plan_shard(demand_df, output_df, weeks, options):
+    started = time.perf_counter()
+    result = logic.plan_frames(demand_df, output_df, StageTimer(), weeks=weeks, **options)
+    state = result.pop('state')
+    group_stats = state.group_stats
+    records = state.records
+    # Just what the merged KPIs need
+    result['allocations'] = pd.DataFrame({
+        'Group': group_stats[logic.GROUPLINE_COL].to_numpy()[records['group']],
+        'Allocated_Qty': records['qty'],
+        'Eff': group_stats[logic.EFF_COL].to_numpy(dtype=float)[records['group']],
+    })
+    result['groups'] = group_stats[[logic.GROUPLINE_COL, logic.EFF_COL, 'Total_Capacity']]
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def run_sharded_plan(file_content, shard_by=DEFAULT_SHARD_KEY, phase2_strategy='sweep', engine=logic.GREEDY_ENGINE,
+                     time_budget=None, coalesce=None, progress=None, instruments=()):
+    """
+    run_plan, sharded by the shard_by column of both sheets. The result has
+    the same tables and KPIs plus result['shards'], one entry per key value;
+    it keeps no re-planning state.
+    """
+    if progress is not None:
+        instruments = [ProgressInstrument(progress), *instruments]
+    timer = StageTimer(instruments, trace_memory=logic.TRACE_MEMORY)
+
+    timer.start('parsing')
+    demand_df, output_df = logic.read_plan_frames(file_content, extra_columns=[shard_by])
+    timer.rows(len(demand_df) + len(output_df))
+
+    timer.start('validate')
+    if coalesce:
+        coalesce_columns(coalesce)
+    for sheet, df in (('demand_forecast', demand_df), ('Output_forecast', output_df)):
+        if shard_by not in df.columns:
+            raise ValueError(f"Cannot shard by '{shard_by}': no such column in '{sheet}'")
+    if logic.SEW_WEEK_COL not in demand_df.columns:
+        raise ValueError(f"Missing columns in 'demand_forecast': {logic.SEW_WEEK_COL}")
+    weeks = logic.horizon_weeks(demand_df)
+    if not weeks:
+        raise ValueError("Could not determine planning horizon.")
+
+    demand_keys = _shard_values(demand_df[shard_by])
+    output_keys = _shard_values(output_df[shard_by])
+    if logic.GROUPLINE_COL in output_df.columns:
+        groupline = output_df[logic.GROUPLINE_COL].astype(str).str.strip()
+        shared = groupline.groupby(output_keys.to_numpy()).unique().explode().value_counts()
+        shared = shared[shared > 1]
+        if len(shared):
+            raise ValueError(f"Grouplines appear under more than one {shard_by}: {', '.join(map(str, shared.index[:10]))}")
+    keys = sorted(set(demand_keys) | set(output_keys))
+    timer.rows(len(keys))
+
+    timer.start('shards')
+    options = {'phase2_strategy': phase2_strategy, 'engine': engine, 'time_budget': time_budget, 'coalesce': coalesce}
+    pool = _shard_pool()
+    futures = [
+        pool.submit(_plan_shard,
+                    demand_df[(demand_keys == key).to_numpy()].drop(columns=shard_by),
+                    output_df[(output_keys == key).to_numpy()].drop(columns=shard_by),
+                    weeks, options)
+        for key in keys
+    ]
+    shards = [future.result() for future in futures]
+    timer.rows(len(shards))
+
+    timer.start('merge')
+    allocations = pd.concat([shard['allocations'] for shard in shards], ignore_index=True)
+    groups = pd.concat([shard['groups'] for shard in shards], ignore_index=True)
+    kpi = logic.plan_kpis(
+        allocations, groups,
+        sum(shard['kpi']['total_demand'] for shard in shards),
+        groups['Total_Capacity'].sum(),
+        sum(shard['kpi']['unallocated_qty'] for shard in shards),
+    )
+    coalescing = None
+    if coalesce:
+        # Grouplines belong to one shard, so per-group counts add up
+        kpi['changeovers'] = sum(shard['kpi']['changeovers'] for shard in shards)
+        coalescing = merge_coalescing([shard['coalescing'] for shard in shards if 'coalescing' in shard])
+    summary_df = concat([shard['summary'] for shard in shards], ignore_index=True)
+    summary_df = summary_df.sort_values(by='Allocated Units', ascending=False, kind='stable')
+    demand_details = concat([shard['demand_details'] for shard in shards], ignore_index=True)
+    demand_details = demand_details.sort_values(by='Demand Qty', ascending=False, kind='stable').reset_index(drop=True)
+    final_plan_df = merge_plans([shard['detailed_plan'] for shard in shards], logic.SHIFTS_PER_WEEK)
+    timer.rows(len(final_plan_df))
+
+    shard_info = []
+    for key, shard in zip(keys, shards):
+        info = {
+            'key': key,
+            'demand_rows': int(np.sum(demand_keys == key)),
+            'grouplines': len(shard['groups']),
+            'seconds': shard['seconds'],
+            'kpi': shard['kpi'],
+        }
+        if 'optimization' in shard:
+            info['optimization'] = shard['optimization']
+        shard_info.append(info)
+
+    result = {
+        'kpi': kpi,
+        'summary': summary_df,
+        'demand_details': demand_details,
+        'detailed_plan': final_plan_df,
+        'planning_horizon': len(weeks),
+        'shards': shard_info,
+        'timings': timer.finish(),
+    }
+    if coalescing is not None:
+        result['coalescing'] = coalescing
+    return result
+
+
+def merge_coalescing(reports):
+    """One coalescing report for all shards: counts summed, reductions recomputed"""
+    if not reports:
+        return None
+    before = {key: sum(report['before'][key] for report in reports) for key in reports[0]['before']}
+    after = {key: sum(report['after'][key] for report in reports) for key in reports[0]['after']}
+    return {'by': reports[0]['by'], 'before': before, 'after': after, 'reduction_pct': logic.reduction_pct(before, after)}
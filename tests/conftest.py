@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The planner prints diagnostics unless PLAN_DEBUG=0
+os.environ.setdefault('PLAN_DEBUG', '0')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
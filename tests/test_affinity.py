@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import logic
+from affinity import KEY_SEP, build_affinity_index, allocate_affinity, map_size_to_r_code
+from workload import generate_workbook
+
+STYLE_COL, QTY_COL, GROUPLINE_COL, EFF_COL = logic.STYLE_COL, logic.QTY_COL, logic.GROUPLINE_COL, logic.EFF_COL
+
+
+# --- Reference: the original row-by-row implementation ---
+
+def reference_affinity_map(output_df):
+    style_size_group_map = {}
+    for _, row in output_df.iterrows():
+        style = row.get('style construction', '').strip()
+        size = row.get('size', '').strip()
+        group = row[GROUPLINE_COL].strip()
+        output = row.get('output', 0)
+
+        if style and group:
+            key = (style, size) if size else (style, '')
+            if key not in style_size_group_map:
+                style_size_group_map[key] = []
+            style_size_group_map[key].append({'group': group, 'output': output})
+
+    for key in style_size_group_map:
+        style_size_group_map[key] = sorted(style_size_group_map[key], key=lambda x: x['output'], reverse=True)
+    return style_size_group_map
+
+
+def reference_phase1(demand_rows, group_stats, style_size_group_map):
+    """Phase 1 allocations as (demand position, group, amount, group capacity + amount), remaining qty and capacity"""
+    allocations = []
+    demand_queue = demand_rows.to_dict('records')
+    groups_dict = {row[GROUPLINE_COL]: row for row in group_stats.to_dict('records')}
+
+    for position, demand in enumerate(demand_queue):
+        style = demand[STYLE_COL]
+        size = demand.get('SELL_SIZE', '')
+        r_code = map_size_to_r_code(size)
+
+        key = (style, r_code) if r_code else (style, '')
+        preferred_groups = style_size_group_map.get(key, [])
+        if not preferred_groups and r_code:
+            key = (style, '')
+            preferred_groups = style_size_group_map.get(key, [])
+
+        for pref in preferred_groups:
+            group_name = pref['group']
+            if group_name in groups_dict:
+                current_group = groups_dict[group_name]
+                group_cap = current_group['Total_Capacity']
+                demand_qty = demand[QTY_COL]
+
+                if demand_qty <= 0 or group_cap <= 0:
+                    continue
+
+                amount_to_allocate = min(demand_qty, group_cap)
+                allocations.append((position, group_name, amount_to_allocate, group_cap + amount_to_allocate))
+                demand[QTY_COL] -= amount_to_allocate
+                groups_dict[group_name]['Total_Capacity'] -= amount_to_allocate
+
+                if demand[QTY_COL] <= 0.01:
+                    break
+
+    remaining_qty = [demand[QTY_COL] for demand in demand_queue]
+    remaining_cap = [groups_dict[name]['Total_Capacity'] for name in group_stats[GROUPLINE_COL]]
+    return allocations, remaining_qty, remaining_cap
+
+
+# --- Inputs, prepared the way plan_frames prepares them ---
+
+def prepare(demand_df, output_df, weeks=4):
+    demand_rows = demand_df.copy()
+    demand_rows[STYLE_COL] = demand_rows[STYLE_COL].astype(str).str.strip()
+    demand_rows[QTY_COL] = pd.to_numeric(demand_rows[QTY_COL], errors='coerce').fillna(0).astype(float)
+    demand_rows = demand_rows.sort_values(by=QTY_COL, ascending=False, kind='stable').reset_index(drop=True)
+
+    output_df = output_df.copy()
+    output_df[GROUPLINE_COL] = output_df[GROUPLINE_COL].astype(str).str.strip()
+    group_stats = output_df.groupby(GROUPLINE_COL).agg({EFF_COL: 'mean', 'HC': 'mean'}).reset_index()
+    base_rate = logic.BASE_OUTPUT_100_EFF / 38 / logic.SHIFT_HOURS
+    group_stats['Total_Capacity'] = group_stats['HC'] * logic.SHIFT_HOURS * 12 * weeks * base_rate * (group_stats[EFF_COL] / 100)
+    group_stats = group_stats.sort_values(by='Total_Capacity', ascending=False, kind='stable').reset_index(drop=True)
+    return demand_rows, output_df, group_stats
+
+
+def assert_equivalent(demand_rows, output_df, group_stats):
+    group_names = group_stats[GROUPLINE_COL].to_numpy()
+
+    # Affinity index: same keys, same groups in the same rank order
+    expected_map = reference_affinity_map(output_df)
+    index = build_affinity_index(output_df, GROUPLINE_COL, group_names)
+    actual_map = {
+        tuple(key.split(KEY_SEP)): [group_names[g] for g in index.groups[index.ptr[k]:index.ptr[k + 1]]]
+        for k, key in enumerate(index.keys)
+    }
+    assert actual_map == {key: [entry['group'] for entry in groups] for key, groups in expected_map.items()}
+
+    # Phase 1: same allocations in the same order, same remaining demand and capacity
+    expected, expected_qty, expected_cap = reference_phase1(demand_rows, group_stats, expected_map)
+    qty = demand_rows[QTY_COL].to_numpy(dtype=float, copy=True)
+    capacity = group_stats['Total_Capacity'].to_numpy(dtype=float, copy=True)
+    keys = index.lookup(demand_rows[STYLE_COL], demand_rows['SELL_SIZE'])
+    demand_idx, group_idx, amounts, group_caps = allocate_affinity(index, keys, qty, capacity)
+
+    assert demand_idx.tolist() == [allocation[0] for allocation in expected]
+    assert [group_names[g] for g in group_idx] == [allocation[1] for allocation in expected]
+    np.testing.assert_allclose(amounts, [allocation[2] for allocation in expected])
+    np.testing.assert_allclose(group_caps, [allocation[3] for allocation in expected])
+    np.testing.assert_allclose(qty, expected_qty)
+    np.testing.assert_allclose(capacity, expected_cap)
+    return len(expected)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2, 3])
+@pytest.mark.parametrize('overlap, load', [(0.8, 0.9), (0.6, 2.5)])
+def test_matches_reference_on_generated_workbooks(seed, overlap, load):
+    # load > 1: demand exceeds capacity, so groups run dry part-way through demands
+    demand_df, output_df = logic.read_plan_frames(
+        generate_workbook(demand_rows=600, grouplines=20, weeks=4, overlap=overlap, load=load, seed=seed))
+    assert assert_equivalent(*prepare(demand_df, output_df)) > 0
+
+
+def test_matches_reference_on_ties_and_partial_capacity():
+    output_df = pd.DataFrame({
+        GROUPLINE_COL: ['G1', 'G2', 'G3', 'G4', 'G2', 'G3', 'G1', 'G4'],
+        EFF_COL: [100.0, 80.0, 120.0, 90.0, 80.0, 120.0, 100.0, 90.0],
+        'HC': [1, 1, 1, 1, 1, 1, 1, 1],
+        # Equal outputs: ties keep Output_forecast row order
+        'style construction': ['A', 'A', 'A', 'B', 'B', 'B', 'C', 'C'],
+        'size': ['R1', 'R1', 'R1', 'R2', '', 'R2', 'XL', ''],
+        'output': [500, 500, 700, 300, 300, 300, 100, 100],
+    })
+    demand_df = pd.DataFrame({
+        STYLE_COL: [' A ', 'A', 'B', 'B', 'C', 'C', 'D', 'A', 'B'],
+        # Larger than one group's capacity: split over the ranked groups
+        QTY_COL: [2500, 900, 1800, 400, 700, 700, 100, 0, 1200],
+        'SELL_SIZE': [41, '41', 43, np.nan, 'XL', 'M', 41, 41, 'L'],
+    })
+    demand_rows, output_df, group_stats = prepare(demand_df, output_df, weeks=1)
+    demand_rows['SELL_SIZE'] = demand_rows['SELL_SIZE'].astype(object).astype('category')
+    demand_rows[STYLE_COL] = demand_rows[STYLE_COL].astype('category')
+    assert assert_equivalent(demand_rows, output_df, group_stats) > 0
@@ -0,0 +1,195 @@
+import importlib.util
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import logic
+from workload import generate_workbook
+
+WORKBOOK = generate_workbook(demand_rows=200, grouplines=8, weeks=4, seed=5)
+needs_brotli = pytest.mark.skipif(importlib.util.find_spec('brotli') is None, reason="needs the 'brotli' package")
+ENCODINGS = [None, 'gzip', pytest.param('br', marks=needs_brotli)]
+
+
+@pytest.fixture(scope='module')
+def main(tmp_path_factory):
+    os.environ.setdefault('PLAN_WORKERS', '1')
+    os.environ['PLAN_UPLOAD_DIR'] = str(tmp_path_factory.mktemp('uploads'))
+    os.environ['PLAN_DATASET_DIR'] = str(tmp_path_factory.mktemp('datasets'))
+    import main
+    return main
+
+
+@pytest.fixture(scope='module')
+def client(main):
+    with TestClient(main.app) as client:
+        yield client
+
+
+def accept_encoding(encoding):
+    # The test client sends 'gzip, deflate, br' unless told otherwise
+    return encoding or 'identity'
+
+
+def generate_plan(client, params=None, headers=None):
+    return client.post('/api/generate-plan', params=params, headers=headers,
+                       files={'file': ('plan.xlsx', WORKBOOK, 'application/octet-stream')})
+
+
+@pytest.fixture(scope='module')
+def plan_id(client):
+    response = generate_plan(client)
+    assert response.status_code == 200
+    return response.headers['x-plan-id']
+
+
+def columnar_records(table):
+    """A columnar table back as records"""
+    columns = {}
+    for name, values in table['columns'].items():
+        if isinstance(values, dict):
+            values = [values['dictionary'][code] if code >= 0 else None for code in values['codes']]
+        columns[name] = values
+    return [dict(zip(columns, row)) for row in zip(*columns.values())] if columns else [{}] * table['length']
+
+
+def test_plan_round_trips_through_every_format(client, plan_id):
+    pa = pytest.importorskip('pyarrow')
+    records = client.get(f'/api/plans/{plan_id}', params={'format': 'records'}, headers={'accept-encoding': 'identity'})
+    assert records.headers['content-type'] == 'application/json'
+    expected = records.json()
+
+    columnar = client.get(f'/api/plans/{plan_id}', headers={'accept': 'application/vnd.plan.columnar+json'})
+    assert columnar.headers['content-type'] == 'application/vnd.plan.columnar+json'
+    content = columnar.json()
+    assert content.pop('format') == 'columnar'
+    assert content.keys() == expected.keys()
+    for key, value in content.items():
+        assert (columnar_records(value) if key in ('summary', 'demand_details', 'detailed_plan') else value) == expected[key]
+
+    for table in ('summary', 'detailed_plan'):
+        arrow = client.get(f'/api/plans/{plan_id}', params={'format': 'arrow', 'table': table})
+        assert arrow.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+        arrow_table = pa.ipc.open_stream(arrow.content).read_all()
+        metadata = arrow_table.schema.metadata
+        assert json.loads(metadata[b'kpi']) == expected['kpi']
+        assert metadata[b'planning_horizon'].decode() == str(expected['planning_horizon'])
+        # Arrow carries text columns (mixed sizes included) as strings
+        text = {field.name for field in arrow_table.schema if pa.types.is_dictionary(field.type)}
+        as_text = [{key: str(value) if key in text and value is not None else value for key, value in row.items()}
+                   for row in expected[table]]
+        assert arrow_table.to_pylist() == as_text
+
+
+@pytest.mark.parametrize('offered, chosen', [
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip;q=0, identity', None),
+    pytest.param('gzip, br', 'br', marks=needs_brotli),
+    pytest.param('br;q=0, gzip', 'gzip', marks=needs_brotli),
+])
+def test_plan_encoding_follows_accept_encoding(client, plan_id, offered, chosen):
+    identity = client.get(f'/api/plans/{plan_id}', headers={'accept-encoding': 'identity'})
+    response = client.get(f'/api/plans/{plan_id}', headers={'accept-encoding': offered})
+    assert response.status_code == 200
+    assert response.headers.get('content-encoding') == chosen
+    assert 'Accept-Encoding' in response.headers['vary']
+    # The client decodes it back to the same body
+    assert response.content == identity.content
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+@pytest.mark.parametrize('fmt', ['records', 'columnar'])
+def test_plan_if_none_match_returns_304_per_encoding(client, plan_id, fmt, encoding):
+    url, params = f'/api/plans/{plan_id}', {'format': fmt}
+    response = client.get(url, params=params, headers={'accept-encoding': accept_encoding(encoding)})
+    etag = response.headers['etag']
+    assert response.status_code == 200 and etag.startswith(f'"{plan_id}.')
+
+    again = client.get(url, params=params, headers={'accept-encoding': accept_encoding(encoding), 'if-none-match': etag})
+    assert again.status_code == 304
+    assert again.content == b''
+    assert again.headers['etag'] == etag
+
+    # Another encoding is another representation
+    other = 'identity' if encoding else 'gzip'
+    assert client.get(url, params=params, headers={'accept-encoding': other, 'if-none-match': etag}).status_code == 200
+
+    uploaded = generate_plan(client, params=params, headers={'accept-encoding': accept_encoding(encoding), 'if-none-match': etag})
+    assert uploaded.status_code == 304
+    assert uploaded.headers['x-cache'] == 'HIT'
+
+
+def test_page_references_assets_by_fingerprint(client):
+    page = client.get('/', headers={'accept-encoding': 'identity'})
+    assert page.headers['cache-control'] == 'no-cache'
+    for name in ('style.css', 'script.js'):
+        asset = client.get(f'/{name}', headers={'accept-encoding': 'identity'})
+        digest = asset.headers['etag'].strip('"')
+        assert f'"{name}?v={digest}"'.encode() in page.content
+        assert asset.headers['cache-control'] == 'no-cache'
+        versioned = client.get(f'/{name}', params={'v': digest})
+        assert versioned.headers['cache-control'] == 'public, max-age=31536000, immutable'
+        assert versioned.content == asset.content
+        # A stale fingerprint is not cached for a year
+        assert client.get(f'/{name}', params={'v': 'stale'}).headers['cache-control'] == 'no-cache'
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+@pytest.mark.parametrize('path', ['/', '/style.css', '/script.js'])
+def test_asset_if_none_match_returns_304_per_encoding(client, path, encoding):
+    response = client.get(path, headers={'accept-encoding': accept_encoding(encoding)})
+    assert response.status_code == 200
+    assert response.headers.get('content-encoding') == encoding
+    etag = response.headers['etag']
+    assert etag.endswith(f'.{encoding}"') if encoding else '.' not in etag
+
+    again = client.get(path, headers={'accept-encoding': accept_encoding(encoding), 'if-none-match': f'"other", {etag}'})
+    assert again.status_code == 304
+    assert again.content == b''
+    assert again.headers['etag'] == etag
+    other = 'identity' if encoding else 'gzip'
+    assert client.get(path, headers={'accept-encoding': other, 'if-none-match': etag}).status_code == 200
+
+
+def test_export_streams_csv_and_xlsx(client, plan_id):
+    plan = client.get(f'/api/plans/{plan_id}', params={'tables': 'summary'}).json()
+    csv = client.get(f'/api/plans/{plan_id}/export', params={'table': 'summary'})
+    assert csv.headers['content-type'].startswith('text/csv')
+    assert csv.headers['content-disposition'] == 'attachment; filename=summary.csv'
+    assert len(csv.text.splitlines()) == 1 + len(plan['summary'])
+
+    xlsx = client.get(f'/api/plans/{plan_id}/export', params={'format': 'xlsx'})
+    assert xlsx.headers['content-disposition'] == 'attachment; filename=plan.xlsx'
+    assert xlsx.content.startswith(b'PK\x03\x04')
+    assert client.get(f'/api/plans/{plan_id}/export', params={'format': 'pdf'}).status_code == 400
+
+
+def test_metrics_scrape_after_a_plan(client, plan_id):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    for stage in logic.STAGES:
+        assert samples[f'plan_stage_seconds_count{{stage="{stage}"}}'] >= 1
+        assert samples[f'plan_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}'] == samples[f'plan_stage_seconds_count{{stage="{stage}"}}']
+    assert samples['plan_requests_total{cache="miss"}'] >= 1
+    assert samples['plan_cache_entries'] >= 1
+    assert samples['plan_worker_max_rss_bytes'] > 0
+    assert '# TYPE plan_stage_seconds histogram' in response.text
+
+
+def test_template_is_revalidated_by_etag(client):
+    response = client.get('/api/template')
+    assert response.status_code == 200
+    assert response.content.startswith(b'PK\x03\x04')
+    assert response.headers['cache-control'] == 'no-cache'
+    again = client.get('/api/template', headers={'if-none-match': response.headers['etag']})
+    assert again.status_code == 304
+    assert again.content == b''
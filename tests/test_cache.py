@@ -0,0 +1,23 @@
+import shutil
+
+from cache import PlanCache
+
+
+def test_put_keeps_entry_in_memory_when_disk_write_fails(tmp_path, caplog):
+    directory = tmp_path / 'plans'
+    cache = PlanCache(directory=str(directory))
+    # The directory disappears under the cache: the pickle cannot be written
+    shutil.rmtree(directory)
+
+    cache.put('a', {'plan': 1}, 10)
+
+    assert cache.get('a') == {'plan': 1}
+    assert cache.nbytes == 10
+    assert 'could not write a to disk' in caplog.text
+    assert not directory.exists()
+
+
+def test_put_persists_entry_to_disk(tmp_path):
+    PlanCache(directory=str(tmp_path)).put('a', {'plan': 1}, 10)
+
+    assert PlanCache(directory=str(tmp_path)).get('a') == {'plan': 1}
@@ -0,0 +1,87 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import logic
+from categorical import categorize
+from workload import generate_workbook
+
+pytest.importorskip('pyarrow')
+
+from datasets import Dataset, DatasetRegistry, write_dataset  # noqa: E402
+
+
+def dataset_id(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def frames():
+    return {
+        'demand': pd.DataFrame({
+            'QTY': [10, 20, 30, 40],
+            'WEIGHT': [1.5, np.nan, 2.5, 0.0],
+            # Sizes mix numbers and text
+            'SELL_SIZE': [41, 'L', np.nan, 'XL'],
+            'SELL_COLOR': categorize(pd.Series(['RED', None, 'RED', 'BLUE'])),
+            'SIZE_CODE': categorize(pd.Series([10, 'M', 10, None], dtype=object)),
+        }),
+        'output': pd.DataFrame({'GROUP': ['G1', 'G2'], 'HC': [30, 20]}),
+    }
+
+
+def test_write_and_read_round_trip(tmp_path):
+    staged = frames()
+    info = write_dataset(str(tmp_path), 'a' * 64, staged, filename='plan.xlsx')
+    assert info['filename'] == 'plan.xlsx'
+    assert info['sheets']['demand'] == {'rows': 4, 'columns': list(staged['demand'].columns)}
+    assert info['bytes'] > 0
+
+    dataset = Dataset(info['id'], str(tmp_path / info['id']))
+    read, timings = dataset.read({sheet: list(df.columns) for sheet, df in staged.items()})
+    assert set(timings) == set(staged)
+    for sheet, df in staged.items():
+        pd.testing.assert_frame_equal(read[sheet], df)
+
+    # Only the requested columns; unknown ones are skipped
+    read, _ = dataset.read({'demand': ['SELL_SIZE', 'QTY', 'MISSING']})
+    pd.testing.assert_frame_equal(read['demand'], staged['demand'][['SELL_SIZE', 'QTY']])
+    with pytest.raises(ValueError):
+        dataset.read({'nothing': ['QTY']})
+
+
+def test_staging_the_same_id_again_keeps_the_first(tmp_path):
+    first = write_dataset(str(tmp_path), 'b' * 64, frames())
+    again = write_dataset(str(tmp_path), 'b' * 64, {'other': pd.DataFrame({'x': [1]})})
+    assert again['sheets'] == first['sheets']
+    assert os.listdir(tmp_path) == ['b' * 64]
+
+
+def test_plan_of_a_dataset_matches_the_workbook(tmp_path):
+    workbook = generate_workbook(demand_rows=200, grouplines=8, weeks=4, seed=6)
+    registry = DatasetRegistry(str(tmp_path))
+    info = logic.stage_dataset(workbook, registry.directory, dataset_id(workbook))
+    dataset = registry.open(info['id'])
+    assert registry.list()[0]['id'] == info['id']
+
+    for staged, parsed in zip(logic.read_plan_frames(dataset), logic.read_plan_frames(workbook)):
+        pd.testing.assert_frame_equal(staged, parsed, check_dtype=False, check_categorical=False)
+    from_dataset, from_workbook = logic.run_plan(dataset), logic.run_plan(workbook)
+    assert from_dataset['kpi'] == from_workbook['kpi']
+    pd.testing.assert_frame_equal(from_dataset['detailed_plan'], from_workbook['detailed_plan'], check_categorical=False)
+
+
+def test_registry_trims_least_recently_used(tmp_path):
+    registry = DatasetRegistry(str(tmp_path))
+    ids = [c * 64 for c in 'cde']
+    for i in ids:
+        write_dataset(registry.directory, i, frames())
+        os.utime(os.path.join(registry.directory, i, 'dataset.json'), (0, ids.index(i) + 1))
+    registry.open(ids[0])
+    registry.max_bytes = registry.list()[0]['bytes'] * 2
+    assert registry.trim() == [ids[1]]
+    assert sorted(info['id'] for info in registry.list()) == [ids[0], ids[2]]
+    assert registry.open(ids[1]) is None
+    assert registry.open('../' + ids[0]) is None
@@ -0,0 +1,53 @@
+import io
+
+import pandas as pd
+import pytest
+
+import logic
+from exports import EXPORT_TABLES, csv_chunks, xlsx_chunks
+from workload import generate_workbook
+
+
+@pytest.fixture(scope='module')
+def result():
+    return logic.run_plan(generate_workbook(demand_rows=150, grouplines=6, weeks=3, seed=4))
+
+
+def expected_table(df):
+    # What a spreadsheet or CSV reader gets back: plain values, categories included
+    return df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+
+@pytest.mark.parametrize('table', list(EXPORT_TABLES))
+def test_csv_export_has_one_header_and_every_row(result, table):
+    chunks = list(csv_chunks(result[table], chunk_rows=7))
+    assert len(chunks) == 1 + -(-len(result[table]) // 7)
+    body = b''.join(chunks)
+    assert body.count(body.splitlines()[0]) == 1
+
+    exported = pd.read_csv(io.BytesIO(body), keep_default_na=False, na_values=[''])
+    expected = pd.read_csv(io.StringIO(result[table].to_csv(index=False)), keep_default_na=False, na_values=[''])
+    pd.testing.assert_frame_equal(exported, expected)
+    assert list(exported.columns) == list(result[table].columns)
+    assert len(exported) == len(result[table])
+
+
+def test_xlsx_export_has_a_sheet_per_table(result):
+    workbook = pd.read_excel(io.BytesIO(b''.join(xlsx_chunks(result))), sheet_name=None)
+    assert list(workbook) == list(EXPORT_TABLES.values())
+    for table, sheet in EXPORT_TABLES.items():
+        expected = expected_table(result[table])
+        exported = workbook[sheet]
+        assert list(exported.columns) == list(expected.columns)
+        assert len(exported) == len(expected)
+        for col in expected.columns:
+            if pd.api.types.is_numeric_dtype(expected[col]):
+                assert exported[col].to_numpy(dtype=float) == pytest.approx(expected[col].to_numpy(dtype=float), nan_ok=True)
+            else:
+                assert exported[col].astype(str).tolist() == expected[col].astype(str).tolist()
+
+
+def test_xlsx_export_of_one_table(result):
+    workbook = pd.read_excel(io.BytesIO(b''.join(xlsx_chunks(result, ['summary']))), sheet_name=None)
+    assert list(workbook) == [EXPORT_TABLES['summary']]
+    assert len(workbook[EXPORT_TABLES['summary']]) == len(result['summary'])
@@ -0,0 +1,48 @@
+import os
+import threading
+
+import jobs
+
+
+def report_cpu_share(progress=None):
+    return jobs.cpu_share()
+
+
+def test_job_workers_split_the_cpus():
+    manager = jobs.JobManager(max_workers=2)
+    try:
+        job = manager.submit(report_cpu_share, keep_result=True)
+        assert job.future.result(timeout=60) == max(1, (os.cpu_count() or 1) // 2)
+    finally:
+        manager.shutdown()
+
+
+def test_cpu_share_outside_a_job_worker_is_every_cpu():
+    assert jobs.cpu_share() == (os.cpu_count() or 1)
+
+
+def test_active_is_safe_while_jobs_are_registered():
+    manager = jobs.JobManager(keep_finished=8)
+    errors = []
+    stop = threading.Event()
+
+    def count():
+        try:
+            while not stop.is_set():
+                manager.active()
+        except RuntimeError as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=count) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    try:
+        # Registering adds a job and forgets the oldest finished ones
+        for _ in range(20000):
+            manager.finished_job(None)
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert errors == []
+    assert manager.active() == 0
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import logic
+from metrics import StageTimer
+from workload import generate_workbook
+
+pytest.importorskip('scipy')
+
+
+def _plan(demand_df, output_df, engine):
+    return logic.plan_frames(demand_df.copy(), output_df.copy(), StageTimer(), engine=engine)
+
+
+def test_optimal_engine_without_affinity_pairs():
+    # overlap=0: no demand style was ever produced, so the model has no affinity pairs
+    demand_df, output_df = logic.read_plan_frames(generate_workbook(demand_rows=300, grouplines=10, weeks=4, overlap=0, seed=1))
+    result = _plan(demand_df, output_df, logic.OPTIMAL_ENGINE)
+    assert result['optimization']['status'] == 'optimal'
+    assert result['kpi']['total_allocated'] == pytest.approx(_plan(demand_df, output_df, logic.GREEDY_ENGINE)['kpi']['total_allocated'])
+
+
+def test_optimal_engine_without_style_construction_column():
+    demand_df, output_df = logic.read_plan_frames(generate_workbook(demand_rows=300, grouplines=10, weeks=4, seed=2))
+    result = _plan(demand_df, output_df.drop(columns=['style construction']), logic.OPTIMAL_ENGINE)
+    assert result['optimization']['status'] == 'optimal'
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_optimal_engine_never_adds_changeovers(seed):
+    demand_df, output_df = logic.read_plan_frames(generate_workbook(demand_rows=1000, grouplines=30, weeks=6, overlap=0.7, seed=seed))
+    greedy = _plan(demand_df, output_df, logic.GREEDY_ENGINE)
+    optimal = _plan(demand_df, output_df, logic.OPTIMAL_ENGINE)
+    report = optimal['optimization']
+    assert report['greedy_changeovers'] == greedy['kpi']['changeovers']
+    assert report['changeovers'] is not None
+    assert optimal['kpi']['changeovers'] <= greedy['kpi']['changeovers']
+    if report['changeovers'] > report['greedy_changeovers']:
+        assert report['used'] == logic.GREEDY_ENGINE
+
+
+def _split_rows(records):
+    _, counts = np.unique(records['demand'], return_counts=True)
+    return int((counts > 1).sum())
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_optimal_engine_reduces_changeovers_where_greedy_splits(seed):
+    demand_df, output_df = logic.read_plan_frames(generate_workbook(demand_rows=300, grouplines=10, weeks=4, overlap=0.7, load=0.9, seed=seed))
+    greedy = _plan(demand_df, output_df, logic.GREEDY_ENGINE)
+    optimal = _plan(demand_df, output_df, logic.OPTIMAL_ENGINE)
+    greedy_records, records = greedy['state'].records, optimal['state'].records
+    assert _split_rows(greedy_records) > 0
+
+    assert optimal['optimization']['used'] == logic.OPTIMAL_ENGINE
+    assert optimal['kpi']['changeovers'] < greedy['kpi']['changeovers']
+    assert _split_rows(records) < _split_rows(greedy_records)
+    assert optimal['kpi']['total_allocated'] == pytest.approx(greedy['kpi']['total_allocated'])
+    # Within every demand row's quantity and every groupline's capacity
+    state = optimal['state']
+    qty = state.demand_rows[logic.QTY_COL].to_numpy(dtype=float)
+    capacity = state.group_stats['Total_Capacity'].to_numpy(dtype=float)
+    assert (np.bincount(records['demand'], weights=records['qty'], minlength=len(qty)) <= qty + 1e-6).all()
+    assert (np.bincount(records['group'], weights=records['qty'], minlength=len(capacity)) <= capacity + 1e-6).all()
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import logic
+from allocation import allocation_frame
+from schedule import expand_shift_plan, coalesce_tasks
+from workload import generate_workbook
+
+
+@pytest.fixture(scope='module', params=[0.6, 1.3], ids=['underloaded', 'overloaded'])
+def workbook(request):
+    return generate_workbook(demand_rows=600, grouplines=12, weeks=6, load=request.param, seed=3)
+
+
+def assert_consistent(result):
+    """The spliced plan equals a full re-expansion; qty and capacity are conserved"""
+    state = result['state']
+    allocation_df = allocation_frame(state.records, state.demand_rows, state.group_stats,
+                                     logic.STYLE_COL, logic.GROUPLINE_COL, logic.EFF_COL, logic.METADATA_COLS)
+    task_df = coalesce_tasks(allocation_df, state.coalesce) if state.coalesce else allocation_df
+    base_rate = logic.BASE_OUTPUT_100_EFF / 38 / logic.SHIFT_HOURS
+    full = expand_shift_plan(task_df, state.weeks, logic.SHIFT_HOURS, base_rate, logic.SHIFTS_PER_WEEK)
+    pd.testing.assert_frame_equal(result['detailed_plan'].reset_index(drop=True), full.reset_index(drop=True),
+                                  check_dtype=False, check_categorical=False)
+
+    records = state.records
+    qty = state.demand_rows[logic.QTY_COL].to_numpy(dtype=float)
+    allocated = np.bincount(records['demand'], weights=records['qty'], minlength=len(qty))
+    live = state.active & (qty > 0)
+    np.testing.assert_allclose(allocated[live] + state.remaining_qty[live], qty[live])
+    assert (allocated[~state.active] == 0).all()
+
+    capacity = state.group_stats['Total_Capacity'].to_numpy(dtype=float)
+    used = np.bincount(records['group'], weights=records['qty'], minlength=len(capacity))
+    np.testing.assert_allclose(used + state.remaining_cap, capacity)
+    assert (state.remaining_cap > -1e-6).all()
+
+
+def mixed_delta(result):
+    state = result['state']
+    ids = state.demand_ids
+    style = state.demand_rows[logic.STYLE_COL].iloc[5]
+    return {
+        'removed': [int(ids[3])],
+        'changed': [{'id': int(ids[10]), logic.QTY_COL: 5000}, {'id': int(ids[200]), logic.QTY_COL: 1}],
+        'added': [{logic.STYLE_COL: style, logic.QTY_COL: 777, 'SELL_SIZE': 'M', logic.SEW_WEEK_COL: int(state.weeks[1])}],
+    }
+
+
+def test_empty_delta_is_a_no_op(workbook):
+    base = logic.run_plan(workbook)
+    result, diff = logic.replan(base, {})
+    assert diff['allocations']['added'] == [] and diff['allocations']['removed'] == []
+    assert all(not rows for rows in diff['detailed_plan'].values())
+    assert diff['groups'] == []
+    pd.testing.assert_frame_equal(result['detailed_plan'], base['detailed_plan'], check_categorical=False)
+    assert result['kpi'] == base['kpi']
+
+
+def test_spliced_plan_equals_full_expansion(workbook):
+    base = logic.run_plan(workbook)
+    assert_consistent(base)
+    result, diff = logic.replan(base, mixed_delta(base))
+    assert diff['groups']
+    assert_consistent(result)
+    rows = base['state'].demand_rows[logic.QTY_COL]
+    assert result['kpi']['total_demand'] == pytest.approx(
+        base['kpi']['total_demand'] - rows.iloc[3] - rows.iloc[10] + 5000 - rows.iloc[200] + 1 + 777)
+
+
+@pytest.mark.parametrize('coalesce', [None, ('style',)], ids=['plain', 'coalesced'])
+def test_chained_replans_conserve_qty_and_capacity(workbook, coalesce):
+    base = logic.run_plan(workbook, coalesce=coalesce)
+    result, diff = logic.replan(base, mixed_delta(base))
+    assert_consistent(result)
+
+    ids = base['state'].demand_ids
+    result, _ = logic.replan(result, {
+        'removed': diff['demand']['added_ids'],
+        'changed': [{'id': int(ids[11]), 'SELL_COLOR': 'PINK'}, {'id': int(ids[10]), logic.QTY_COL: 0}],
+    })
+    assert_consistent(result)
+    assert len(result['demand_details']) == len(base['demand_details']) - 1
+    if coalesce:
+        assert result['coalescing'] is not None
@@ -0,0 +1,66 @@
+import asyncio
+import importlib.util
+
+import numpy as np
+import pytest
+
+import logic
+from metrics import StageTimer
+from scenarios import ScenarioRunner, _demand_mask
+from workload import generate_workbook
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return logic.read_plan_frames(generate_workbook(demand_rows=300, grouplines=10, weeks=4, overlap=0.7, load=0.9, seed=1))
+
+
+@pytest.fixture(scope='module')
+def runner():
+    runner = ScenarioRunner(max_workers=2)
+    yield runner
+    runner.shutdown()
+
+
+def run(runner, result, scenarios):
+    return asyncio.run(runner.run(result, scenarios))['scenarios']
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'coalesce': ('style', 'color')},
+    pytest.param({'engine': logic.OPTIMAL_ENGINE, 'time_budget': 60},
+                 marks=pytest.mark.skipif(importlib.util.find_spec('scipy') is None, reason="needs the 'scipy' package")),
+], ids=['greedy', 'coalesced', 'optimal'])
+def test_unchanged_scenario_reproduces_the_plan(frames, runner, options):
+    demand_df, output_df = frames
+    result = logic.plan_frames(demand_df.copy(), output_df.copy(), StageTimer(), **options)
+    baseline, unchanged, faster = run(runner, result, [{}, {'eff_scale': {'*': 1.1}}])
+    assert baseline['kpi'] == result['kpi']
+    assert unchanged['kpi'] == pytest.approx(result['kpi'])
+    assert faster['kpi']['cap_utilization'] < baseline['kpi']['cap_utilization']
+    assert faster['delta']['cap_utilization'] == pytest.approx(faster['kpi']['cap_utilization'] - result['kpi']['cap_utilization'])
+
+
+def test_baseline_of_a_replanned_plan_is_the_replanned_plan(frames, runner):
+    demand_df, output_df = frames
+    base = logic.plan_frames(demand_df.copy(), output_df.copy(), StageTimer())
+    ids = base['state'].demand_ids
+    result, _ = logic.replan(base, {'removed': [int(ids[0]), int(ids[1])]})
+    baseline, unchanged = run(runner, result, [{}])
+    assert baseline['kpi'] == result['kpi'] != base['kpi']
+    assert unchanged['kpi']['total_demand'] == pytest.approx(result['kpi']['total_demand'])
+
+
+def test_demand_filters_match_numbers_and_text(frames):
+    demand_df, output_df = frames
+    state = logic.plan_frames(demand_df.copy(), output_df.copy(), StageTimer())['state']
+    sizes = state.demand_rows['SELL_SIZE']
+    size = sizes.dropna().iloc[0]
+    expected = (sizes.astype(str) == str(size)).to_numpy()
+    for value in (size, str(size), [str(size)]):
+        assert (_demand_mask(state.demand_rows, state.active, {'SELL_SIZE': value}, None) == expected).all()
+    assert (_demand_mask(state.demand_rows, state.active, None, {'SELL_SIZE': value}) == ~expected).all()
+    with pytest.raises(ValueError):
+        _demand_mask(state.demand_rows, state.active, {'NO_SUCH_COLUMN': 'x'}, None)
+    assert np.array_equal(_demand_mask(state.demand_rows, state.active, None, None), state.active)
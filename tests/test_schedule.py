@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import logic
+from allocation import allocation_frame
+from categorical import is_categorical
+from metrics import StageTimer
+from schedule import MIXED_VALUE, coalesce_tasks
+from workload import generate_workbook
+
+STYLE_COL, QTY_COL, GROUPLINE_COL, EFF_COL = logic.STYLE_COL, logic.QTY_COL, logic.GROUPLINE_COL, logic.EFF_COL
+SHIFTS_PER_WEEK, SHIFT_HOURS = logic.SHIFTS_PER_WEEK, logic.SHIFT_HOURS
+
+
+# --- Reference: Section 7 of the original process_plan, row by row ---
+
+def reference_detailed_plan(allocation_df, group_names, unique_weeks, base_rate):
+    plan_rows = []
+
+    for group_name in group_names:
+        group_work = allocation_df[allocation_df['Group'] == group_name].copy()
+        if group_work.empty: continue
+
+        hc = group_work.iloc[0]['HC']
+        eff = group_work.iloc[0]['Eff']
+        cap_per_shift = hc * SHIFT_HOURS * base_rate * (eff / 100)
+        cap_per_week = cap_per_shift * 12
+
+        tasks = []
+        for _, row in group_work.iterrows():
+            tasks.append({
+                'Style': row['Style'],
+                'SELL_STYLE': row['SELL_STYLE'],
+                'PACK_STYLE': row['PACK_STYLE'],
+                'SELL_COLOR': row['SELL_COLOR'],
+                'SELL_SIZE': row.get('SELL_SIZE', '-'),
+                'SELL_PACK': row.get('SELL_PACK', '-'),
+                'PRIMARY_DC': row.get('PRIMARY_DC', '-'),
+                'Qty': row['Allocated_Qty']
+            })
+
+        current_task_idx = 0
+        for week in unique_weeks:
+            if current_task_idx >= len(tasks):
+                for shift in SHIFTS_PER_WEEK:
+                    plan_rows.append({
+                        'Week': int(week), 'Group': group_name, 'Shift': shift, 'Style': 'IDLE',
+                        'SELL_STYLE': '-', 'PACK_STYLE': '-', 'SELL_COLOR': '-', 'SELL_SIZE': '-',
+                        'SELL_PACK': '-', 'PRIMARY_DC': '-', 'Allocated Qty': 0.0,
+                        'Shift Capacity': float(cap_per_shift), 'HC': float(hc), 'Eff': float(eff)
+                    })
+                continue
+
+            task = tasks[current_task_idx]
+            units_this_week = min(task['Qty'], cap_per_week)
+            units_per_shift = units_this_week / 12
+            for shift in SHIFTS_PER_WEEK:
+                plan_rows.append({
+                    'Week': int(week), 'Group': group_name, 'Shift': shift, 'Style': task['Style'],
+                    'SELL_STYLE': task['SELL_STYLE'], 'PACK_STYLE': task['PACK_STYLE'],
+                    'SELL_COLOR': task['SELL_COLOR'], 'SELL_SIZE': task['SELL_SIZE'],
+                    'SELL_PACK': task.get('SELL_PACK', '-'), 'PRIMARY_DC': task.get('PRIMARY_DC', '-'),
+                    'Allocated Qty': float(units_per_shift), 'Shift Capacity': float(cap_per_shift),
+                    'HC': float(hc), 'Eff': float(eff)
+                })
+            tasks[current_task_idx]['Qty'] -= units_this_week
+            if tasks[current_task_idx]['Qty'] <= 0.1:
+                current_task_idx += 1
+
+    final_plan_df = pd.DataFrame(plan_rows)
+    final_plan_df['shift_num'] = final_plan_df['Shift'].str.extract(r'(\d+)').astype(int)
+    final_plan_df = final_plan_df.sort_values(by=['Week', 'Group', 'shift_num'], ascending=True)
+    return final_plan_df.drop('shift_num', axis=1).reset_index(drop=True)
+
+
+def workbook_frames():
+    """A small fixed workbook: mixed int/str sizes, missing metadata, demand spilling over several weeks"""
+    output_df = pd.DataFrame({
+        GROUPLINE_COL: ['G-10', 'G-02', 'G-03', 'G-02', 'G-10'],
+        EFF_COL: [110.0, 95.0, 80.0, 95.0, 110.0],
+        'HC': [40, 30, 20, 30, 40],
+        'style construction': ['Boxer', 'Brief', 'Boxer', 'Trunk', 'Trunk'],
+        'size': ['R1', 'R2', '', 'R1', 'R2'],
+        'output': [900, 800, 700, 600, 500],
+    })
+    demand_df = pd.DataFrame({
+        STYLE_COL: ['Boxer', 'Brief', 'Trunk', 'Boxer', 'Vest', 'Trunk', 'Brief'],
+        # 9000 takes G-10 about two weeks
+        QTY_COL: [9000, 2500, 1200, 300, 800, 4000, 0],
+        'SELL_SIZE': [41, 'L', 43, 'M', np.nan, 'XL', 'S'],
+        'SELL_STYLE': ['B1', 'R1', np.nan, 'B2', 'V1', 'T2', 'R2'],
+        'PACK_STYLE': ['B1_1', np.nan, 'T1_1', 'B2_1', 'V1_1', np.nan, 'R2_1'],
+        'SELL_COLOR': ['RED', 'BLUE', np.nan, np.nan, 'GREEN', 'BLACK', 'RED'],
+        logic.SEW_WEEK_COL: [202538, 202538, 202539, 202540, 202541, 202541, 202538],
+    })
+    return demand_df, output_df
+
+
+def assert_matches_reference(demand_df, output_df):
+    result = logic.plan_frames(demand_df.copy(), output_df.copy(), StageTimer())
+    state = result['state']
+    allocation_df = allocation_frame(state.records, state.demand_rows, state.group_stats,
+                                     STYLE_COL, GROUPLINE_COL, EFF_COL, logic.METADATA_COLS)
+    # The original allocation_df held plain object columns
+    allocation_df = allocation_df.astype({col: object for col in allocation_df.columns if is_categorical(allocation_df[col])})
+    expected = reference_detailed_plan(allocation_df, state.group_stats[GROUPLINE_COL].unique(),
+                                       logic.horizon_weeks(demand_df), logic.BASE_OUTPUT_100_EFF / 38 / SHIFT_HOURS)
+
+    actual = result['detailed_plan']
+    actual = actual.astype({col: object for col in actual.columns if is_categorical(actual[col])})
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_dtype=False)
+    return expected
+
+
+def test_detailed_plan_matches_reference_loop():
+    expected = assert_matches_reference(*workbook_frames())
+    # The workbook exercises what it claims to
+    assert expected['SELL_COLOR'].isna().any()
+    assert expected['SELL_SIZE'].map(type).nunique() > 1
+    assert expected.groupby(['Group', 'Style'], dropna=False)['Week'].nunique().max() > 1
+    assert (expected['Style'] == 'IDLE').any()
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_detailed_plan_matches_reference_loop_on_generated_workbooks(seed):
+    assert_matches_reference(*logic.read_plan_frames(generate_workbook(demand_rows=200, grouplines=12, weeks=5, seed=seed)))
+
+
+def test_coalesce_tasks_merges_each_groups_fragments():
+    allocation_df = pd.DataFrame({
+        'Group': pd.Categorical(['A', 'A', 'A', 'B', 'A']),
+        'Style': pd.Categorical(['s1', 's2', 's1', 's1', 's2']),
+        'SELL_COLOR': pd.Categorical(['RED', 'RED', 'BLUE', 'RED', 'RED']),
+        'Allocated_Qty': [10.0, 20.0, 30.0, 40.0, 50.0],
+        'HC': [30.0, 30.0, 30.0, 20.0, 30.0],
+    })
+    tasks = coalesce_tasks(allocation_df, ('Style',))
+    assert tasks[['Group', 'Style']].astype(str).values.tolist() == [['A', 's1'], ['A', 's2'], ['B', 's1']]
+    assert tasks['Allocated_Qty'].tolist() == [40.0, 70.0, 40.0]
+    assert tasks['SELL_COLOR'].astype(str).tolist() == [MIXED_VALUE, 'RED', 'RED']
+    assert tasks['HC'].tolist() == [30.0, 30.0, 20.0]
+
+    # A style's colours stay back to back, in the order they were first allocated
+    tasks = coalesce_tasks(allocation_df, ('Style', 'SELL_COLOR'))
+    assert tasks[['Group', 'Style', 'SELL_COLOR']].astype(str).values.tolist() == [
+        ['A', 's1', 'RED'], ['A', 's1', 'BLUE'], ['A', 's2', 'RED'], ['B', 's1', 'RED']]
+    assert tasks['Allocated_Qty'].tolist() == [10.0, 30.0, 70.0, 40.0]
+
+
+def test_coalesced_plan_cuts_changeovers_and_keeps_allocations():
+    workbook = generate_workbook(demand_rows=400, grouplines=10, weeks=6, seed=2)
+    plain = logic.run_plan(workbook)
+    coalesced = logic.run_plan(workbook, coalesce=('style',))
+    report = coalesced['coalescing']
+    assert report['by'] == ['Style']
+    assert report['before']['changeovers'] == plain['kpi']['changeovers']
+    assert report['after']['changeovers'] == coalesced['kpi']['changeovers'] < plain['kpi']['changeovers']
+    assert coalesced['kpi']['total_allocated'] == pytest.approx(plain['kpi']['total_allocated'])
+
+    plan = coalesced['detailed_plan']
+    assert (plan['Style'] != 'IDLE').sum() == report['after']['scheduled_rows']
+    # Fewer fragments waiting on a week each: more of the allocation fits the horizon
+    assert plan['Allocated Qty'].sum() >= plain['detailed_plan']['Allocated Qty'].sum()
+    assert plan.groupby('Group', observed=True)['Allocated Qty'].sum().le(
+        coalesced['summary'].set_index('Group')['Allocated Units'] + 1e-6).all()
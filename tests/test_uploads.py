@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from uploads import UploadSpool, UploadLimits, NotAWorkbook, NoUpload, UploadTooLarge, ZIP_MAGIC
+
+BOUNDARY = 'plan-test-boundary'
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return UploadSpool(max_bytes=1024 * 1024, directory=str(tmp_path))
+
+
+@pytest.fixture
+def client(spool):
+    app = FastAPI()
+    app.add_middleware(UploadLimits, spool=spool, paths=['/upload'])
+
+    @app.post('/upload')
+    async def upload(request: Request):
+        try:
+            spooled = await spool.spool(request)
+        except (NotAWorkbook, NoUpload) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        with spooled, open(spooled.path, 'rb') as fh:
+            return {'filename': spooled.filename, 'size': spooled.size, 'sha256': hashlib.sha256(fh.read()).hexdigest()}
+
+    return TestClient(app)
+
+
+def multipart_chunks(content, filename='plan.xlsx', chunk_size=4096, fields=()):
+    """A multipart/form-data body in chunks, with form fields ahead of the file"""
+    yield b''.join(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields
+    )
+    yield (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+           'Content-Type: application/octet-stream\r\n\r\n').encode()
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+    yield f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def post(client, chunks):
+    return client.post('/upload', content=chunks, headers={'content-type': f'multipart/form-data; boundary={BOUNDARY}'})
+
+
+def test_file_part_is_written_to_the_spool_as_is(client, tmp_path):
+    content = ZIP_MAGIC + os.urandom(300 * 1024)
+    response = post(client, multipart_chunks(content, fields=[('note', 'x')]))
+    assert response.status_code == 200
+    assert response.json() == {'filename': 'plan.xlsx', 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}
+    assert os.listdir(tmp_path) == []
+
+
+def test_non_zip_is_rejected_from_its_first_chunk(client, tmp_path):
+    # Over raw ASGI, counting what the app reads (the test client sends the body at once)
+    app = client.app
+    chunks = list(multipart_chunks(b'<html>' + b'x' * (512 * 1024)))
+    received = []
+    sent = []
+
+    async def receive():
+        received.append(chunks[len(received)])
+        return {'type': 'http.request', 'body': received[-1], 'more_body': len(received) < len(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/upload', 'raw_path': b'/upload', 'root_path': '',
+        'scheme': 'http', 'query_string': b'', 'server': ('test', 80), 'client': ('test', 1), 'http_version': '1.1',
+        'headers': [(b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode())],
+    }
+    asyncio.run(app(scope, receive, send))
+    assert sent[0]['status'] == 400
+    # The file's first bytes come in the third chunk; the other 128 are never read
+    assert len(received) == 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_non_xlsx_filename_and_missing_file_are_rejected(client, tmp_path):
+    assert post(client, multipart_chunks(ZIP_MAGIC + b'data', filename='plan.csv')).status_code == 400
+    empty = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="note"\r\n\r\nx\r\n--{BOUNDARY}--\r\n'.encode()]
+    assert post(client, iter(empty)).status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_oversize_file_is_rejected_and_removed(client, tmp_path):
+    response = post(client, multipart_chunks(ZIP_MAGIC + b'x' * (2 * 1024 * 1024), chunk_size=64 * 1024))
+    assert response.status_code == 413
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+from fastapi import HTTPException
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+# Every .xlsx is a zip archive: local file header signature
+ZIP_MAGIC = b'PK\x03\x04'
+# Multipart boundaries, part headers and small form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class NotAWorkbook(Exception):
+    pass
+
+
+class TooManyUploads(Exception):
+    pass
+
+
+class NoUpload(Exception):
+    pass
+
+
+NOT_A_WORKBOOK = "Invalid file format. Please upload an Excel file."
+
+
+class SpooledUpload:
+    """
+    An upload copied to a named temp file, so planning workers get a path to
+    memory-map instead of a pickled copy of the bytes. release() deletes the
+    file; it may be called more than once.
+    """
+
+    def __init__(self, path, size, filename=None):
+        self.path = path
+        self.size = size
+        self.filename = filename
+        self._released = False
+
+    def view(self):
+        """The file's bytes as a read-only mmap (close it when done)"""
+        with open(self.path, 'rb') as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class UploadSpool:
+    """
+    Streams uploads to disk, at most max_bytes each, and counts the upload
+    requests in flight in this process (at most max_in_flight).
+
+    Early checks happen in UploadLimits, before the body is read; spool()
+    parses the multipart body as it arrives and writes the file part
+    straight to its temp file, enforcing the exact file size.
+    """
+
+    def __init__(self, max_bytes=100 * 1024 * 1024, max_in_flight=4, directory=None, chunk_size=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_in_flight = max_in_flight
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                raise TooManyUploads(f"Too many uploads in progress (limit {self.max_in_flight})")
+            self._in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def spool(self, request, field='file'):
+        """
+        The `field` file of a multipart/form-data request as a SpooledUpload.
+        The body is not buffered anywhere else: the file part's bytes go to
+        the temp file as they are received (written off the event loop).
+        """
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or b'boundary' not in params:
+            raise NoUpload(f"Expected a multipart/form-data upload with a '{field}' file")
+        writer = _PartWriter(self, field)
+        parser = multipart.MultipartParser(params[b'boundary'], writer.callbacks())
+        try:
+            async for chunk in request.stream():
+                if chunk:
+                    await asyncio.to_thread(parser.write, chunk)
+            parser.finalize()
+            return writer.result()
+        except BaseException:
+            writer.discard()
+            raise
+
+
+class _PartWriter:
+    """python-multipart callbacks writing one file field of the body to a temp file"""
+
+    def __init__(self, spool, field):
+        self.spool = spool
+        self.field = field.encode()
+        self.path = None
+        self.filename = None
+        self.size = 0
+        self._file = None
+        self._writing = False
+        self._header_field = b''
+        self._header_value = b''
+        self._headers = {}
+
+    def callbacks(self):
+        return {
+            'on_part_begin': self._part_begin,
+            'on_header_field': lambda data, start, end: self._append('_header_field', data[start:end]),
+            'on_header_value': lambda data, start, end: self._append('_header_value', data[start:end]),
+            'on_header_end': self._header_end,
+            'on_headers_finished': self._headers_finished,
+            'on_part_data': self._part_data,
+            'on_part_end': self._part_end,
+        }
+
+    def _append(self, name, data):
+        setattr(self, name, getattr(self, name) + data)
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b''
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        self._writing = options.get(b'name') == self.field and self._file is None and b'filename' in options
+        if not self._writing:
+            return
+        self.filename = options[b'filename'].decode('utf-8', 'replace')
+        if not self.filename.endswith('.xlsx'):
+            raise NotAWorkbook(NOT_A_WORKBOOK)
+        fd, self.path = tempfile.mkstemp(suffix='.xlsx', prefix='upload-', dir=self.spool.directory)
+        self._file = os.fdopen(fd, 'wb')
+
+    def _part_data(self, data, start, end):
+        if not self._writing:
+            return
+        chunk = data[start:end]
+        # The first bytes must start a zip archive; a chunk may hold fewer than four
+        if self.size < len(ZIP_MAGIC) and not ZIP_MAGIC[self.size:].startswith(chunk[:len(ZIP_MAGIC) - self.size]):
+            raise NotAWorkbook(NOT_A_WORKBOOK)
+        self.size += len(chunk)
+        if self.size > self.spool.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {self.spool.max_bytes} byte limit")
+        self._file.write(chunk)
+
+    def _part_end(self):
+        if self._writing:
+            self._writing = False
+            self._file.close()
+            if self.size < len(ZIP_MAGIC):
+                raise NotAWorkbook(NOT_A_WORKBOOK)
+
+    def result(self):
+        if self.path is None:
+            raise NoUpload(f"No '{self.field.decode()}' file in the upload")
+        if not self._file.closed:
+            raise NoUpload("The upload ended before its file did")
+        return SpooledUpload(self.path, self.size, self.filename)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class _FileSniffer:
+    """
+    Finds the first file part of a multipart body as it streams in and
+    tells whether its content starts like a zip archive (None until known).
+    Only the body's first MULTIPART_OVERHEAD bytes are looked at.
+    """
+
+    def __init__(self, boundary):
+        self.delimiter = b'--' + boundary
+        self.head = b''
+        self.verdict = None
+
+    def feed(self, chunk):
+        if self.verdict is not None:
+            return self.verdict
+        self.head += chunk
+        position = 0
+        while True:
+            part = self.head.find(self.delimiter, position)
+            headers_end = self.head.find(b'\r\n\r\n', part) if part >= 0 else -1
+            if headers_end < 0:
+                break
+            content = headers_end + 4
+            if b'filename=' in self.head[part:headers_end].lower():
+                if len(self.head) >= content + len(ZIP_MAGIC):
+                    self.verdict = self.head[content:content + len(ZIP_MAGIC)] == ZIP_MAGIC
+                break
+            position = content
+        if self.verdict is None and len(self.head) > MULTIPART_OVERHEAD:
+            # No file part up front: leave the rest to the parser
+            self.verdict = True
+        if self.verdict is not None:
+            self.head = b''
+        return self.verdict
+
+
+class UploadLimits:
+    """
+    ASGI middleware for the upload routes: answers 429 when the spool's
+    in-flight limit is reached and 413 when the declared Content-Length (or
+    the body received so far) is over the size limit, before the multipart
+    body is parsed. A file part that does not start like a zip archive is
+    turned away (400) from the chunk that carries its first bytes.
+    """
+
+    def __init__(self, app, spool, paths):
+        self.app = app
+        self.spool = spool
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.spool.max_bytes + MULTIPART_OVERHEAD
+        headers = dict(scope['headers'])
+        length = headers.get(b'content-length', b'').decode()
+        if length.isdigit() and int(length) > limit:
+            await _reject(send, 413, f"Upload exceeds the {self.spool.max_bytes} byte limit")
+            return
+        try:
+            self.spool.acquire()
+        except TooManyUploads as e:
+            await _reject(send, 429, str(e), [(b'retry-after', b'5')])
+            return
+
+        received = 0
+        _, params = parse_options_header(headers.get(b'content-type', b''))
+        sniffer = _FileSniffer(params[b'boundary']) if b'boundary' in params else None
+
+        async def bounded_receive():
+            # Chunked bodies declare no length: stop reading once past the limit
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                body = message.get('body', b'')
+                received += len(body)
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the {self.spool.max_bytes} byte limit")
+                if sniffer is not None and sniffer.feed(body) is False:
+                    raise HTTPException(status_code=400, detail=NOT_A_WORKBOOK)
+            return message
+
+        try:
+            await self.app(scope, bounded_receive, send)
+        finally:
+            self.spool.release()
+
+
+async def _reject(send, status, detail, headers=()):
+    body = json.dumps({'detail': detail}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    (b'connection', b'close'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})